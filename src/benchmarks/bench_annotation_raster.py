@@ -0,0 +1,70 @@
+"""AnnotationRasterizer on synthetic CAMELYON16 style annotations (_0/_1 tumor,
+_2 exclusions drawn last): timing of the streamed TIFF and of random
+read_region windows, with a consistency check against one fillPoly of the full
+level. Correctness against known masks is covered by tests/test_annotation_raster.py.
+
+Run from src/: python -m benchmarks.bench_annotation_raster
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+import tifffile
+
+from benchmarks.synthetic import make_polygons, write_annotation_xml
+from utils.annotation_raster import SHIFT, AnnotationRasterizer
+
+LABEL_MAP = {'_0': 1, '_1': 1, '_2': 0}
+CONVERSION_ORDER = ['_0', '_1', '_2']
+
+
+def reference_mask(groups, size, downsample):
+    """Independent full level rasterization in conversion order."""
+    mask = np.zeros((size[1] // downsample, size[0] // downsample), dtype=np.uint8)
+    for group in CONVERSION_ORDER:
+        for polygon in groups[group]:
+            points = np.round(polygon / downsample * (1 << SHIFT)).astype(np.int32)
+            cv2.fillPoly(mask, [points], LABEL_MAP[group], lineType=cv2.LINE_8, shift=SHIFT)
+    return mask
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=16384)
+    parser.add_argument('--polygons', type=int, default=40)
+    parser.add_argument('--windows', type=int, default=500)
+    args = parser.parse_args()
+    size = (args.size, args.size)
+
+    groups = {'_0': make_polygons(*size, args.polygons, seed=0),
+              '_1': make_polygons(*size, args.polygons // 4, seed=1),
+              '_2': make_polygons(*size, args.polygons // 4, seed=2)}
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = write_annotation_xml(os.path.join(tmp, 'synthetic.xml'), groups)
+        rasterizer = AnnotationRasterizer(xml_path, LABEL_MAP, CONVERSION_ORDER, size, levels=4)
+
+        start = time.perf_counter()
+        tiff_path = rasterizer.write_tiff(os.path.join(tmp, 'synthetic_mask.tif'))
+        print(f'TIFF written in {time.perf_counter() - start:.2f}s '
+              f'({os.path.getsize(tiff_path) / 1e6:.1f} MB)')
+
+        with tifffile.TiffFile(tiff_path) as tif:
+            for level, page in enumerate(tif.pages):
+                downsample = rasterizer.level_downsamples[level]
+                reference = reference_mask(groups, size, downsample)
+                mismatches = int((page.asarray() != reference).sum())
+                print(f'level {level}: {mismatches} mismatching pixels, '
+                      f'{(reference > 0).mean():.3f} labeled')
+
+        reference = reference_mask(groups, size, 1)
+        mismatches = 0
+        start = time.perf_counter()
+        for _ in range(args.windows):
+            x, y = rng.integers(0, args.size - 256, 2)
+            window = rasterizer.read_region_np((int(x), int(y)), 0, (256, 256))[:, :, 0]
+            mismatches += int((window != reference[y:y + 256, x:x + 256]).sum())
+        print(f'{args.windows} read_region windows in {time.perf_counter() - start:.2f}s, '
+              f'{mismatches} mismatching pixels')
@@ -0,0 +1,52 @@
+"""Tile decodes and wall time of one read_region per patch vs
+BatchedRegionReader, for the WSI and the mask of a synthetic slide.
+
+Run from src/: python -m benchmarks.bench_batched_reads
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+import openslide
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.candidate_index import CandidateIndex
+from utils.patch_generator import PatchGenerator
+from utils.region_reader import BatchedRegionReader, _count, _tiles
+from utils.slide_reader import read_region_np
+
+LOWER_BOUND = np.array([20, 20, 20])
+UPPER_BOUND = np.array([200, 200, 200])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patches_per_bbox', type=int, default=200)
+    parser.add_argument('--patch_size', type=int, default=256)
+    args = parser.parse_args()
+    size = (args.patch_size, args.patch_size)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, mask_path, _, _ = make_synthetic_slide(tmp)
+        generator = PatchGenerator(tmp, tmp, tmp, 16, args.patches_per_bbox, args.patch_size,
+                                   0.2, 0, LOWER_BOUND, UPPER_BOUND, seed=0)
+        _, mask_scaled = generator.read_wsi(mask_path)
+        wsi = openslide.OpenSlide(wsi_path)
+        index = CandidateIndex(mask_scaled, 16, args.patch_size, wsi.dimensions, seed=0)
+        locations = [location for bbox in generator.get_bbox(generator.get_tumor_contours(mask_scaled))
+                     for location in index.sample(bbox, 0.2, args.patches_per_bbox)]
+
+        for name, path in (('wsi', wsi_path), ('mask', mask_path)):
+            slide = openslide.OpenSlide(path)
+            reader = BatchedRegionReader(slide, tile_size=256)
+
+            start = time.perf_counter()
+            for location in locations:
+                read_region_np(slide, location, 0, size)
+            per_patch = time.perf_counter() - start
+            naive_tiles = sum(_count(_tiles((x, y) + size, 256))
+                              for x, y in locations)
+
+            reader.read(locations, size)
+            print(f'{name:>4}: {len(locations)} patches | per patch: {naive_tiles} tiles, '
+                  f'{per_patch:.2f}s | batched: {reader.stats["tiles_spanned"]} tiles in '
+                  f'{reader.stats["reads"]} reads, {reader.stats["seconds"]:.2f}s')
@@ -0,0 +1,61 @@
+"""read_region calls per accepted patch: rejection sampling (get_patches) vs
+the candidate index (get_patches_indexed) on a synthetic slide and mask.
+
+Run from src/: python -m benchmarks.bench_candidate_index
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+import openslide
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+
+LOWER_BOUND = np.array([20, 20, 20])
+UPPER_BOUND = np.array([200, 200, 200])
+
+
+class CountingSlide:
+    """Forwards everything to an OpenSlide handle and counts read_region calls."""
+
+    def __init__(self, slide):
+        self.slide = slide
+        self.reads = 0
+
+    def read_region(self, location, level, size):
+        self.reads += 1
+        return self.slide.read_region(location, level, size)
+
+    def __getattr__(self, name):
+        return getattr(self.slide, name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patches_per_bbox', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, mask_path, _, _ = make_synthetic_slide(tmp)
+        generator = PatchGenerator(tmp, tmp, tmp, 16, args.patches_per_bbox, 256,
+                                   args.threshold, 0, LOWER_BOUND, UPPER_BOUND, seed=0)
+        _, mask_scaled = generator.read_wsi(mask_path)
+        tumor_contours = generator.get_tumor_contours(mask_scaled)
+
+        for name in ('rejection', 'indexed'):
+            wsi = CountingSlide(openslide.OpenSlide(wsi_path))
+            mask = CountingSlide(openslide.OpenSlide(mask_path))
+            start = time.perf_counter()
+            if name == 'rejection':
+                generator.get_patches(wsi, True, 'bench', tumor_contours, mask)
+                # get_patches stops after the first bbox
+                accepted = args.patches_per_bbox
+            else:
+                accepted = generator.get_patches_indexed(
+                    wsi, True, 'bench', tumor_contours, mask_scaled)['accepted']
+            elapsed = time.perf_counter() - start
+            reads = wsi.reads + mask.reads
+            print(f'{name:>9}: {accepted} patches, {reads} read_region calls '
+                  f'({reads / max(accepted, 1):.2f}/patch), {elapsed:.2f}s')
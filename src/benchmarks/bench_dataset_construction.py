@@ -0,0 +1,45 @@
+"""PCAMDataset construction time with normalize set: fitting the stain
+normalizer in every constructor (empty cache) vs loading the cached reference.
+
+Run from src/: python -m benchmarks.bench_dataset_construction
+"""
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import torchvision.transforms as transforms
+
+from benchmarks.bench_pcam_loader import make_pcam_file
+from benchmarks.bench_stain_norm import synthetic_he
+from utils.pcam_dataset import PCAMDataset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=6)
+    args = parser.parse_args()
+
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Lambda(lambda x: x*255.0)
+    ])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pcam_synthetic.h5')
+        make_pcam_file(path, 1024)
+        target_path = os.path.join(tmp, 'norm_better.png')
+        target = synthetic_he(1, size=512)[0].permute(1, 2, 0).byte().numpy()
+        cv2.imwrite(target_path, cv2.cvtColor(target, cv2.COLOR_RGB2BGR))
+
+        for method in ('macenko', 'reinhard'):
+            for label, cache_dir in (('refit', None), ('cached', os.path.join(tmp, method))):
+                times = []
+                for _ in range(args.repeats):
+                    # a fresh folder every time means no cached reference
+                    folder = cache_dir or tempfile.mkdtemp(dir=tmp)
+                    start = time.perf_counter()
+                    PCAMDataset(path, path, transform, normalize=method,
+                                target_path=target_path, norm_cache_dir=folder)
+                    times.append(time.perf_counter() - start)
+                print(f'{method:>8} {label:>6}: {1e3 * sum(times[1:]) / (len(times) - 1):.1f} ms '
+                      f'per construction (first {1e3 * times[0]:.1f} ms)')
@@ -0,0 +1,42 @@
+"""Scaling of ExtractionDriver with the number of workers on synthetic slides.
+
+Run from src/: python -m benchmarks.bench_extraction_driver
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.extraction_driver import ExtractionDriver
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slides', type=int, default=8)
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        slides = []
+        for i in range(args.slides):
+            wsi_path, mask_path, _, _ = make_synthetic_slide(
+                tmp, f'synthetic_{i}', size=(args.size, args.size), seed=i)
+            slides.append({'wsi_path': wsi_path, 'mask_path': mask_path,
+                           'img_idx': str(i), 'is_tumor': True})
+
+        generator_kwargs = dict(image_path=tmp, annotation_path=tmp, mask_path=tmp, mag_factor=16,
+                                patches_per_bbox=50, patch_size=256, tumor_threshold=0.2,
+                                adaptive_quant=0, lower_bound=np.array([20, 20, 20]),
+                                upper_bound=np.array([200, 200, 200]))
+
+        baseline = None
+        workers = 1
+        while workers <= args.max_workers:
+            start = time.perf_counter()
+            ExtractionDriver(generator_kwargs, num_workers=workers, seed=0).run(slides)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f'{workers} workers: {elapsed:.1f}s, speedup {baseline / elapsed:.2f}x\n')
+            workers *= 2
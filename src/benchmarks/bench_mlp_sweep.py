@@ -0,0 +1,43 @@
+"""Serial MLPEvaluator runs vs MLPSweep (stacked members + process pool) over a
+grid of learning rates, betas and batch sizes on synthetic embeddings.
+
+Run from src/: python -m benchmarks.bench_mlp_sweep
+"""
+import argparse
+import time
+import torch
+
+from utils.mlp_evaluator import MLPEvaluator
+from utils.mlp_sweep import MLPSweep, grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=50000)
+    parser.add_argument('--size_z', type=int, default=256)
+    parser.add_argument('--num_epochs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--skip_serial', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    X = torch.randn(args.n, args.size_z)
+    y = (X[:, :4].sum(dim=1) > 0).float().reshape(-1, 1)
+    configs = grid(learning_rate=[1e-2, 1e-3, 3e-4, 1e-4], betas=[(0.9, 0.999), (0.5, 0.999)],
+                   batch_size=[128, 512], num_epochs=[args.num_epochs])
+    device = torch.device('cpu')
+
+    if not args.skip_serial:
+        start = time.perf_counter()
+        for config in configs:
+            evaluator = MLPEvaluator(device, config['batch_size'], config['num_epochs'], args.size_z,
+                                     config['learning_rate'], config['betas'])
+            evaluator.train_mlp(X, y)
+        serial = time.perf_counter() - start
+        print(f'serial: {len(configs)} configs in {serial:.1f} s')
+
+    sweep = MLPSweep(device, num_workers=args.workers, patience=2)
+    start = time.perf_counter()
+    results = sweep.run(X, y, configs)
+    print(f' sweep: {len(configs)} configs in {time.perf_counter() - start:.1f} s')
+    print(results.sort_values('val_loss').to_string(index=False))
@@ -0,0 +1,36 @@
+"""Epoch time of MLPEvaluator.train_mlp: DataLoader over list(zip(X, y)) vs the
+tensor training loop (and torch.compile) on synthetic embeddings.
+
+Run from src/: python -m benchmarks.bench_mlp_training
+"""
+import argparse
+import time
+import torch
+
+from utils.mlp_evaluator import MLPEvaluator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--size_z', type=int, default=512)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--compile', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    X = torch.randn(args.n, args.size_z)
+    y = (X[:, 0] > 0).float().reshape(-1, 1)
+    device = torch.device('cpu')
+
+    runs = [('loader', False, False), ('tensors', True, False)]
+    if args.compile:
+        runs.append(('tensors + compile', True, True))
+    for name, fast, compile in runs:
+        evaluator = MLPEvaluator(device, args.batch_size, 1, args.size_z, 1e-3, (0.9, 0.999),
+                                 compile=compile)
+        start = time.perf_counter()
+        mlp, losses = evaluator.train_mlp(X, y, fast=fast)
+        seconds = time.perf_counter() - start
+        print(f'{name:>18}: epoch {seconds:.2f} s ({args.n / seconds:.0f} rows/s), '
+              f'final loss {losses[-1]:.4f}, accuracy {evaluator.get_mlp_accuracy(mlp, X, y):.4f}')
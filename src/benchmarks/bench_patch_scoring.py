@@ -0,0 +1,62 @@
+"""Per-patch tumor/tissue fractions (as in get_patches) vs the batch scorer.
+
+Run from src/: python -m benchmarks.bench_patch_scoring
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import BACKGROUND_RGB, TISSUE_RGB, blob_mask, make_blobs
+from utils.patch_scoring import tissue_fractions, tumor_fractions
+
+LOWER_BOUND = np.array([20, 20, 20])
+UPPER_BOUND = np.array([200, 200, 200])
+
+
+def extract_tissue(hsv_img):
+    tissue_mask = cv2.inRange(hsv_img, LOWER_BOUND, UPPER_BOUND)
+    image_closed = cv2.morphologyEx(tissue_mask, cv2.MORPH_CLOSE,
+                                    np.ones((20, 20), dtype=np.uint8))
+    return cv2.morphologyEx(image_closed, cv2.MORPH_OPEN, np.ones((5, 5), dtype=np.uint8))
+
+
+def timed(fn, repeats=5):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=256)
+    parser.add_argument('--patch_size', type=int, default=256)
+    args = parser.parse_args()
+    n, size = args.n, args.patch_size
+
+    patches = np.empty((n, size, size, 4), dtype=np.uint8)
+    masks = np.zeros((n, size, size, 4), dtype=np.uint8)
+    for i in range(n):
+        inside = blob_mask(make_blobs(size, size, 2, seed=i), 0, 0, size, size)
+        patches[i] = BACKGROUND_RGB + (255,)
+        patches[i][inside] = TISSUE_RGB + (255,)
+        masks[i][inside] = 255
+    area = size * size
+
+    per_patch, tumor_loop = timed(lambda: np.array(
+        [(m[:, :, 0].sum(axis=0).sum(axis=0)/255)/area for m in masks]))
+    batched, tumor_batch = timed(lambda: tumor_fractions(masks))
+    print(f'tumor : per patch {per_patch * 1e3:.1f} ms, batched {batched * 1e3:.1f} ms, '
+          f'max diff {np.abs(tumor_loop - tumor_batch).max():.2e}')
+
+    per_patch, tissue_loop = timed(lambda: np.array(
+        [(extract_tissue(cv2.cvtColor(p, cv2.COLOR_BGR2HSV)).sum(axis=0).sum(axis=0)/255)/area
+         for p in patches]))
+    batched, tissue_batch = timed(
+        lambda: tissue_fractions(patches, LOWER_BOUND, UPPER_BOUND))
+    no_morph, _ = timed(lambda: tissue_fractions(
+        patches, LOWER_BOUND, UPPER_BOUND, morphology=False))
+    print(f'tissue: per patch {per_patch * 1e3:.1f} ms, batched {batched * 1e3:.1f} ms, '
+          f'batched without morphology {no_morph * 1e3:.1f} ms, '
+          f'max diff {np.abs(tissue_loop - tissue_batch).max():.2e}')
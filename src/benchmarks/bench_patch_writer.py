@@ -0,0 +1,51 @@
+"""End-to-end patches/sec of indexed tumor patch sampling on a synthetic slide
+with each codec, writing inline vs through AsyncPatchSink.
+
+Run from src/: python -m benchmarks.bench_patch_writer
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import openslide
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.patch_sink import AsyncPatchSink, FilePatchSink
+
+LOWER_BOUND = np.array([20, 20, 20])
+UPPER_BOUND = np.array([200, 200, 200])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patches_per_bbox', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, mask_path, _, _ = make_synthetic_slide(tmp)
+        mask = openslide.OpenSlide(mask_path)
+        mag_level = mask.get_best_level_for_downsample(16)
+        tumor_mask = np.array(mask.read_region((0, 0), mag_level, mask.level_dimensions[mag_level]))
+
+        for codec in ('png', 'jpeg', 'webp', 'npy'):
+            for threads in (0, args.threads):
+                out = os.path.join(tmp, f'{codec}_{threads}')
+                generator = PatchGenerator(out, tmp, tmp, 16, args.patches_per_bbox, 256, 0.2, 0,
+                                           LOWER_BOUND, UPPER_BOUND, seed=0)
+                sink = FilePatchSink(generator.patch_pos_path, generator.patch_neg_path, codec,
+                                     compress_level=1 if codec == 'png' else 6)
+                generator.sink = AsyncPatchSink(sink, threads) if threads else sink
+
+                wsi = openslide.OpenSlide(wsi_path)
+                start = time.perf_counter()
+                summary = generator.get_patches_indexed(wsi, True, 'synthetic',
+                                                        generator.get_tumor_contours(tumor_mask),
+                                                        tumor_mask)
+                generator.sink.close()
+                seconds = time.perf_counter() - start
+                written = sum(os.path.getsize(os.path.join(generator.patch_pos_path, name))
+                              for name in os.listdir(generator.patch_pos_path))
+                print(f'{codec:>4}, {threads} threads: {summary["accepted"] / seconds:.0f} patches/s, '
+                      f'{written / max(summary["accepted"], 1) / 1e3:.0f} kB/patch')
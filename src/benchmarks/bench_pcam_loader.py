@@ -0,0 +1,59 @@
+"""Images/sec of PCAMDataset through a DataLoader on a synthetic PCam-shaped
+HDF5 file: per-item random access vs chunk-aligned batches, with and without
+the x cache, across worker counts.
+
+Run from src/: python -m benchmarks.bench_pcam_loader
+"""
+import argparse
+import os
+import tempfile
+import time
+import h5py
+import numpy as np
+from torch.utils.data import DataLoader
+
+from utils.pcam_dataset import ChunkBatchSampler, PCAMDataset
+
+
+def make_pcam_file(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, 'w') as f:
+        x = f.create_dataset('x', shape=(n, 96, 96, 3), dtype=np.uint8,
+                             chunks=(64, 96, 96, 3), compression='gzip')
+        for start in range(0, n, 4096):
+            stop = min(start + 4096, n)
+            x[start:stop] = rng.integers(0, 256, (stop - start, 96, 96, 3), dtype=np.uint8)
+        f.create_dataset('y', data=rng.integers(0, 2, (n, 1, 1, 1), dtype=np.uint8))
+
+
+def images_per_second(loader, max_batches):
+    start = time.perf_counter()
+    count = 0
+    for i, (data, _) in enumerate(loader):
+        count += len(data)
+        if i + 1 == max_batches:
+            break
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=32768)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--max_batches', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pcam_synthetic.h5')
+        make_pcam_file(path, args.n)
+
+        for workers in (0, 2, 4):
+            for cache in (None, 'memmap'):
+                dataset = PCAMDataset(path, path, cache=cache, cache_dir=tmp)
+                random_access = DataLoader(dataset, batch_size=args.batch_size, shuffle=True,
+                                           num_workers=workers)
+                sampler = ChunkBatchSampler(len(dataset), args.batch_size, dataset.chunk_rows, seed=0)
+                chunked = DataLoader(dataset, batch_sampler=sampler, num_workers=workers)
+                print(f'workers={workers} cache={cache}: '
+                      f'shuffled {images_per_second(random_access, args.max_batches):.0f} img/s, '
+                      f'chunk batches {images_per_second(chunked, args.max_batches):.0f} img/s')
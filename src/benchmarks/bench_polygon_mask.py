@@ -0,0 +1,67 @@
+"""Tumor fractions of patch windows read from a mask TIFF (as get_patches does)
+vs PolygonMask answered from the XML polygons, on synthetic annotations.
+
+Run from src/: python -m benchmarks.bench_polygon_mask
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import openslide
+
+from benchmarks.synthetic import make_polygons, write_annotation_xml
+from utils.annotation_raster import AnnotationRasterizer
+from utils.polygon_mask import PolygonMask
+
+CONVERSION_ORDER = ['_0', '_1', '_2']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=32768)
+    parser.add_argument('--polygons', type=int, default=40)
+    parser.add_argument('--windows', type=int, default=2000)
+    parser.add_argument('--patch_size', type=int, default=256)
+    args = parser.parse_args()
+    size = (args.size, args.size)
+    patch = (args.patch_size, args.patch_size)
+
+    groups = {'_0': make_polygons(*size, args.polygons, seed=0),
+              '_1': make_polygons(*size, args.polygons // 4, seed=1),
+              '_2': make_polygons(*size, args.polygons // 4, seed=2)}
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = write_annotation_xml(os.path.join(tmp, 'synthetic.xml'), groups)
+
+        start = time.perf_counter()
+        tiff_path = AnnotationRasterizer(xml_path, {'_0': 255, '_1': 255, '_2': 0}, CONVERSION_ORDER,
+                                         size).write_tiff(os.path.join(tmp, 'synthetic_mask.tif'))
+        print(f'mask TIFF written in {time.perf_counter() - start:.2f}s (step skipped with polygons)')
+
+        start = time.perf_counter()
+        mask = PolygonMask(xml_path, {'_0': 1, '_1': 1, '_2': 0}, CONVERSION_ORDER, size)
+        print(f'PolygonMask built in {time.perf_counter() - start:.3f}s '
+              f'({"STR-tree" if mask.tree is not None else "rasterized fractions, no shapely"})')
+
+        # windows around the annotations, where get_patches samples
+        rng = np.random.default_rng(0)
+        polygons = [p for group in groups.values() for p in group]
+        centers = np.array([polygons[i].mean(0) for i in rng.integers(0, len(polygons), args.windows)])
+        locations = [tuple(int(v) for v in np.clip(c + rng.normal(0, 1500, 2), 0, args.size - args.patch_size))
+                     for c in centers]
+
+        slide = openslide.OpenSlide(tiff_path)
+        start = time.perf_counter()
+        tiff_fractions = []
+        for location in locations:
+            region = np.array(slide.read_region(location, 0, patch))[:, :, 0]
+            tiff_fractions.append((region.sum(axis=0).sum(axis=0) / 255) / (patch[0] * patch[1]))
+        tiff_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        polygon_fractions = mask.fractions(locations, patch)
+        polygon_seconds = time.perf_counter() - start
+
+        difference = np.abs(np.array(tiff_fractions) - polygon_fractions)
+        print(f'mask TIFF: {args.windows / tiff_seconds:.0f} windows/s | polygons: '
+              f'{args.windows / polygon_seconds:.0f} windows/s | fraction difference '
+              f'max {difference.max():.4f}, mean {difference.mean():.5f}')
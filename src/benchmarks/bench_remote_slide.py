@@ -0,0 +1,55 @@
+"""Bytes transferred per accepted patch when sampling a synthetic slide stored
+in a fake S3 through RemoteSlide, vs downloading the WSI and its mask.
+
+Run from src/: python -m benchmarks.bench_remote_slide
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.fake_s3 import FakeS3Client
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.slide_reader import TileCache, level_geometry, read_region_np
+
+BUCKET = 'camelyon-dataset'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=32768)
+    parser.add_argument('--patches_per_bbox', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--coalesce_gap', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, mask_path, _, _ = make_synthetic_slide(tmp, size=(args.size, args.size), levels=6)
+        client = FakeS3Client(latency=args.latency, bandwidth=50 * 1024 * 1024)
+        for path in (wsi_path, mask_path):
+            with open(path, 'rb') as f:
+                client.put(BUCKET, os.path.basename(path), f.read())
+        full_bytes = os.path.getsize(wsi_path) + os.path.getsize(mask_path)
+
+        generator = PatchGenerator(tmp, tmp, tmp, 16, args.patches_per_bbox, 256, 0.2, 0,
+                                   np.array([20, 20, 20]), np.array([200, 200, 200]), seed=0,
+                                   tile_cache=TileCache(256 * 1024 * 1024), s3_client=client)
+
+        start = time.perf_counter()
+        wsi, tissue_mask, _ = generator.read_tissue_mask(f's3://{BUCKET}/{os.path.basename(wsi_path)}')
+        mask = generator.open_slide(f's3://{BUCKET}/{os.path.basename(mask_path)}')
+        mag_level, size, _ = level_geometry(mask, generator.mag_factor)
+        tumor_mask = read_region_np(mask, (0, 0), mag_level, size)
+        header_bytes = client.bytes_sent
+        summary = generator.get_patches_indexed(wsi, True, 'remote', generator.get_tumor_contours(tumor_mask),
+                                                tumor_mask, mask_full_size=mask, verify=True)
+        seconds = time.perf_counter() - start
+
+        accepted = max(summary['accepted'], 1)
+        print(f'full download: {full_bytes / 1e6:.1f} MB ({full_bytes / accepted / 1e3:.1f} kB/patch)')
+        print(f'remote: {client.bytes_sent / 1e6:.1f} MB in {client.calls["get_object"]} ranged GETs '
+              f'({header_bytes / 1e6:.2f} MB headers + low resolution levels), '
+              f'{client.bytes_sent / accepted / 1e3:.1f} kB/patch for {summary["accepted"]} patches, '
+              f'{seconds:.2f}s')
+        print(f'WSI: {wsi.stats}, mask: {mask.stats}')
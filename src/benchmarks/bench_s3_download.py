@@ -0,0 +1,62 @@
+"""Serial download_list_file vs download_list_file_parallel against a local
+fake S3 with simulated latency, plus a resume after a dropped connection.
+
+Run from src/: python -m benchmarks.bench_s3_download
+"""
+import argparse
+import os
+import tempfile
+import time
+from boto3.s3.transfer import TransferConfig
+
+from benchmarks.fake_s3 import FakeS3Client
+from utils.aws_handler import AWSHandler
+
+BUCKET = 'camelyon-dataset'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--file_mb', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    client = FakeS3Client(latency=args.latency, bandwidth=20 * 1024 * 1024)
+    for i in range(args.files):
+        client.put(BUCKET, f'CAMELYON17/images/patient_{i:03d}.tif',
+                   os.urandom(args.file_mb * 1024 * 1024))
+    files = [[key, len(data) / 1024 / 1024] for (_, key), data in client.objects.items()]
+    handler = AWSHandler(None, None, 'eu-west-1', s3_client=client)
+    config = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                            multipart_chunksize=8 * 1024 * 1024, max_concurrency=4)
+    total_mb = args.files * args.file_mb
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        handler.download_list_file(files, BUCKET, tmp + os.sep, 'serial/')
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        handler.download_list_file_parallel(files, BUCKET, tmp + os.sep, 'parallel/',
+                                            max_workers=args.workers, config=config)
+        parallel = time.perf_counter() - start
+        print(f'serial {total_mb / serial:.1f} MB/s, parallel {total_mb / parallel:.1f} MB/s '
+              f'({serial / parallel:.1f}x)')
+
+        # drop the connection halfway through the first file, then resume
+        dropping = FakeS3Client(client.objects, latency=args.latency, fail_after=2)
+        handler.s3_client = dropping
+        try:
+            handler.download_file_resumable(BUCKET, files[0][0], tmp + os.sep, 'resume/',
+                                            config=config)
+        except ConnectionError:
+            pass
+        dropping.fail_after = None
+        sent_before = dropping.bytes_sent
+        handler.download_file_resumable(BUCKET, files[0][0], tmp + os.sep, 'resume/',
+                                        config=config)
+        print(f'resume fetched {(dropping.bytes_sent - sent_before) / 1024 / 1024:.1f} of '
+              f'{args.file_mb} MB after the drop')
+        handler.download_list_file_parallel(files, BUCKET, tmp + os.sep, 'parallel/',
+                                            max_workers=args.workers, config=config)
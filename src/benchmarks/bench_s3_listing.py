@@ -0,0 +1,36 @@
+"""Paginated listing and manifest cache of AWSHandler.list_folders against a
+fake S3 client with more keys than one list_objects_v2 page.
+
+Run from src/: python -m benchmarks.bench_s3_listing
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fake_s3 import FakeS3Client
+from utils.aws_handler import AWSHandler
+
+BUCKET = 'camelyon-dataset'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=2500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    client = FakeS3Client(latency=args.latency, page_size=1000)
+    for i in range(args.keys):
+        client.put(BUCKET, f'CAMELYON17/images/patch_{i:05d}.tif', b'0' * 16)
+    handler = AWSHandler(None, None, 'eu-west-1', s3_client=client)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest_path = os.path.join(tmp, 'manifest.json')
+        for run in ('first', 'repeat'):
+            calls = client.calls['list_objects_v2']
+            start = time.perf_counter()
+            elements = handler.list_folders(BUCKET, 'CAMELYON17/images/',
+                                            manifest_path=manifest_path)
+            elapsed = time.perf_counter() - start
+            print(f'{run:>6} run: {len(elements)}/{args.keys} keys, '
+                  f'{client.calls["list_objects_v2"] - calls} list calls, {elapsed * 1e3:.1f} ms')
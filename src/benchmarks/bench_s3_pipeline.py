@@ -0,0 +1,65 @@
+"""Download-then-extract vs the streaming S3PatchPipeline on synthetic slides
+served by a fake S3 client: time to the first patches and disk usage.
+
+Run from src/: python -m benchmarks.bench_s3_pipeline
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.fake_s3 import FakeS3Client
+from benchmarks.synthetic import make_synthetic_slide
+from utils.aws_handler import AWSHandler
+from utils.extraction_driver import ExtractionDriver
+from utils.s3_pipeline import S3PatchPipeline
+
+BUCKET = 'camelyon-dataset'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slides', type=int, default=6)
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--high_water_mb', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = FakeS3Client(latency=0.05, bandwidth=20 * 1024 * 1024)
+        slides = []
+        for i in range(args.slides):
+            wsi_path, mask_path, _, _ = make_synthetic_slide(os.path.join(tmp, 'source'), f'synthetic_{i}',
+                                                             size=(args.size, args.size), seed=i)
+            for path in (wsi_path, mask_path):
+                with open(path, 'rb') as f:
+                    client.put(BUCKET, 'CAMELYON17/images/' +
+                               os.path.basename(path), f.read())
+            slides.append({'key': f'CAMELYON17/images/synthetic_{i}.tif',
+                           'mask_key': f'CAMELYON17/images/synthetic_{i}_mask.tif',
+                           'img_idx': str(i), 'is_tumor': True})
+
+        handler = AWSHandler(None, None, 'eu-west-1', s3_client=client)
+        out_dir = os.path.join(tmp, 'out')
+        generator_kwargs = dict(image_path=out_dir, annotation_path=out_dir, mask_path=out_dir, mag_factor=16,
+                                patches_per_bbox=20, patch_size=256, tumor_threshold=0.2,
+                                adaptive_quant=0, lower_bound=np.array([20, 20, 20]),
+                                upper_bound=np.array([200, 200, 200]))
+
+        # current flow: download everything, then extract
+        start = time.perf_counter()
+        local = os.path.join(tmp, 'download', '')
+        files = [[s[k]] for s in slides for k in ('key', 'mask_key')]
+        handler.download_list_file_parallel(files, BUCKET, local, max_workers=args.workers)
+        downloaded = time.perf_counter() - start
+        disk_mb = sum(len(d) for d in client.objects.values()) / 1024 ** 2
+        ExtractionDriver(generator_kwargs, num_workers=args.workers).run(
+            [{'wsi_path': local + s['key'].split('/')[-1], 'mask_path': local + s['mask_key'].split('/')[-1],
+              'img_idx': s['img_idx'], 'is_tumor': True} for s in slides])
+        print(f'download then extract: {time.perf_counter() - start:.1f}s, first extraction '
+              f'after {downloaded:.1f}s, {disk_mb:.0f} MB on disk\n')
+
+        pipeline = S3PatchPipeline(handler, BUCKET, os.path.join(tmp, 'stream'), generator_kwargs,
+                                   download_workers=args.workers, extraction_workers=args.workers,
+                                   high_water_bytes=args.high_water_mb * 1024 ** 2)
+        pipeline.run(slides)
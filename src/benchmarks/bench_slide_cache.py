@@ -0,0 +1,39 @@
+"""Time to get a slide ready for sampling (thumbnail, masks, contours, bboxes)
+on a first run vs a re-run served by SlideMetadataCache, on synthetic slides.
+
+Run from src/: python -m benchmarks.bench_slide_cache
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.slide_cache import SlideMetadataCache
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slides', type=int, default=4)
+    parser.add_argument('--size', type=int, default=32768)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        slides = [make_synthetic_slide(tmp, f'synthetic_{i}', size=(args.size, args.size), levels=6,
+                                       seed=i)[:2] for i in range(args.slides)]
+        generator = PatchGenerator(tmp, tmp, tmp, 16, 50, 256, 0.2, 0,
+                                   np.array([20, 20, 20]), np.array([200, 200, 200]), seed=0)
+        cache = SlideMetadataCache(os.path.join(tmp, 'metadata'))
+
+        for run in ('first run', 're-run'):
+            start = time.perf_counter()
+            for wsi_path, mask_path in slides:
+                metadata = cache.get(generator, wsi_path, mask_path)
+            seconds = (time.perf_counter() - start) / args.slides
+            print(f'{run:>9}: {seconds * 1e3:.1f} ms per slide '
+                  f'({len(metadata["tissue_bboxes"])} tissue / {len(metadata["tumor_bboxes"])} tumor bboxes)')
+
+        entry_bytes = sum(os.path.getsize(os.path.join(cache.cache_dir, name))
+                          for name in os.listdir(cache.cache_dir)) / args.slides
+        print(f'cache entry: {entry_bytes / 1e3:.0f} kB per slide')
@@ -0,0 +1,60 @@
+"""Per-image torchstain normalization (as in PCAMDataset) vs the batched
+normalizers: throughput and largest difference on synthetic H&E patches.
+
+Run from src/: python -m benchmarks.bench_stain_norm
+"""
+import argparse
+import time
+import torch
+import torchstain
+
+from utils.stain_norm import BatchMacenkoNormalizer, BatchReinhardNormalizer
+
+
+def synthetic_he(n, size=96, seed=0):
+    """(N, 3, H, W) images in [0, 255] made from random H&E concentrations."""
+    generator = torch.Generator().manual_seed(seed)
+    HE = torch.tensor([[0.65, 0.07], [0.70, 0.99], [0.29, 0.11]])
+    HE = HE + 0.05 * torch.rand(n, 3, 2, generator=generator)
+    C = torch.rand(n, 2, size * size, generator=generator) * 1.5
+    C[:, :, : size * size // 5] = 0  # background
+    images = 240 * torch.exp(-HE @ C)
+    return images.clamp(0, 255).round().reshape(n, 3, size, size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=256)
+    args = parser.parse_args()
+
+    target = synthetic_he(1, seed=1)[0]
+    batch = synthetic_he(args.n)
+
+    for name in ('macenko', 'reinhard'):
+        if name == 'macenko':
+            normalizer = torchstain.normalizers.MacenkoNormalizer(backend='torch')
+        else:
+            normalizer = torchstain.normalizers.ReinhardNormalizer(backend='torch')
+        normalizer.fit(target)
+
+        start = time.perf_counter()
+        per_image = []
+        for image in batch:
+            if name == 'macenko':
+                out, _, _ = normalizer.normalize(I=image, stains=False)
+            else:
+                out = normalizer.normalize(I=image).type(torch.float)/255.0
+            per_image.append(out.permute(2, 0, 1))
+        per_image = torch.stack(per_image).float()
+        per_image_time = time.perf_counter() - start
+
+        batch_normalizer = (BatchMacenkoNormalizer if name == 'macenko' else
+                            BatchReinhardNormalizer).from_normalizer(normalizer)
+        start = time.perf_counter()
+        batched = batch_normalizer(batch).float()
+        batched_time = time.perf_counter() - start
+
+        scale = 1 if name == 'macenko' else 255
+        print(f'{name:>8}: per image {args.n / per_image_time:.0f} img/s, batched '
+              f'{args.n / batched_time:.0f} img/s, max diff '
+              f'{(per_image - batched).abs().max().item() * scale:.1f}/255')
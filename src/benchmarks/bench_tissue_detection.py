@@ -0,0 +1,60 @@
+"""Full-level read_wsi vs tiled read_tissue_mask on a synthetic pyramidal TIFF.
+
+Run from src/: python -m benchmarks.bench_tissue_detection
+Each path runs in a fresh process so the reported peak RSS is its own.
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import make_synthetic_slide
+
+LOWER_BOUND = np.array([20, 20, 20])
+UPPER_BOUND = np.array([200, 200, 200])
+
+
+def _run(mode, wsi_path, mag_factor, tile_size, out_dir):
+    from utils.patch_generator import PatchGenerator
+
+    generator = PatchGenerator(out_dir, out_dir, out_dir, mag_factor, 1, 256, 0.2, 0,
+                               LOWER_BOUND, UPPER_BOUND)
+    start = time.perf_counter()
+    if mode == 'full':
+        _, wsi_scaled = generator.read_wsi(wsi_path)
+        tissue_mask = generator.extract_tissue(
+            cv2.cvtColor(wsi_scaled, cv2.COLOR_BGR2HSV))
+        contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE)
+    else:
+        _, tissue_mask, contours = generator.read_tissue_mask(
+            wsi_path, tile_size=tile_size)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, peak_mb, len(contours), tissue_mask
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=16384)
+    parser.add_argument('--mag_factor', type=int, default=4)
+    parser.add_argument('--tile_size', type=int, default=1024)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, _, _, _ = make_synthetic_slide(
+            tmp, size=(args.size, args.size), levels=6)
+        results = {}
+        for mode in ('full', 'tiled'):
+            with ctx.Pool(1) as pool:
+                results[mode] = pool.apply(
+                    _run, (mode, wsi_path, args.mag_factor, args.tile_size, tmp))
+            elapsed, peak_mb, n_contours, _ = results[mode]
+            print(f'{mode:>5}: {elapsed:.2f}s, peak RSS {peak_mb:.0f} MB, {n_contours} contours')
+
+        same = np.array_equal(results['full'][3], results['tiled'][3])
+        print(f'Tissue masks identical: {same}')
@@ -0,0 +1,46 @@
+"""Tiles/sec of WSIInference on synthetic slides (CPU), with and without the
+prefetching reader thread.
+
+Run from src/: python -m benchmarks.bench_wsi_inference
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+import torch
+import torch.nn as nn
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.wsi_inference import WSIInference
+
+
+def small_cnn():
+    """Stand-in patch classifier with a single probability output."""
+    return nn.Sequential(
+        nn.Conv2d(3, 16, 7, stride=4), nn.ReLU(True),
+        nn.Conv2d(16, 32, 5, stride=4), nn.ReLU(True),
+        nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(32, 1), nn.Sigmoid())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=16384)
+    parser.add_argument('--stride', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=64)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = small_cnn()
+    with tempfile.TemporaryDirectory() as tmp:
+        wsi_path, _, _, _ = make_synthetic_slide(tmp, size=(args.size, args.size))
+        generator = PatchGenerator(tmp, tmp, tmp, 16, 0, 256, 0.2, 0,
+                                   np.array([20, 20, 20]), np.array([200, 200, 200]), seed=0)
+
+        for prefetch in (0, 4):
+            engine = WSIInference(generator, model, torch.device('cpu'), stride=args.stride,
+                                  batch_size=args.batch_size, prefetch=prefetch)
+            summary = engine.run(wsi_path, os.path.join(tmp, f'heatmap_{prefetch}.npy'))
+            print(f'prefetch {prefetch}: {summary["tiles"]} tiles, {summary["tiles_per_sec"]:.1f} tiles/s '
+                  f'(read {summary["read_seconds"]:.2f}s, model {summary["inference_seconds"]:.2f}s), '
+                  f'heatmap {summary["grid_shape"]}')
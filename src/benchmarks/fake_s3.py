@@ -0,0 +1,115 @@
+"""In-memory stand-in for the boto3 S3 client calls used by AWSHandler, with
+simulated request latency and per-stream bandwidth."""
+import hashlib
+import io
+import threading
+import time
+
+
+class FakeS3Client:
+
+    def __init__(self, objects=None, latency=0.05, bandwidth=50 * 1024 * 1024,
+                 page_size=1000, fail_after=None):
+        """
+        Args:
+            objects (dict, optional): {(bucket, key): bytes}. Defaults to None.
+            latency (float, optional): Seconds added to every request. Defaults to 0.05.
+            bandwidth (int, optional): Bytes per second of one response stream. Defaults to 50 MB/s.
+            page_size (int, optional): Keys per list_objects_v2 page. Defaults to 1000.
+            fail_after (int, optional): Raise on the get_object call after this many. Defaults to None.
+        """
+        self.objects = dict(objects or {})
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.fail_after = fail_after
+        self.calls = {'head_object': 0, 'get_object': 0,
+                      'download_file': 0, 'list_objects_v2': 0}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, data):
+        self.objects[(bucket, key)] = data
+
+    def _etag(self, data):
+        return '"' + hashlib.md5(data).hexdigest() + '"'
+
+    def _count(self, name, sent=0):
+        with self.lock:
+            self.calls[name] += 1
+            self.bytes_sent += sent
+            calls = self.calls[name]
+        time.sleep(self.latency + sent / self.bandwidth)
+        return calls
+
+    def head_object(self, Bucket, Key, **kwargs):
+        data = self.objects[(Bucket, Key)]
+        self._count('head_object')
+        return {'ContentLength': len(data), 'ETag': self._etag(data)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        data = self.objects[(Bucket, Key)]
+        if IfMatch is not None and IfMatch != self._etag(data):
+            raise RuntimeError('PreconditionFailed')
+        if Range is not None:
+            start, end = Range.replace('bytes=', '').split('-')
+            end = min(int(end), len(data) - 1) if end else len(data) - 1
+            data = data[int(start):end + 1]
+        calls = self._count('get_object', len(data))
+        if self.fail_after is not None and calls > self.fail_after:
+            raise ConnectionError('Simulated connection drop')
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self._etag(self.objects[(Bucket, Key)])}
+
+    def download_file(self, Bucket, Key, Filename, Config=None, **kwargs):
+        data = self.objects[(Bucket, Key)]
+        self._count('download_file', len(data))
+        with open(Filename, 'wb') as f:
+            f.write(data)
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter='', ContinuationToken=None, **kwargs):
+        self._count('list_objects_v2')
+        keys = sorted(key for bucket, key in self.objects
+                      if bucket == Bucket and key.startswith(Prefix))
+        contents, prefixes = [], []
+        for key in keys:
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                if prefix not in prefixes:
+                    prefixes.append(prefix)
+            else:
+                contents.append(key)
+
+        entries = [('key', key) for key in contents] + [('prefix', p) for p in prefixes]
+        start = int(ContinuationToken or 0)
+        page = entries[start:start + self.page_size]
+        response = {'KeyCount': len(page), 'IsTruncated': start + self.page_size < len(entries)}
+        response['Contents'] = [{'Key': key, 'Size': len(self.objects[(Bucket, key)]),
+                                 'ETag': self._etag(self.objects[(Bucket, key)]),
+                                 'LastModified': '2026-01-01T00:00:00Z'}
+                                for kind, key in page if kind == 'key']
+        response['CommonPrefixes'] = [{'Prefix': p} for kind, p in page if kind == 'prefix']
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + self.page_size)
+        return response
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'list_objects_v2'
+        return _FakePaginator(self)
+
+
+class _FakePaginator:
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            if token is not None:
+                kwargs['ContinuationToken'] = token
+            response = self.client.list_objects_v2(**kwargs)
+            yield response
+            if not response['IsTruncated']:
+                break
+            token = response['NextContinuationToken']
@@ -0,0 +1,116 @@
+"""Synthetic pyramidal slides used by the benchmarks. Tissue and tumor
+regions are ellipses, so every level can be generated tile by tile without
+holding the full slide in memory."""
+import os
+import numpy as np
+import tifffile
+
+TISSUE_RGB = (200, 120, 180)
+BACKGROUND_RGB = (240, 240, 240)
+
+
+def make_blobs(width, height, n_blobs, seed=0):
+    """Random ellipses (cx, cy, rx, ry) in level 0 coordinates."""
+    rng = np.random.default_rng(seed)
+    side = min(width, height)
+    cx = rng.uniform(0.15, 0.85, n_blobs) * width
+    cy = rng.uniform(0.15, 0.85, n_blobs) * height
+    rx = rng.uniform(0.04, 0.12, n_blobs) * side
+    ry = rng.uniform(0.04, 0.12, n_blobs) * side
+    return np.stack([cx, cy, rx, ry], axis=1)
+
+
+def blob_mask(blobs, x0, y0, width, height, scale=1):
+    """Boolean mask of the ellipses over a window given in level coordinates."""
+    ys, xs = np.mgrid[y0:y0 + height, x0:x0 + width].astype(np.float32)
+    xs = (xs + 0.5) * scale
+    ys = (ys + 0.5) * scale
+    inside = np.zeros((height, width), dtype=bool)
+    for cx, cy, rx, ry in blobs:
+        inside |= ((xs - cx) / rx) ** 2 + ((ys - cy) / ry) ** 2 <= 1
+    return inside
+
+
+def _tiles(blobs, width, height, tile_size, scale, fill, background, noise, seed):
+    for ty in range(0, height, tile_size):
+        for tx in range(0, width, tile_size):
+            inside = blob_mask(blobs, tx, ty, tile_size, tile_size, scale)
+            tile = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+            tile[:] = background
+            tile[inside] = fill
+            if noise:
+                rng = np.random.default_rng((seed, scale, tx, ty))
+                jitter = rng.integers(-noise, noise + 1, tile.shape)
+                tile = np.clip(tile.astype(np.int16) + jitter,
+                               0, 255).astype(np.uint8)
+            yield tile
+
+
+def write_slide(path, blobs, size, levels=5, tile_size=256, fill=TISSUE_RGB,
+                background=BACKGROUND_RGB, noise=10, compression='zlib', seed=0):
+    """Writes a tiled TIFF with levels as successive directories (the generic
+    TIFF layout OpenSlide understands). size must be divisible by 2**levels."""
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        for level in range(levels):
+            scale = 2 ** level
+            width, height = size[0] // scale, size[1] // scale
+            tif.write(_tiles(blobs, width, height, tile_size, scale, fill, background, noise, seed),
+                      shape=(height, width, 3), dtype=np.uint8, tile=(tile_size, tile_size),
+                      photometric='rgb', compression=compression,
+                      subfiletype=1 if level else 0, metadata=None)
+    return path
+
+
+def make_synthetic_slide(directory, name='synthetic_0', size=(16384, 16384), levels=5,
+                         tile_size=256, n_blobs=8, n_tumor=3, seed=0):
+    """Writes a WSI and its tumor mask (first n_tumor blobs, 255 on tumor).
+
+    Returns:
+        wsi_path, mask_path, blobs, tumor_blobs
+    """
+    os.makedirs(directory, exist_ok=True)
+    blobs = make_blobs(size[0], size[1], n_blobs, seed)
+    tumor_blobs = blobs[:n_tumor] * np.array([1, 1, 0.5, 0.5])
+
+    wsi_path = write_slide(os.path.join(directory, f'{name}.tif'), blobs, size,
+                           levels, tile_size, seed=seed)
+    mask_path = write_slide(os.path.join(directory, f'{name}_mask.tif'), tumor_blobs, size,
+                            levels, tile_size, fill=(255, 255, 255), background=(0, 0, 0),
+                            noise=0, seed=seed)
+    return wsi_path, mask_path, blobs, tumor_blobs
+
+
+def make_polygons(width, height, n_polygons, n_vertices=24, seed=0):
+    """Random star-shaped polygons (float level 0 coordinates)."""
+    rng = np.random.default_rng(seed)
+    side = min(width, height)
+    polygons = []
+    for _ in range(n_polygons):
+        cx, cy = rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+        radii = rng.uniform(0.01, 0.08, n_vertices) * side
+        polygons.append(np.stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)], 1))
+    return polygons
+
+
+def write_annotation_xml(path, groups):
+    """Writes an ASAP/CAMELYON XML file from {group name: [polygons]}."""
+    lines = ['<?xml version="1.0"?>', '<ASAP_Annotations>', '\t<Annotations>']
+    i = 0
+    for group, polygons in groups.items():
+        for polygon in polygons:
+            lines.append(f'\t\t<Annotation Name="Annotation {i}" Type="Polygon" '
+                         f'PartOfGroup="{group}" Color="#F4FA58">')
+            lines.append('\t\t\t<Coordinates>')
+            lines.extend(f'\t\t\t\t<Coordinate Order="{order}" X="{x:.4f}" Y="{y:.4f}" />'
+                         for order, (x, y) in enumerate(polygon))
+            lines.append('\t\t\t</Coordinates>')
+            lines.append('\t\t</Annotation>')
+            i += 1
+    lines += ['\t</Annotations>', '\t<AnnotationGroups>']
+    lines.extend(f'\t\t<Group Name="{group}" PartOfGroup="None" Color="#64FE2E">'
+                 f'<Attributes /></Group>' for group in groups)
+    lines += ['\t</AnnotationGroups>', '</ASAP_Annotations>']
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+    return path
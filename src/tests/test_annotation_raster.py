@@ -0,0 +1,95 @@
+"""AnnotationRasterizer against hand-built annotations whose masks are known
+pixel by pixel (computed with plain array indexing, not with fillPoly).
+
+Polygon corners on the pixel grid are inside the mask, so an axis aligned
+rectangle from (x0, y0) to (x1, y1) covers (x1 - x0 + 1) * (y1 - y0 + 1) pixels.
+"""
+import os
+
+import numpy as np
+import pytest
+import tifffile
+
+from benchmarks.synthetic import write_annotation_xml
+from utils.annotation_raster import AnnotationRasterizer
+
+LABEL_MAP = {'_0': 1, '_1': 2, '_2': 0}
+CONVERSION_ORDER = ['_0', '_1', '_2']
+SIZE = (96, 64)
+
+
+def rectangle(x0, y0, x1, y1):
+    return np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], dtype=float)
+
+
+@pytest.fixture
+def rasterizer(tmp_path):
+    groups = {'_0': [rectangle(8, 8, 40, 32), np.array([(60, 4), (70, 4), (60, 14)], dtype=float)],
+              '_1': [rectangle(32, 24, 56, 48)],
+              # exclusion drawn last, over both tumor groups
+              '_2': [rectangle(16, 16, 36, 28)]}
+    xml_path = write_annotation_xml(os.path.join(tmp_path, 'annotation.xml'), groups)
+    return AnnotationRasterizer(xml_path, LABEL_MAP, CONVERSION_ORDER, SIZE, levels=3, cell_size=32)
+
+
+def expected_mask(downsample):
+    """Ground truth of the fixture at a level whose downsample divides every corner."""
+    width, height = SIZE[0] // downsample, SIZE[1] // downsample
+    mask = np.zeros((height, width), dtype=np.uint8)
+
+    def fill(x0, y0, x1, y1, label):
+        mask[y0 // downsample:y1 // downsample + 1, x0 // downsample:x1 // downsample + 1] = label
+
+    fill(8, 8, 40, 32, 1)
+    fill(32, 24, 56, 48, 2)
+    fill(16, 16, 36, 28, 0)
+    if downsample == 1:
+        # right triangle with legs of 10 pixels: x + y <= 10 from its corner
+        ys, xs = np.mgrid[:height, :width]
+        mask[(xs >= 60) & (ys >= 4) & ((xs - 60) + (ys - 4) <= 10)] = 1
+    return mask
+
+
+def test_rectangle_pixel_count(tmp_path):
+    xml_path = write_annotation_xml(os.path.join(tmp_path, 'rectangle.xml'),
+                                    {'_0': [rectangle(8, 8, 40, 32)]})
+    rasterizer = AnnotationRasterizer(xml_path, LABEL_MAP, CONVERSION_ORDER, SIZE, levels=3)
+
+    assert int((rasterizer.full_mask(0) == 1).sum()) == 33 * 25
+    assert int((rasterizer.full_mask(1) == 1).sum()) == 17 * 13
+    assert int((rasterizer.full_mask(2) == 1).sum()) == 9 * 7
+
+
+def test_full_mask_matches_ground_truth(rasterizer):
+    mask = rasterizer.full_mask(0)
+    assert np.array_equal(mask, expected_mask(1))
+    # triangle: 11 + 10 + ... + 1 pixels
+    assert int((mask[:20, 56:] == 1).sum()) == 66
+    for level in (1, 2):
+        # the triangle corners are off the grid of these levels, compare the rest
+        assert np.array_equal(rasterizer.full_mask(level)[:, :56 // 2 ** level],
+                              expected_mask(2 ** level)[:, :56 // 2 ** level])
+
+
+def test_windows_match_ground_truth(rasterizer):
+    expected = expected_mask(1)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        x, y = int(rng.integers(-8, SIZE[0] - 8)), int(rng.integers(-8, SIZE[1] - 8))
+        window = rasterizer.read_region_np((x, y), 0, (24, 16))
+        assert window.shape == (16, 24, 4)
+        assert np.all(window[:, :, 3] == 255)
+
+        truth = np.zeros((16, 24), dtype=np.uint8)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + 24, SIZE[0]), min(y + 16, SIZE[1])
+        truth[y0 - y:y1 - y, x0 - x:x1 - x] = expected[y0:y1, x0:x1]
+        assert np.array_equal(window[:, :, 0], truth)
+
+
+def test_tiff_matches_ground_truth(rasterizer, tmp_path):
+    path = rasterizer.write_tiff(os.path.join(tmp_path, 'mask.tif'), tile_size=16, levels=2)
+    with tifffile.TiffFile(path) as tif:
+        assert len(tif.pages) == 2
+        assert np.array_equal(tif.pages[0].asarray(), expected_mask(1))
+        assert np.array_equal(tif.pages[1].asarray()[:, :28], expected_mask(2)[:, :28])
@@ -0,0 +1,69 @@
+"""Streaming embedding extraction with checkpointed resume."""
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+from torch.utils.data import DataLoader, TensorDataset
+
+from utils.get_embeddings_pytorch import get_embeddings_pytorch, get_embeddings_streaming
+
+DEVICE = torch.device('cpu')
+
+
+class FailingModel(torch.nn.Module):
+    """Linear model raising on the call after fail_after batches (None never fails)."""
+
+    def __init__(self, fail_after=None):
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(12, 5)
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def forward(self, x):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError('Simulated crash')
+        return self.linear(x)
+
+
+@pytest.fixture
+def dataloader():
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(torch.randn(70, 12, generator=generator),
+                            torch.randint(0, 2, (70,), generator=generator))
+    return DataLoader(dataset, batch_size=8)
+
+
+def test_streaming_matches_in_memory(tmp_path, dataloader):
+    expected_embeddings, expected_labels = get_embeddings_pytorch(FailingModel(), dataloader, DEVICE)
+    embeddings, labels = get_embeddings_streaming(FailingModel(), dataloader, DEVICE,
+                                                  str(tmp_path / 'run'))
+    torch.testing.assert_close(embeddings, expected_embeddings)
+    torch.testing.assert_close(labels, expected_labels)
+    assert not os.path.exists(tmp_path / 'run_progress.json')
+
+
+def test_interrupted_run_resumes(tmp_path, dataloader):
+    out_path = str(tmp_path / 'run')
+    expected_embeddings, expected_labels = get_embeddings_pytorch(FailingModel(), dataloader, DEVICE)
+
+    with pytest.raises(RuntimeError):
+        get_embeddings_streaming(FailingModel(fail_after=5), dataloader, DEVICE, out_path,
+                                 checkpoint_every=2)
+    assert os.path.isfile(out_path + '_progress.json')
+
+    # batches 1-4 were checkpointed, only the remaining 5 are computed again
+    model = FailingModel()
+    embeddings, labels = get_embeddings_streaming(model, dataloader, DEVICE, out_path,
+                                                  checkpoint_every=2)
+    assert model.calls == 5
+    torch.testing.assert_close(embeddings, expected_embeddings)
+    torch.testing.assert_close(labels, expected_labels)
+
+    # a finished run is loaded without calling the model
+    model = FailingModel()
+    embeddings, _ = get_embeddings_streaming(model, dataloader, DEVICE, out_path)
+    assert model.calls == 0
+    torch.testing.assert_close(embeddings, expected_embeddings)
@@ -0,0 +1,55 @@
+"""ExtractionDriver writing HDF5 shards (one per worker) read back with load_shards."""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('h5py')
+pytest.importorskip('torch')
+openslide = pytest.importorskip('openslide')
+pytest.importorskip('multiresolutionimageinterface')
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.extraction_driver import ExtractionDriver
+from utils.patch_sink import HDF5PatchSink
+from utils.pcam_dataset import load_shards
+
+PATCH_SIZE = 64
+
+
+def test_driver_writes_shards(tmp_path):
+    slides = []
+    for i in range(4):
+        wsi_path, mask_path, _, _ = make_synthetic_slide(
+            str(tmp_path), f'synthetic_{i}', size=(2048, 2048), levels=4, tile_size=128, seed=i)
+        slides.append({'wsi_path': wsi_path, 'mask_path': mask_path,
+                       'img_idx': str(i), 'is_tumor': i % 2 == 0})
+
+    shard_path = os.path.join(str(tmp_path), 'patches_{worker}.h5')
+    generator_kwargs = dict(image_path=str(tmp_path), annotation_path=str(tmp_path),
+                            mask_path=str(tmp_path), mag_factor=8, patches_per_bbox=5,
+                            patch_size=PATCH_SIZE, tumor_threshold=0.2, adaptive_quant=0,
+                            lower_bound=np.array([20, 20, 20]), upper_bound=np.array([200, 200, 200]),
+                            sink=HDF5PatchSink(shard_path, PATCH_SIZE, batch_size=8))
+    results = ExtractionDriver(generator_kwargs, num_workers=2, seed=0, poll_seconds=1).run(slides)
+    assert all('error' not in result for result in results)
+    accepted = sum(result['accepted'] for result in results)
+    assert accepted > 0
+
+    dataset = load_shards(shard_path)
+    assert 1 <= len(dataset.datasets) <= 2
+    assert len(dataset) == accepted
+
+    # every row keeps its own label, slide and coordinates
+    handles = {str(i): openslide.OpenSlide(slide['wsi_path']) for i, slide in enumerate(slides)}
+    for shard in dataset.datasets:
+        shard.open()
+        slide_ids = shard.dataset['slide_id'].asstr()[:]
+        coords = shard.dataset['coords'][:]
+        for row in range(len(shard)):
+            image, label = shard[row]
+            slide_id = slide_ids[row]
+            assert int(label.ravel()[0]) == int(slides[int(slide_id)]['is_tumor'])
+            expected = np.array(handles[slide_id].read_region(
+                tuple(int(c) for c in coords[row]), 0, (PATCH_SIZE, PATCH_SIZE)))[:, :, :3]
+            assert np.array_equal(image, expected)
@@ -0,0 +1,44 @@
+"""BatchedAdam against one torch.optim.Adam per member."""
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.mlp_sweep import BatchedAdam
+
+LEARNING_RATES = [1e-3, 3e-2, 1e-1]
+BETAS = [(0.9, 0.999), (0.8, 0.99), (0.5, 0.9)]
+
+
+def test_batched_adam_matches_torch_adam():
+    generator = torch.Generator().manual_seed(0)
+    weight = torch.randn(3, 4, 5, generator=generator)
+    bias = torch.randn(3, 5, generator=generator)
+    batched = [weight.clone(), bias.clone()]
+    optimizer = BatchedAdam(batched, LEARNING_RATES, BETAS)
+
+    members = [[weight[m].clone().requires_grad_(), bias[m].clone().requires_grad_()] for m in range(3)]
+    optimizers = [torch.optim.Adam(params, lr=lr, betas=betas)
+                  for params, lr, betas in zip(members, LEARNING_RATES, BETAS)]
+
+    for step in range(30):
+        grads = [torch.randn(p.shape, generator=generator) for p in batched]
+        # member 2 stops after step 10, member 1 skips every third step
+        active = torch.tensor([True, step % 3 != 0, step < 10])
+
+        optimizer.zero_grad()
+        for p, grad in zip(batched, grads):
+            p.grad = grad
+        optimizer.step(active)
+
+        for m, (params, member_optimizer) in enumerate(zip(members, optimizers)):
+            if not active[m]:
+                continue
+            member_optimizer.zero_grad()
+            for p, grad in zip(params, grads):
+                p.grad = grad[m].clone()
+            member_optimizer.step()
+
+    for m, params in enumerate(members):
+        for p, batched_p in zip(params, batched):
+            torch.testing.assert_close(batched_p[m], p.detach(), atol=3e-7, rtol=0)
+    assert optimizer.steps.tolist() == [30, 20, 10]
@@ -0,0 +1,59 @@
+"""Random samplers of PatchGenerator: seeded, bounded by max_tries."""
+import numpy as np
+import pytest
+
+openslide = pytest.importorskip('openslide')
+pytest.importorskip('multiresolutionimageinterface')
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.patch_sink import PatchSink
+
+
+class ListSink(PatchSink):
+
+    def __init__(self):
+        self.locations = []
+
+    def write(self, patch, label, slide_id, location, patch_idx):
+        self.locations.append(location)
+
+
+def make_generator(tmp_path, tumor_threshold, seed=0, max_tries=50):
+    return PatchGenerator(str(tmp_path), str(tmp_path), str(tmp_path), mag_factor=8,
+                          patches_per_bbox=4, patch_size=64, tumor_threshold=tumor_threshold,
+                          adaptive_quant=0, lower_bound=np.array([20, 20, 20]),
+                          upper_bound=np.array([200, 200, 200]), seed=seed, max_tries=max_tries,
+                          sink=ListSink())
+
+
+@pytest.fixture
+def slide(tmp_path):
+    wsi_path, mask_path, _, _ = make_synthetic_slide(
+        str(tmp_path), size=(2048, 2048), levels=4, tile_size=128, seed=0)
+    return wsi_path, openslide.OpenSlide(wsi_path), openslide.OpenSlide(mask_path)
+
+
+def test_unreachable_threshold_stops_after_max_tries(tmp_path, slide):
+    wsi_path, wsi, mask = slide
+    generator = make_generator(tmp_path, tumor_threshold=1.0)
+    _, wsi_scaled = generator.read_wsi(wsi_path)
+    contours = generator.get_tissue_contours(wsi_scaled)
+    assert len(contours) > 0
+
+    generator.get_tumor_patches_const(wsi, mask, '0', contours)
+    generator.get_normalT_patches_const(wsi, mask, '0', contours)
+    generator.get_patches(wsi, True, '0', contours, mask)
+    assert generator.sink.locations == []
+
+
+def test_samplers_are_seeded(tmp_path, slide):
+    wsi_path, wsi, mask = slide
+    runs = []
+    for _ in range(2):
+        generator = make_generator(tmp_path, tumor_threshold=0.2, seed=3)
+        _, wsi_scaled = generator.read_wsi(wsi_path)
+        generator.get_normalT_patches_const(wsi, mask, '0', generator.get_tissue_contours(wsi_scaled))
+        runs.append(generator.sink.locations)
+    assert len(runs[0]) > 0
+    assert runs[0] == runs[1]
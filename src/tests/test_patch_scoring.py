@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.patch_scoring import tissue_fractions, tumor_fractions
+
+LOWER = np.array([100, 50, 50])
+UPPER = np.array([180, 255, 255])
+
+
+def extract_tissue(patch, close_kernel_size, open_kernel_size):
+    """Per patch reference, as PatchGenerator.extract_tissue."""
+    hsv = cv2.cvtColor(patch, cv2.COLOR_BGR2HSV)
+    tissue_mask = cv2.inRange(hsv, LOWER, UPPER)
+    kernel_close = np.ones((close_kernel_size, close_kernel_size), dtype=np.uint8)
+    kernel_open = np.ones((open_kernel_size, open_kernel_size), dtype=np.uint8)
+    image_closed = cv2.morphologyEx(tissue_mask, cv2.MORPH_CLOSE, kernel_close)
+    return cv2.morphologyEx(image_closed, cv2.MORPH_OPEN, kernel_open)
+
+
+def make_patches(n=12, size=48, seed=0):
+    """RGBA patches of tissue blobs with specks and holes for the morphology."""
+    rng = np.random.default_rng(seed)
+    patches = np.full((n, size, size, 4), 240, dtype=np.uint8)
+    ys, xs = np.mgrid[:size, :size]
+    for patch in patches:
+        for _ in range(3):
+            cx, cy, r = rng.uniform(0, size, 2).tolist() + [rng.uniform(4, size / 2)]
+            patch[(xs - cx) ** 2 + (ys - cy) ** 2 <= r * r, :3] = (180, 60, 120)
+        specks = rng.random((size, size)) < 0.05
+        patch[specks, :3] = rng.choice([(240, 240, 240), (180, 60, 120)], int(specks.sum()))
+    return patches
+
+
+@pytest.mark.parametrize('close_kernel_size, open_kernel_size', [(20, 5), (7, 3), (4, 9)])
+def test_tissue_fractions_match_per_patch(close_kernel_size, open_kernel_size):
+    patches = make_patches()
+    expected = [np.count_nonzero(extract_tissue(patch, close_kernel_size, open_kernel_size)) / patch[..., 0].size
+                for patch in patches]
+    fractions = tissue_fractions(patches, LOWER, UPPER, close_kernel_size, open_kernel_size)
+    assert 0 < min(expected) and max(expected) <= 1
+    np.testing.assert_array_equal(fractions, expected)
+
+
+def test_tissue_fractions_without_morphology():
+    patches = make_patches()
+    expected = [np.count_nonzero(cv2.inRange(cv2.cvtColor(patch, cv2.COLOR_BGR2HSV), LOWER, UPPER)) / patch[..., 0].size
+                for patch in patches]
+    np.testing.assert_array_equal(tissue_fractions(patches, LOWER, UPPER, morphology=False), expected)
+
+
+def test_tumor_fractions_match_per_patch():
+    rng = np.random.default_rng(0)
+    masks = (rng.random((10, 32, 32, 4)) < rng.random((10, 1, 1, 1))).astype(np.uint8) * 255
+    expected = [(np.array(mask)[:, :, 0].sum() / 255) / (32 * 32) for mask in masks]
+    np.testing.assert_allclose(tumor_fractions(masks), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(tumor_fractions(masks[..., 0]), expected, rtol=0, atol=1e-12)
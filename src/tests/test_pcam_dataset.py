@@ -0,0 +1,46 @@
+"""Caches of PCAMDataset."""
+import os
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('torch')
+
+from utils.pcam_dataset import PCAMDataset
+
+
+def make_pcam_file(path, n=40, chunked=True):
+    rng = np.random.default_rng(0)
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('x', data=rng.integers(0, 256, (n, 8, 8, 3), dtype=np.uint8),
+                         chunks=(8, 8, 8, 3) if chunked else None,
+                         compression='gzip' if chunked else None)
+        f.create_dataset('y', data=rng.integers(0, 2, (n, 1, 1, 1), dtype=np.uint8))
+    return path
+
+
+def items(dataset):
+    return [dataset[i] for i in range(len(dataset))]
+
+
+@pytest.mark.parametrize('chunked', [True, False])
+def test_memmap_matches_hdf5(tmp_path, chunked):
+    data_dir, cache_dir = tmp_path / 'data', tmp_path / 'cache'
+    data_dir.mkdir()
+    path = make_pcam_file(str(data_dir / 'pcam.h5'), chunked=chunked)
+
+    expected = items(PCAMDataset(path, path))
+    dataset = PCAMDataset(path, path, cache='memmap', cache_dir=str(cache_dir))
+    for (image, label), (expected_image, expected_label) in zip(items(dataset), expected):
+        np.testing.assert_array_equal(image, expected_image)
+        np.testing.assert_array_equal(label, expected_label)
+
+    # the data folder is left untouched, the copy (only needed for chunked x) goes to cache_dir
+    assert os.listdir(data_dir) == ['pcam.h5']
+    copies = os.listdir(cache_dir) if cache_dir.exists() else []
+    assert len(copies) == (1 if chunked else 0)
+
+    # written once
+    PCAMDataset(path, path, cache='memmap', cache_dir=str(cache_dir))
+    assert (os.listdir(cache_dir) if cache_dir.exists() else []) == copies
@@ -0,0 +1,67 @@
+"""PolygonMask tumor fractions against windows of known tumor area, from the
+polygons (shapely) and from the rasterization fallback."""
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_annotation_xml
+from utils import polygon_mask
+from utils.patch_scoring import tumor_fractions
+from utils.polygon_mask import PolygonMask
+
+LABEL_MAP = {'_0': 1, '_1': 2, '_2': 0}
+CONVERSION_ORDER = ['_0', '_1', '_2']
+SIZE = (256, 256)
+PATCH = (32, 32)
+
+# window -> (exact area fraction, fraction of the rasterized pixels), the
+# rasterization covers the right/bottom edges of a polygon too
+WINDOWS = {(100, 40): (1.0, 1.0),     # inside the tumor
+           (64, 64): (0.0, 0.0),      # on the exclusion
+           (16, 40): (0.5, 0.5),      # left half on the tumor
+           (144, 100): (0.5, 17 / 32),
+           (150, 150): (0.0, 0.0),    # tumor overwritten by the non-tumor label
+           (200, 10): (0.0, 0.0)}     # outside every polygon
+
+
+def rectangle(x0, y0, x1, y1):
+    return np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], dtype=float)
+
+
+@pytest.fixture
+def xml_path(tmp_path):
+    groups = {'_0': [rectangle(32, 32, 160, 160)],
+              '_1': [rectangle(140, 140, 200, 200)],
+              '_2': [rectangle(64, 64, 96, 96)]}
+    return write_annotation_xml(os.path.join(tmp_path, 'annotation.xml'), groups)
+
+
+def test_fractions_from_polygons(xml_path):
+    pytest.importorskip('shapely')
+    mask = PolygonMask(xml_path, LABEL_MAP, CONVERSION_ORDER, SIZE, levels=3)
+    assert mask.tree is not None
+
+    fractions = mask.fractions(list(WINDOWS), PATCH)
+    np.testing.assert_allclose(fractions, [area for area, _ in WINDOWS.values()], rtol=0, atol=1e-12)
+
+
+def test_fractions_without_shapely(xml_path, monkeypatch):
+    monkeypatch.setattr(polygon_mask, 'STRtree', None)
+    mask = PolygonMask(xml_path, LABEL_MAP, CONVERSION_ORDER, SIZE, levels=3)
+    assert mask.tree is None
+
+    fractions = mask.fractions(list(WINDOWS), PATCH)
+    np.testing.assert_allclose(fractions, [raster for _, raster in WINDOWS.values()], rtol=0, atol=1e-12)
+
+
+def test_read_region_is_a_tumor_mask(xml_path):
+    mask = PolygonMask(xml_path, LABEL_MAP, CONVERSION_ORDER, SIZE, levels=3)
+    regions = np.stack([mask.read_region_np(location, 0, PATCH) for location in WINDOWS])
+
+    assert set(np.unique(regions[..., :3])) <= {0, 255}
+    assert (regions[..., 3] == 255).all()
+    # the existing tumor fraction code reads it like a mask TIFF
+    np.testing.assert_allclose(tumor_fractions(regions), [raster for _, raster in WINDOWS.values()],
+                               rtol=0, atol=1e-12)
+    assert np.array(mask.read_region((0, 0), 2, (64, 64))).shape == (64, 64, 4)
@@ -0,0 +1,89 @@
+"""Resumable downloads of AWSHandler against the fake S3 client (no network)."""
+import os
+
+import numpy as np
+import pytest
+from boto3.s3.transfer import TransferConfig
+
+from benchmarks.fake_s3 import FakeS3Client
+from utils.aws_handler import AWSHandler
+
+BUCKET = 'camelyon-dataset'
+KEY = 'CAMELYON17/images/patient_000_node_0.tif'
+CHUNK = 64 * 1024
+CONFIG = TransferConfig(multipart_threshold=4 * CHUNK, multipart_chunksize=CHUNK, max_concurrency=1)
+
+
+def make_handler(data, fail_after=None):
+    client = FakeS3Client(latency=0, fail_after=fail_after)
+    client.put(BUCKET, KEY, data)
+    return client, AWSHandler(None, None, 'eu-west-1', s3_client=client)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def data():
+    # 10.5 parts, the last one short
+    return np.random.default_rng(0).bytes(10 * CHUNK + CHUNK // 2)
+
+
+def test_interrupted_download_resumes(tmp_path, data):
+    file_path = str(tmp_path) + '/'
+    final_path = file_path + KEY.split('/')[-1]
+
+    client, handler = make_handler(data, fail_after=4)
+    with pytest.raises(ConnectionError):
+        handler.download_file_resumable(BUCKET, KEY, file_path, config=CONFIG)
+    assert not os.path.exists(final_path)
+    assert os.path.isfile(final_path + '.part.json')
+
+    # a new connection only fetches the missing parts
+    client.fail_after = None
+    downloaded = handler.download_file_resumable(BUCKET, KEY, file_path, config=CONFIG)
+    assert downloaded == len(data) - 4 * CHUNK
+    assert read(final_path) == data
+    assert not os.path.exists(final_path + '.part')
+    assert not os.path.exists(final_path + '.part.json')
+
+    # already present, nothing is downloaded again
+    calls = client.calls['get_object']
+    assert handler.download_file_resumable(BUCKET, KEY, file_path, config=CONFIG, verify_etag=True) == 0
+    assert client.calls['get_object'] == calls
+
+
+def test_changed_object_restarts(tmp_path, data):
+    file_path = str(tmp_path) + '/'
+    client, handler = make_handler(data, fail_after=3)
+    with pytest.raises(ConnectionError):
+        handler.download_file_resumable(BUCKET, KEY, file_path, config=CONFIG)
+
+    # new version of the object (other ETag), the finished parts are discarded
+    new_data = data[::-1]
+    client.put(BUCKET, KEY, new_data)
+    client.fail_after = None
+    assert handler.download_file_resumable(BUCKET, KEY, file_path, config=CONFIG) == len(new_data)
+    assert read(file_path + KEY.split('/')[-1]) == new_data
+
+
+def test_parallel_list_download(tmp_path):
+    client = FakeS3Client(latency=0)
+    rng = np.random.default_rng(1)
+    files = {f'CAMELYON17/images/patient_{i:03d}.tif': rng.bytes(int(rng.integers(1, 8)) * CHUNK)
+             for i in range(6)}
+    for key, content in files.items():
+        client.put(BUCKET, key, content)
+    handler = AWSHandler(None, None, 'eu-west-1', s3_client=client)
+
+    elements = handler.list_folders(BUCKET, 'CAMELYON17/images/')
+    downloaded = handler.download_list_file_parallel(elements, BUCKET, str(tmp_path) + '/',
+                                                     max_workers=3, config=CONFIG)
+
+    assert downloaded == sum(len(content) for content in files.values())
+    # size and ETag come from the listing
+    assert client.calls['head_object'] == 0
+    for key, content in files.items():
+        assert read(os.path.join(tmp_path, key.split('/')[-1])) == content
@@ -0,0 +1,95 @@
+"""AWSHandler listing against the fake paginated S3 client (no network).
+
+Run from the repository root: python -m pytest src/tests
+"""
+import os
+
+from benchmarks.fake_s3 import FakeS3Client
+from utils.aws_handler import AWSHandler
+
+BUCKET = 'camelyon-dataset'
+PREFIX = 'CAMELYON17/images/'
+N_KEYS = 2500
+
+
+def make_handler():
+    client = FakeS3Client(latency=0, page_size=1000)
+    for i in range(N_KEYS):
+        client.put(BUCKET, f'{PREFIX}patient_{i:05d}.tif', b'0' * (i % 7 + 1))
+    # outside the listed prefix
+    client.put(BUCKET, 'CAMELYON17/masks/patient_00000.tif', b'0')
+    client.put(BUCKET, 'CAMELYON16/images/tumor_001.tif', b'0')
+    client.put(BUCKET, f'{PREFIX}annotations/patient_00000.xml', b'0')
+    return client, AWSHandler(None, None, 'eu-west-1', s3_client=client)
+
+
+def test_listing_follows_pages():
+    client, handler = make_handler()
+    elements = handler.list_folders(BUCKET, PREFIX)
+
+    assert len(elements) == N_KEYS
+    assert client.calls['list_objects_v2'] == 3
+    keys = [element[0] for element in elements]
+    assert len(set(keys)) == N_KEYS
+    assert keys[-1] == f'{PREFIX}patient_{N_KEYS - 1:05d}.tif'
+    assert elements[3][2] == 4
+
+
+def test_listing_filters_prefix():
+    client, handler = make_handler()
+    keys = [element[0] for element in handler.list_folders(BUCKET, PREFIX)]
+
+    assert all(key.startswith(PREFIX) for key in keys)
+    assert 'CAMELYON17/masks/patient_00000.tif' not in keys
+    # keys below a delimiter are listed as folders, not objects
+    assert f'{PREFIX}annotations/patient_00000.xml' not in keys
+    assert handler.list_folders(BUCKET, PREFIX, folders=True) == [f'{PREFIX}annotations/']
+    assert handler.list_folders(BUCKET, 'CAMELYON17/', folders=True) == [
+        'CAMELYON17/images/', 'CAMELYON17/masks/']
+
+
+def test_manifest_cache_hit(tmp_path):
+    client, handler = make_handler()
+    manifest_path = os.path.join(tmp_path, 'manifest.json')
+
+    first = handler.list_folders(BUCKET, PREFIX, manifest_path=manifest_path)
+    calls = client.calls['list_objects_v2']
+    second = handler.list_folders(BUCKET, PREFIX, manifest_path=manifest_path)
+
+    assert client.calls['list_objects_v2'] == calls
+    assert second == first
+
+    # other prefixes and expired entries are listed again
+    handler.list_folders(BUCKET, 'CAMELYON16/images/', manifest_path=manifest_path)
+    assert client.calls['list_objects_v2'] == calls + 1
+    handler.list_folders(BUCKET, PREFIX, manifest_path=manifest_path, ttl=0)
+    assert client.calls['list_objects_v2'] == calls + 4
+
+
+def test_iter_objects_streams_pages():
+    client, handler = make_handler()
+    objects = handler.iter_objects(BUCKET, PREFIX)
+
+    first = next(objects)
+    # only the first page has been requested so far
+    assert client.calls['list_objects_v2'] == 1
+    assert first['Key'] == f'{PREFIX}patient_00000.tif'
+    assert first['Size'] == 1 and first['ETag'].startswith('"')
+    assert 1 + sum(1 for _ in objects) == N_KEYS
+
+
+def test_download_from_manifest_without_list_calls(tmp_path):
+    client, handler = make_handler()
+    manifest_path = os.path.join(tmp_path, 'manifest.json')
+    handler.list_folders(BUCKET, PREFIX, manifest_path=manifest_path)
+
+    # a later run: listing and downloads served from the manifest
+    client, handler = make_handler()
+    elements = handler.list_folders(BUCKET, PREFIX, manifest_path=manifest_path)
+    handler.download_list_file(elements, BUCKET, str(tmp_path) + '/', all_files=False,
+                               files_to_download=4)
+    handler.download_list_file_parallel(elements[10:14], BUCKET, str(tmp_path) + '/')
+
+    assert client.calls['list_objects_v2'] == 0
+    assert client.calls['head_object'] == 0
+    assert os.path.getsize(os.path.join(tmp_path, 'patient_00012.tif')) == elements[12][2]
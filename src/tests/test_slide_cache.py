@@ -0,0 +1,64 @@
+"""SlideMetadataCache entries against the full-level read_wsi path."""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+openslide = pytest.importorskip('openslide')
+pytest.importorskip('multiresolutionimageinterface')
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+from utils.slide_cache import SlideMetadataCache, compute_metadata
+
+
+@pytest.fixture
+def generator(tmp_path):
+    return PatchGenerator(str(tmp_path), str(tmp_path), str(tmp_path), mag_factor=4,
+                          patches_per_bbox=4, patch_size=64, tumor_threshold=0.2,
+                          adaptive_quant=0, lower_bound=np.array([20, 20, 20]),
+                          upper_bound=np.array([200, 200, 200]))
+
+
+@pytest.fixture
+def slide(tmp_path):
+    return make_synthetic_slide(str(tmp_path), size=(2048, 2048), levels=4, tile_size=128,
+                                n_blobs=10, seed=2)[:2]
+
+
+def test_metadata_matches_full_level(generator, slide):
+    wsi_path, mask_path = slide
+    metadata = compute_metadata(generator, openslide.OpenSlide(wsi_path),
+                                openslide.OpenSlide(mask_path), tile_size=100)
+
+    _, wsi_scaled = generator.read_wsi(wsi_path)
+    expected_tissue = generator.extract_tissue(cv2.cvtColor(wsi_scaled, cv2.COLOR_BGR2HSV))
+    np.testing.assert_array_equal(metadata['tissue_mask'], expected_tissue)
+    assert metadata['tissue_bboxes'].tolist() == [
+        list(bbox) for bbox in generator.get_bbox(generator.get_tissue_contours(wsi_scaled))]
+
+    _, mask_scaled = generator.read_wsi(mask_path)
+    np.testing.assert_array_equal(metadata['tumor_mask'], cv2.cvtColor(mask_scaled, cv2.COLOR_BGR2GRAY))
+    assert metadata['tumor_bboxes'].tolist() == [
+        list(bbox) for bbox in generator.get_bbox(generator.get_tumor_contours(mask_scaled))]
+    assert len(metadata['tumor_bboxes']) > 0
+    assert metadata['downsample'] == 4
+    assert metadata['thumbnail'].shape == (1024, 1024, 3)
+
+
+def test_cache_hit(tmp_path, generator, slide):
+    wsi_path, mask_path = slide
+    cache = SlideMetadataCache(os.path.join(tmp_path, 'metadata'))
+    first = cache.get(generator, wsi_path, mask_path)
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+    second = cache.get(generator, wsi_path, mask_path)
+    for name in ('thumbnail', 'tissue_mask', 'tumor_mask', 'tissue_bboxes', 'tumor_bboxes'):
+        np.testing.assert_array_equal(second[name], first[name])
+    assert len(second['tissue_contours']) == len(first['tissue_contours'])
+
+    # other thresholds are another entry
+    generator.open_kernel_size = 3
+    cache.get(generator, wsi_path, mask_path)
+    assert len(os.listdir(cache.cache_dir)) == 2
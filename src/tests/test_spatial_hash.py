@@ -0,0 +1,56 @@
+"""Patch spacing of SpatialHash."""
+import numpy as np
+
+from utils.spatial_hash import SpatialHash
+
+
+def brute_force_overlap(location, accepted, patch_size):
+    largest = 0.0
+    for other in accepted:
+        width = patch_size - abs(location[0] - other[0])
+        height = patch_size - abs(location[1] - other[1])
+        if width > 0 and height > 0:
+            largest = max(largest, width * height / patch_size ** 2)
+    return largest
+
+
+def test_overlap_matches_brute_force():
+    rng = np.random.default_rng(0)
+    spacing = SpatialHash(64)
+    accepted = [tuple(int(v) for v in rng.integers(0, 1000, 2)) for _ in range(200)]
+    for location in accepted:
+        spacing.add(location)
+    for location in rng.integers(0, 1000, (500, 2)):
+        location = tuple(int(v) for v in location)
+        assert spacing.overlap(location) == brute_force_overlap(location, accepted, 64)
+
+
+def test_accepts_counts_duplicates():
+    spacing = SpatialHash(100, max_overlap=0.5)
+    spacing.add((0, 0))
+    assert not spacing.accepts((0, 0))      # identical window
+    assert not spacing.accepts((20, 0))     # 80% overlap
+    assert spacing.accepts((50, 0))         # 50% overlap
+    assert spacing.accepts((100, 100))      # touching corners only
+    assert spacing.duplicate_rate == 0.5
+
+
+def test_identical_windows_rejected_without_overlap_limit():
+    spacing = SpatialHash(100, max_overlap=1.0)
+    spacing.add((10, 10))
+    assert not spacing.accepts((10, 10))
+    assert spacing.accepts((11, 10))
+
+
+def test_filter_rejects_overlaps_within_a_batch():
+    spacing = SpatialHash(100, max_overlap=0.25)
+    spacing.add((1000, 1000))
+    batch = [(0, 0), (10, 10), (1010, 1000), (300, 300), (0, 0), (350, 300), (400, 300)]
+
+    # (10, 10), (0, 0) and (350, 300) overlap an earlier location of the batch,
+    # (1010, 1000) the accepted window
+    assert spacing.filter(batch) == [(0, 0), (300, 300), (400, 300)]
+    assert spacing.checks == len(batch)
+    assert spacing.duplicates == 4
+    # nothing is added until the patches are accepted
+    assert spacing.accepts((0, 0))
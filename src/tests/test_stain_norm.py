@@ -0,0 +1,93 @@
+"""Batched stain normalizers against torchstain's per image ones."""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+torchstain = pytest.importorskip('torchstain')
+
+from utils.stain_norm import BatchMacenkoNormalizer, BatchReinhardNormalizer, fit_reference
+
+# H&E optical densities (columns) used to synthesise stained patches
+HE = np.array([[0.65, 0.07], [0.70, 0.99], [0.29, 0.11]])
+
+
+def make_images(n, size=32, seed=0):
+    """(N, 3, H, W) float images in [0, 255] of random H&E concentrations."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(n):
+        concentrations = rng.gamma(2., rng.uniform(.2, .6, (2, 1)), (2, size * size))
+        od = HE @ concentrations + rng.normal(0, .02, (3, size * size))
+        image = np.clip(240 * np.exp(-od), 0, 255).round()
+        images.append(image.reshape(3, size, size))
+    return torch.tensor(np.stack(images), dtype=torch.float32)
+
+
+@pytest.fixture
+def images():
+    return make_images(6)
+
+
+def test_macenko_matches_torchstain(images):
+    reference = make_images(1, seed=1)[0]
+    normalizer = torchstain.normalizers.MacenkoNormalizer(backend='torch')
+    normalizer.fit(reference)
+    expected = torch.stack([normalizer.normalize(I=image)[0].permute(2, 0, 1) for image in images])
+
+    batch_normalizer = BatchMacenkoNormalizer.from_normalizer(normalizer)
+    normalized = batch_normalizer(images)
+    assert normalized.shape == images.shape
+    # integer outputs, off by at most one level where float32 rounding differs
+    assert (normalized - expected).abs().max() <= 1
+
+    # fitting on a single image gives torchstain's reference
+    batch_normalizer.fit(reference)
+    torch.testing.assert_close(batch_normalizer.HERef, normalizer.HERef, atol=1e-4, rtol=0)
+    torch.testing.assert_close(batch_normalizer.maxCRef, normalizer.maxCRef, atol=1e-4, rtol=0)
+
+
+def test_reinhard_matches_torchstain(images):
+    reference = make_images(1, seed=1)[0]
+    normalizer = torchstain.normalizers.ReinhardNormalizer(backend='torch')
+    normalizer.fit(reference)
+    expected = torch.stack([normalizer.normalize(I=image).permute(2, 0, 1) / 255.0 for image in images])
+
+    normalized = BatchReinhardNormalizer.from_normalizer(normalizer)(images)
+    assert normalized.shape == images.shape
+    assert (normalized - expected).abs().max() <= 1 / 255 + 1e-6
+
+
+@pytest.mark.parametrize('method', ['macenko', 'reinhard'])
+def test_pooled_reference(images, method):
+    # several references are fitted on their pixels taken together
+    pooled = fit_reference(list(images[:3]), method)
+    single = fit_reference([torch.cat(list(images[:3]), dim=2)], method)
+    for name, value in pooled.items():
+        torch.testing.assert_close(value, single[name], atol=1e-4, rtol=0)
+
+
+def test_reference_cache_keyed_on_transformed_images(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    from utils.stain_norm import load_or_fit_reference
+
+    target_path = str(tmp_path / 'target.png')
+    image = make_images(1, seed=1)[0].permute(1, 2, 0).numpy().astype(np.uint8)
+    cv2.imwrite(target_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+    def artifacts():
+        return sorted(path.name for path in tmp_path.glob('stain_*.pt'))
+
+    # lambdas repr with their address, the same output must still hit
+    first = load_or_fit_reference(target_path, 'macenko', lambda x: torch.tensor(x).permute(2, 0, 1).float())
+    second = load_or_fit_reference(target_path, 'macenko', lambda x: torch.tensor(x).permute(2, 0, 1).float())
+    assert len(artifacts()) == 1
+    for name, value in first.items():
+        torch.testing.assert_close(second[name], value)
+
+    # another transformed image, another reference
+    load_or_fit_reference(target_path, 'macenko', lambda x: torch.tensor(x[::2, ::2]).permute(2, 0, 1).float())
+    assert len(artifacts()) == 2
+
+    load_or_fit_reference(target_path, 'reinhard', lambda x: torch.tensor(x).permute(2, 0, 1).float(),
+                          cache_key='pcam_target')
+    assert 'stain_reinhard_pcam_target.pt' in artifacts()
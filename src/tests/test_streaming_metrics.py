@@ -0,0 +1,62 @@
+"""StreamingBinaryMetrics against exact metrics over all the predictions."""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.streaming_metrics import StreamingBinaryMetrics
+
+
+def exact_auc(predictions, labels):
+    """Mann-Whitney AUC, ties counted as half."""
+    positives, negatives = predictions[labels == 1], predictions[labels == 0]
+    greater = (positives[:, None] > negatives[None, :]).sum()
+    ties = (positives[:, None] == negatives[None, :]).sum()
+    return (greater + ties / 2) / (len(positives) * len(negatives))
+
+
+def make_predictions(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = (rng.random(n) < 0.3).astype(np.int64)
+    logits = rng.normal(labels * 1.5, 1.0)
+    return 1 / (1 + np.exp(-logits)), labels
+
+
+def stream(predictions, labels, num_bins=1000, batch_size=256):
+    metrics = StreamingBinaryMetrics(num_bins)
+    for start in range(0, len(predictions), batch_size):
+        metrics.update(torch.tensor(predictions[start:start + batch_size], dtype=torch.float64),
+                       torch.tensor(labels[start:start + batch_size]))
+    return metrics.compute()
+
+
+def test_accuracy_and_f1_at_half_are_exact():
+    predictions, labels = make_predictions()
+    result = stream(predictions, labels)
+
+    predicted = predictions >= 0.5
+    tp = np.sum(predicted & (labels == 1))
+    fp = np.sum(predicted & (labels == 0))
+    fn = np.sum(~predicted & (labels == 1))
+    assert result['num_samples'] == len(labels)
+    assert result['accuracy'] == pytest.approx(np.mean(predicted == labels), abs=1e-12)
+    assert result['f1'] == pytest.approx(2 * tp / (2 * tp + fp + fn), abs=1e-12)
+
+
+def test_auc_exact_with_one_value_per_bin():
+    # one value per bin (its center), ties only between equal values
+    predictions, labels = make_predictions()
+    predictions = (np.floor(predictions * 100) + 0.5) / 100
+    assert stream(predictions, labels, num_bins=100)['auc'] == pytest.approx(
+        exact_auc(predictions, labels), abs=1e-12)
+
+
+def test_auc_close_to_exact():
+    predictions, labels = make_predictions()
+    result = stream(predictions, labels)
+    # only pairs inside the same bin are counted as ties
+    assert result['auc'] == pytest.approx(exact_auc(predictions, labels), abs=1e-3)
+
+    best = int(np.argmax(result['f1_sweep']))
+    assert result['best_threshold'] == result['thresholds'][best]
+    assert result['best_f1'] == max(result['f1_sweep'])
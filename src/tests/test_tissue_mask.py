@@ -0,0 +1,38 @@
+"""Streaming tissue mask of PatchGenerator.read_tissue_mask."""
+import cv2
+import numpy as np
+import pytest
+
+openslide = pytest.importorskip('openslide')
+pytest.importorskip('multiresolutionimageinterface')
+
+from benchmarks.synthetic import make_synthetic_slide
+from utils.patch_generator import PatchGenerator
+
+
+def make_generator(tmp_path, **kwargs):
+    return PatchGenerator(str(tmp_path), str(tmp_path), str(tmp_path), mag_factor=4,
+                          patches_per_bbox=4, patch_size=64, tumor_threshold=0.2,
+                          adaptive_quant=0, lower_bound=np.array([20, 20, 20]),
+                          upper_bound=np.array([200, 200, 200]), **kwargs)
+
+
+@pytest.mark.parametrize('tile_size', [64, 100, 4096])
+def test_streaming_mask_matches_full_level(tmp_path, tile_size):
+    wsi_path, _, _, _ = make_synthetic_slide(
+        str(tmp_path), size=(2048, 2048), levels=4, tile_size=128, n_blobs=12, seed=1)
+    generator = make_generator(tmp_path)
+
+    _, wsi_scaled = generator.read_wsi(wsi_path)
+    expected = generator.extract_tissue(cv2.cvtColor(wsi_scaled, cv2.COLOR_BGR2HSV))
+    _, tissue_mask, contours = generator.read_tissue_mask(wsi_path, tile_size=tile_size)
+
+    assert np.count_nonzero(expected) > 0
+    np.testing.assert_array_equal(tissue_mask, expected)
+    assert len(contours) == len(generator.get_tissue_contours(wsi_scaled))
+
+
+def test_halo_smaller_than_kernels_is_rejected(tmp_path):
+    generator = make_generator(tmp_path, close_kernel_size=20, open_kernel_size=5)
+    with pytest.raises(ValueError):
+        generator.read_tissue_mask('unused.tif', halo=10)
@@ -0,0 +1,62 @@
+"""Prefetching thread of WSIInference."""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('openslide')
+pytest.importorskip('multiresolutionimageinterface')
+
+from utils.wsi_inference import WSIInference
+
+
+def make_inference(prefetch=2):
+    return WSIInference(SimpleNamespace(patch_size=32), model=None, device=None, prefetch=prefetch)
+
+
+def counting(n, produced, fail_at=None):
+    for i in range(n):
+        if i == fail_at:
+            raise ValueError('read failed')
+        produced.append(i)
+        yield i
+
+
+@pytest.fixture
+def prefetch_threads():
+    """Threads started since the beginning of the test."""
+    before = set(threading.enumerate())
+    return lambda: [thread for thread in threading.enumerate() if thread not in before]
+
+
+def test_prefetched_yields_everything_in_order(prefetch_threads):
+    produced = []
+    assert list(make_inference().prefetched(counting(20, produced))) == list(range(20))
+    assert prefetch_threads() == []
+
+
+def test_read_error_is_raised_by_the_consumer(prefetch_threads):
+    received = []
+    with pytest.raises(ValueError):
+        for item in make_inference().prefetched(counting(20, [], fail_at=5)):
+            received.append(item)
+    assert received == list(range(5))
+    assert prefetch_threads() == []
+
+
+def test_consumer_error_stops_the_producer(prefetch_threads):
+    produced = []
+    batches = make_inference(prefetch=2).prefetched(counting(1000, produced))
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError):
+        for item in batches:
+            if item == 3:
+                raise RuntimeError('model failed')
+    batches.close()
+
+    # joined, not left blocked on the full buffer
+    assert prefetch_threads() == []
+    assert time.perf_counter() - start < 5
+    assert len(produced) < 10
@@ -0,0 +1,151 @@
+import math
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+import cv2
+import numpy as np
+import tifffile
+
+# fixed point bits of the polygon coordinates passed to cv2.fillPoly
+SHIFT = 4
+
+
+def parse_annotations(xml_path):
+    """Polygons of an ASAP/CAMELYON XML annotation file.
+
+    Returns:
+        annotations: List of (group name, (N, 2) float64 array of level 0 x, y)
+        parents: Dictionary group name -> parent group name (None at the top)
+    """
+    root = ET.parse(xml_path).getroot()
+    annotations = []
+    for annotation in root.iter('Annotation'):
+        coordinates = sorted(annotation.iter('Coordinate'), key=lambda c: int(c.get('Order', 0)))
+        if len(coordinates) < 3:
+            continue
+        polygon = np.array([(float(c.get('X').replace(',', '.')), float(c.get('Y').replace(',', '.')))
+                            for c in coordinates])
+        annotations.append((annotation.get('PartOfGroup'), polygon))
+
+    parents = {}
+    for group in root.iter('Group'):
+        parent = group.get('PartOfGroup')
+        parents[group.get('Name')] = None if parent in (None, 'None') else parent
+    return annotations, parents
+
+
+class AnnotationRasterizer:
+    """Native replacement of mir.AnnotationToMask. The XML polygons are kept in
+    memory and rasterized on demand with cv2.fillPoly: groups are drawn in
+    conversion_order with their label_map value (later groups overwrite earlier
+    ones, like ASAP). Any window can be answered directly from the polygons
+    (read_region, through a grid index of the polygon bounding boxes) or the
+    whole mask can be written as a tiled pyramidal TIFF one row strip at a time.
+    """
+
+    def __init__(self, xml_path, label_map, conversion_order, dimensions,
+                 levels: int = 6, cell_size: int = 4096):
+        self.label_map = label_map
+        self.conversion_order = conversion_order
+        self.dimensions = tuple(dimensions)
+        self.level_downsamples = [2 ** level for level in range(levels)]
+        self.level_dimensions = [(self.dimensions[0] // ds, self.dimensions[1] // ds)
+                                 for ds in self.level_downsamples]
+        self.level_count = levels
+        self.properties = {}
+        self.cell_size = cell_size
+
+        annotations, parents = parse_annotations(xml_path)
+        # (order in conversion_order, label, polygon), in drawing order
+        self.polygons = []
+        for group, polygon in annotations:
+            # annotations of a nested group take the label of the nearest listed ancestor
+            seen = set()
+            while group is not None and group not in conversion_order and group not in seen:
+                seen.add(group)
+                group = parents.get(group)
+            if group in conversion_order:
+                self.polygons.append((conversion_order.index(group), label_map[group], polygon))
+        self.polygons.sort(key=lambda p: p[0])
+        self.bboxes = np.array([(p.min(0)[0], p.min(0)[1], p.max(0)[0], p.max(0)[1])
+                                for _, _, p in self.polygons]).reshape(-1, 4)
+
+        # grid index: level 0 cell -> polygons whose bbox touches it
+        self.grid = defaultdict(list)
+        for i, (x0, y0, x1, y1) in enumerate(self.bboxes):
+            for cy in range(int(y0 // cell_size), int(y1 // cell_size) + 1):
+                for cx in range(int(x0 // cell_size), int(x1 // cell_size) + 1):
+                    self.grid[(cx, cy)].append(i)
+
+    def get_best_level_for_downsample(self, downsample):
+        return max(i for i, ds in enumerate(self.level_downsamples) if ds <= max(downsample, 1))
+
+    def query(self, x0, y0, x1, y1):
+        """Indices (in drawing order) of the polygons whose bbox intersects a level 0 window."""
+        candidates = set()
+        for cy in range(int(y0 // self.cell_size), int(y1 // self.cell_size) + 1):
+            for cx in range(int(x0 // self.cell_size), int(x1 // self.cell_size) + 1):
+                candidates.update(self.grid.get((cx, cy), ()))
+        return sorted(i for i in candidates
+                      if self.bboxes[i, 0] <= x1 and self.bboxes[i, 2] >= x0
+                      and self.bboxes[i, 1] <= y1 and self.bboxes[i, 3] >= y0)
+
+    def fixed_point(self, polygon, downsample):
+        """Polygon in fixed point pixel coordinates of a level, so that windows of
+        any origin rasterize exactly like the full level."""
+        return np.round(polygon / downsample * (1 << SHIFT)).astype(np.int64)
+
+    def rasterize(self, location, level, size):
+        """Label mask (height, width) uint8 of a window. location is given in
+        level 0 coordinates (OpenSlide convention), size in level pixels."""
+        downsample = self.level_downsamples[level]
+        x, y = int(location[0] // downsample), int(location[1] // downsample)
+        width, height = size
+        mask = np.zeros((height, width), dtype=np.uint8)
+        # one pixel of margin, fillPoly rounds polygon edges to the pixel grid
+        indices = self.query((x - 1) * downsample, (y - 1) * downsample,
+                             (x + width + 1) * downsample, (y + height + 1) * downsample)
+        origin = np.array([x, y], dtype=np.int64) << SHIFT
+        for i in indices:
+            _, label, polygon = self.polygons[i]
+            points = (self.fixed_point(polygon, downsample) - origin).astype(np.int32)
+            cv2.fillPoly(mask, [points], int(label), lineType=cv2.LINE_8, shift=SHIFT)
+        return mask
+
+    def read_region_np(self, location, level, size):
+        """RGBA window with the label in the color channels, like reading the
+        mask TIFF with OpenSlide."""
+        mask = self.rasterize(location, level, size)
+        region = np.empty(mask.shape + (4,), dtype=np.uint8)
+        region[:, :, :3] = mask[:, :, None]
+        region[:, :, 3] = 255
+        return region
+
+    def strips(self, level, tile_size):
+        """Tiles of a level in row major order, rasterizing one row strip of tiles at a time."""
+        width, height = self.level_dimensions[level]
+        downsample = self.level_downsamples[level]
+        for y in range(0, height, tile_size):
+            padded_width = math.ceil(width / tile_size) * tile_size
+            strip = self.rasterize((0, y * downsample), level, (padded_width, tile_size))
+            # pixels past the level bounds stay background
+            strip[:, width:] = 0
+            strip[max(height - y, 0):] = 0
+            for x in range(0, width, tile_size):
+                yield strip[:, x:x + tile_size]
+
+    def write_tiff(self, path, tile_size: int = 512, levels=None, compression='zlib'):
+        """Writes the mask as a tiled pyramidal TIFF (levels as successive
+        directories, as read by OpenSlide), streaming row strips so memory
+        holds one strip of tiles instead of the level 0 mask."""
+        levels = self.level_count if levels is None else levels
+        with tifffile.TiffWriter(path, bigtiff=True) as tif:
+            for level in range(levels):
+                width, height = self.level_dimensions[level]
+                tif.write(self.strips(level, tile_size), shape=(height, width), dtype=np.uint8,
+                          tile=(tile_size, tile_size), photometric='minisblack',
+                          compression=compression, subfiletype=1 if level else 0, metadata=None)
+        return path
+
+    def full_mask(self, level):
+        """Whole level rasterized at once (reference for the tiled output)."""
+        return self.rasterize((0, 0), level, self.level_dimensions[level])
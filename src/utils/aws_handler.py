@@ -1,10 +1,20 @@
 import boto3
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
 
+DEFAULT_TRANSFER_CONFIG = TransferConfig(multipart_threshold=64 * 1024 * 1024,
+                                         multipart_chunksize=64 * 1024 * 1024,
+                                         max_concurrency=8)
+
 
 class AWSHandler:
-    def __init__(self, aws_access_key_id, aws_secret_key, aws_region):
+    def __init__(self, aws_access_key_id, aws_secret_key, aws_region, s3_client=None):
 
         # Creating the client instance
         self.aws_session = boto3.Session(
@@ -13,36 +23,67 @@ class AWSHandler:
             region_name=aws_region
         )
 
-        # Instatiate all clients needed
-        self.s3_client = self.aws_session.client('s3')
+        # Instatiate all clients needed (an already built client can be given, e.g. a local stand-in)
+        self.s3_client = s3_client if s3_client is not None else self.aws_session.client('s3')
+
+    def iter_objects(self, bucket_name, prefix='CAMELYON17/', delimiter='/', folders=False):
+        """Streams the objects (or common prefixes if folders is True) of the given
+        S3 bucket, following the continuation tokens of list_objects_v2.
 
-    def list_folders(self, bucket_name, prefix='CAMELYON17/', delimiter='/', folders=False):
+        Yields:
+            The prefix name if folders=True, otherwise the object dict (Key, Size, ETag, LastModified).
+        """
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter):
+            if folders:
+                for common_prefix in page.get('CommonPrefixes', []):
+                    yield common_prefix.get('Prefix')
+            else:
+                yield from page.get('Contents', [])
+
+    def list_folders(self, bucket_name, prefix='CAMELYON17/', delimiter='/', folders=False,
+                     manifest_path=None, ttl=24 * 3600):
         """Gets all objects in the given S3 bucket. If folders is True, gets all 
-        the common prefixes of the bucket. 
+        the common prefixes of the bucket. With a manifest_path, the listing is
+        served from that on-disk manifest while it is younger than ttl seconds.
 
         Args:
-            s3_client (_type_): _description_
-            bucket_name (_type_): _description_
-            prefix (str, optional): _description_. Defaults to 'CAMELYON17/'.
-            delimiter (str, optional): _description_. Defaults to '/'.
-            folders (bool, optional): _description_. Defaults to False.
+            bucket_name (str): Name of the bucket.
+            prefix (str, optional): Prefix of the listed keys. Defaults to 'CAMELYON17/'.
+            delimiter (str, optional): Delimiter grouping keys into folders. Defaults to '/'.
+            folders (bool, optional): List the common prefixes instead of the objects. Defaults to False.
+            manifest_path (str, optional): JSON manifest caching the listings. Defaults to None.
+            ttl (int, optional): Seconds a manifest entry stays valid. Defaults to one day.
 
         Returns:
-            elements_list: Array of tuples containing the key (and size in MB if folders=False) of 
-            each element in the bucket.
+            elements_list: Array of the folder names if folders=True, otherwise of
+            [key, size in MB, size in bytes, ETag, last modified] for each element in the bucket.
         """
-        response = self.s3_client.list_objects_v2(
-            Bucket=bucket_name, Prefix=prefix, Delimiter=delimiter)
+        manifest = {}
+        entry_key = f'{bucket_name}/{prefix}|{delimiter}|{"folders" if folders else "objects"}'
+        if manifest_path and os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            entry = manifest.get(entry_key)
+            if entry and time.time() - entry['created'] < ttl:
+                return entry['elements']
+
         elements_list = []
         if folders:
-            for prefix in response.get('CommonPrefixes', []):
-                prefix_name = prefix.get('Prefix')
-                elements_list.append(prefix_name)
+            elements_list = list(self.iter_objects(
+                bucket_name, prefix, delimiter, folders=True))
         else:
-            for element in response.get('Contents', []):
+            for element in self.iter_objects(bucket_name, prefix, delimiter):
                 element_key = element.get('Key')
                 element_size = element.get('Size')/1024/1024
-                elements_list.append([element_key, element_size])
+                elements_list.append([element_key, element_size, element.get('Size'),
+                                      element.get('ETag'), str(element.get('LastModified'))])
+
+        if manifest_path:
+            manifest[entry_key] = {'created': time.time(), 'elements': elements_list}
+            with open(manifest_path + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + '.tmp', manifest_path)
         return elements_list
 
     def download_file(self, bucket_name, element_key, file_path, folder_path=''):
@@ -70,6 +111,130 @@ class AWSHandler:
                 self.download_file(
                     bucket_name, file[0], file_path, folder_path)
 
+    def download_file_resumable(self, bucket_name, element_key, file_path, folder_path='',
+                                size=None, etag=None, config=DEFAULT_TRANSFER_CONFIG, verify_etag=False):
+        """Downloads a file unless it is already present with the same size (and
+        ETag if verify_etag). Files above config.multipart_threshold are fetched
+        as ranged GETs of config.multipart_chunksize bytes, config.max_concurrency
+        at a time, into a .part file whose finished parts are tracked in a
+        .part.json sidecar, so an interrupted download resumes where it stopped.
+
+        Args:
+            bucket_name: Name of the bucket.
+            element_key: Key of the object.
+            file_path: Local directory of the downloads.
+            folder_path (str, optional): Subfolder of file_path. Defaults to ''.
+            size (int, optional): Size in bytes, fetched with head_object if None. Defaults to None.
+            etag (str, optional): ETag of the object, fetched with head_object if None. Defaults to None.
+            config (TransferConfig, optional): Part size, threshold and concurrency. Defaults to DEFAULT_TRANSFER_CONFIG.
+            verify_etag (bool, optional): Compare the MD5 of present files with single part ETags. Defaults to False.
+
+        Returns:
+            downloaded: Number of bytes downloaded (0 if the file was skipped).
+        """
+        final_path = file_path + folder_path + element_key.split('/')[-1]
+        os.makedirs(file_path + folder_path, exist_ok=True)
+
+        if size is None or etag is None:
+            head = self.s3_client.head_object(
+                Bucket=bucket_name, Key=element_key)
+            size, etag = head['ContentLength'], head['ETag']
+
+        if os.path.isfile(final_path) and os.path.getsize(final_path) == size:
+            if not verify_etag or '-' in etag or _file_md5(final_path) == etag.strip('"'):
+                print(f'The file {final_path} is already present, skipping.')
+                return 0
+
+        if size < config.multipart_threshold:
+            self.s3_client.download_file(
+                bucket_name, element_key, final_path, Config=config)
+            return size
+
+        part_path = final_path + '.part'
+        progress_path = part_path + '.json'
+        chunksize = config.multipart_chunksize
+        progress = {'etag': etag, 'size': size, 'chunksize': chunksize, 'done': []}
+        if os.path.isfile(progress_path) and os.path.isfile(part_path):
+            with open(progress_path, 'r') as f:
+                saved = json.load(f)
+            # parts of a different object version or layout can't be reused
+            if all(saved.get(k) == progress[k] for k in ('etag', 'size', 'chunksize')):
+                progress = saved
+        if not progress['done']:
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        done = set(progress['done'])
+        pending = [i for i in range((size + chunksize - 1) // chunksize) if i not in done]
+        lock = threading.Lock()
+
+        def download_part(i):
+            start = i * chunksize
+            end = min(start + chunksize, size) - 1
+            response = self.s3_client.get_object(Bucket=bucket_name, Key=element_key,
+                                                 Range=f'bytes={start}-{end}', IfMatch=etag)
+            data = response['Body'].read()
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+            with lock:
+                progress['done'].append(i)
+                with open(progress_path, 'w') as f:
+                    json.dump(progress, f)
+            return len(data)
+
+        with ThreadPoolExecutor(config.max_concurrency) as pool:
+            downloaded = sum(pool.map(download_part, pending))
+
+        os.replace(part_path, final_path)
+        os.remove(progress_path)
+        print(
+            f'''The file {element_key.split('/')[-1]} has been downloaded in {final_path} succesfully.''')
+        return downloaded
+
+    def download_list_file_parallel(self, list_files, bucket_name, file_path, folder_path='',
+                                    max_workers=4, config=DEFAULT_TRANSFER_CONFIG, verify_etag=False):
+        """Concurrent version of download_list_file: max_workers files at a time,
+        each one through download_file_resumable.
+
+        Args:
+            list_files: Elements as returned by list_folders (key first).
+            bucket_name: Name of the bucket.
+            file_path: Local directory of the downloads.
+            folder_path (str, optional): Subfolder of file_path. Defaults to ''.
+            max_workers (int, optional): Files downloaded at the same time. Defaults to 4.
+            config (TransferConfig, optional): Multipart settings within a file. Defaults to DEFAULT_TRANSFER_CONFIG.
+            verify_etag (bool, optional): Compare the MD5 of present files with their ETag. Defaults to False.
+
+        Returns:
+            downloaded: Total number of bytes downloaded.
+        """
+        print(f'Downloading {len(list_files)} files: {list_files[:3]}...')
+        start = time.perf_counter()
+
+        def download(file):
+            # listings from list_folders carry the size and ETag, no head_object needed
+            size, etag = (file[2], file[3]) if len(file) >= 4 else (None, None)
+            return self.download_file_resumable(bucket_name, file[0], file_path, folder_path,
+                                                size=size, etag=etag, config=config,
+                                                verify_etag=verify_etag)
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            downloaded = sum(pool.map(download, list_files))
+
+        elapsed = time.perf_counter() - start
+        print(f'{downloaded / 1024 / 1024:.1f} MB downloaded in {elapsed:.1f}s '
+              f'({downloaded / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/s).')
+        return downloaded
+
+
+def _file_md5(path, block_size=8 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
 
 if __name__ == '__main__':
     # Loading the AWS credentials
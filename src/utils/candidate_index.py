@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+
+def cell_fractions(mask_scaled, downsample, patch_size, level0_size):
+    """Fraction of non-zero mask pixels inside every cell of a patch_size grid
+    laid over level 0. The fractions are computed on the downsampled mask with
+    an integral image, cells smaller than one mask pixel use that pixel.
+
+    Args:
+        mask_scaled: Downsampled mask (2D, or RGB(A) in which case channel 0 is used).
+        downsample: Downsample of mask_scaled with respect to level 0.
+        patch_size: Side of the grid cells in level 0 pixels.
+        level0_size: (width, height) of level 0.
+
+    Returns:
+        fractions: Array of shape (rows, cols) with values in [0, 1].
+    """
+    if mask_scaled.ndim == 3:
+        mask_scaled = mask_scaled[:, :, 0]
+    height, width = mask_scaled.shape
+    integral = cv2.integral((mask_scaled > 0).astype(np.uint8))
+
+    cell = patch_size / downsample
+    cols = level0_size[0] // patch_size
+    rows = level0_size[1] // patch_size
+
+    x0 = np.minimum(np.floor(np.arange(cols) * cell).astype(int), width - 1)
+    x1 = np.clip(np.ceil((np.arange(cols) + 1) * cell).astype(int), x0 + 1, width)
+    y0 = np.minimum(np.floor(np.arange(rows) * cell).astype(int), height - 1)
+    y1 = np.clip(np.ceil((np.arange(rows) + 1) * cell).astype(int), y0 + 1, height)
+
+    counts = (integral[y1][:, x1] - integral[y0][:, x1]
+              - integral[y1][:, x0] + integral[y0][:, x0])
+    areas = np.outer(y1 - y0, x1 - x0)
+
+    return (counts / areas).astype(np.float32)
+
+
+class CandidateIndex:
+    """Patch-size grid over a WSI with the region (tumor or tissue) fraction and,
+    optionally, the fraction of an excluded region (tumor, for normal patches) of
+    every cell. Sampling only draws cells that already pass the threshold, so no
+    level 0 read is spent on a patch that will be rejected.
+    """
+
+    def __init__(self, region_mask, downsample, patch_size, level0_size,
+                 exclude_mask=None, seed=None):
+        self.downsample = downsample
+        self.patch_size = patch_size
+        self.region_fraction = cell_fractions(
+            region_mask, downsample, patch_size, level0_size)
+        self.exclude_fraction = None if exclude_mask is None else cell_fractions(
+            exclude_mask, downsample, patch_size, level0_size)
+        self.rng = np.random.default_rng(seed)
+
+    def bbox_cells(self, bbox):
+        """Grid cells (row, col) covered by a bounding box of the downsampled image."""
+        x, y, w, h = bbox
+        rows, cols = self.region_fraction.shape
+        scale = self.downsample / self.patch_size
+        col0, col1 = int(x * scale), min(int(np.ceil((x + w) * scale)), cols)
+        row0, row1 = int(y * scale), min(int(np.ceil((y + h) * scale)), rows)
+        grid_rows, grid_cols = np.mgrid[row0:row1, col0:col1]
+        return grid_rows.ravel(), grid_cols.ravel()
+
+    def candidates(self, bbox, threshold):
+        rows, cols = self.bbox_cells(bbox)
+        passing = self.region_fraction[rows, cols] > threshold
+        if self.exclude_fraction is not None:
+            passing &= self.exclude_fraction[rows, cols] == 0
+        return rows[passing], cols[passing]
+
+    def sample(self, bbox, threshold, n_samples):
+        """Random passing cells of a bounding box, without replacement, as
+        level 0 (x, y) locations. Fewer than n_samples are returned when the box
+        does not have enough passing cells."""
+        rows, cols = self.candidates(bbox, threshold)
+        order = self.rng.permutation(len(rows))[:n_samples]
+        return [(int(cols[i]) * self.patch_size, int(rows[i]) * self.patch_size)
+                for i in order]
+
+    def fractions(self, locations):
+        """Region fraction of the grid cells of level 0 (x, y) locations."""
+        rows = [y // self.patch_size for _, y in locations]
+        cols = [x // self.patch_size for x, _ in locations]
+        return self.region_fraction[rows, cols].astype(np.float64)
+
+    def decided(self, locations):
+        """True for locations whose grid cell is entirely inside or outside the
+        region on the downsampled mask: their fraction (0 or 1) is the answer
+        and the level 0 patch does not need scoring."""
+        fractions = self.fractions(locations)
+        return (fractions == 0) | (fractions == 1)
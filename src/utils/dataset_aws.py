@@ -14,18 +14,20 @@ GOAL_DATASET = 'CAMELYON17/'
 GOAL_PATH  = os.path.join('..','data')
 STARTING_DOWNLOAD_IDX = 0
 FILES_TO_DOWNLOAD = 10
+# listings are cached here, re-runs don't list the bucket again
+MANIFEST_PATH = os.path.join(GOAL_PATH, 'manifest.json')
 
 aws_handler  = AWSHandler(AWS_ACCESS_KEY_ID, AWS_SECRET_KEY, AWS_REGION)
-folders_utils = aws_handler.list_folders(GOAL_BUCKET)
+folders_utils = aws_handler.list_folders(GOAL_BUCKET, manifest_path=MANIFEST_PATH)
 del folders_utils[0]
-folders_list = aws_handler.list_folders(GOAL_BUCKET, folders=True)
+folders_list = aws_handler.list_folders(GOAL_BUCKET, folders=True, manifest_path=MANIFEST_PATH)
 print(folders_list)
 
 # Mapping files of each folder
-annotations_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[0])
-evaluation_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[1])
-images_list = aws_handler.list_folders(GOAL_BUCKET,folders_list[2])
-masks_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[3])
+annotations_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[0], manifest_path=MANIFEST_PATH)
+evaluation_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[1], manifest_path=MANIFEST_PATH)
+images_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[2], manifest_path=MANIFEST_PATH)
+masks_list = aws_handler.list_folders(GOAL_BUCKET, folders_list[3], manifest_path=MANIFEST_PATH)
 
 # Downloading utils files from dataset
 aws_handler.download_list_file(folders_utils, GOAL_BUCKET, GOAL_PATH)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Subset
+from utils.get_embeddings_pytorch import get_embeddings_streaming
+
+
+def state_dict_hash(model):
+    """SHA-256 of the names, dtypes, shapes and values of a model's state_dict."""
+    sha = hashlib.sha256(type(model).__name__.encode())
+    for name, tensor in sorted(model.state_dict().items()):
+        tensor = tensor.detach().cpu().contiguous()
+        sha.update(f'{name}:{tensor.dtype}:{tuple(tensor.shape)}'.encode())
+        sha.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    return sha.hexdigest()
+
+
+def dataset_identity(dataset):
+    """Description of where a dataset's data comes from (file identity for
+    PCAMDataset, sample paths for ImageFolder, indices for Subset)."""
+    if isinstance(dataset, Subset):
+        indices = hashlib.sha256(np.asarray(dataset.indices).tobytes()).hexdigest()
+        return {'subset': indices, 'of': dataset_identity(dataset.dataset)}
+    identity = {'type': type(dataset).__name__, 'length': len(dataset),
+                'transform': repr(getattr(dataset, 'transform', None)),
+                'normalize': getattr(dataset, 'normalize', None)}
+    for attribute in ('file_path', 'label_path'):
+        path = getattr(dataset, attribute, None)
+        if path:
+            stat = os.stat(path)
+            identity[attribute] = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    if hasattr(dataset, 'samples'):
+        samples = json.dumps(dataset.samples).encode()
+        identity['samples'] = hashlib.sha256(samples).hexdigest()
+    return identity
+
+
+class LayerOutput(nn.Module):
+    """Runs a model and returns the (flattened) output of one of its named modules.
+    The hook is removed from the model by close() (or on leaving a with block)."""
+
+    def __init__(self, model, layer):
+        super(LayerOutput, self).__init__()
+        self.model = model
+        self.output = None
+        self.handle = dict(model.named_modules())[layer].register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, output):
+        self.output = output
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.remove()
+            self.handle = None
+        self.output = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def forward(self, input):
+        self.model(input)
+        return torch.flatten(self.output, 1)
+
+
+class EmbeddingCache:
+    """Content-addressed on-disk cache of embeddings. The key hashes the model
+    weights, the dataset identity (files, transform, normalize) and the layer;
+    hits return memory-mapped tensors without running the model, misses are
+    computed with get_embeddings_streaming. Least recently used entries are
+    evicted once the cache grows over max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, model, dataset, layer=None):
+        description = json.dumps({'model': state_dict_hash(model), 'dataset': dataset_identity(dataset),
+                                  'layer': layer}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()[:32], description
+
+    def get_embeddings(self, model, dataloader, device, layer=None, autocast_dtype=None):
+        """Embeddings and labels of the dataloader's dataset, from the cache when
+        possible (see get_embeddings_pytorch for the arguments).
+
+        Returns:
+            The embeddings and labels as memory-mapped tensors
+        """
+        key, description = self.key(model, dataloader.dataset, layer)
+        entry_path = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_path, 'meta.json')
+
+        if os.path.isfile(meta_path):
+            # mark as recently used
+            os.utime(meta_path)
+            print(f'Embeddings found in cache ({key}).')
+            # copy-on-write maps: writable tensors, the cache files are never modified
+            embeddings = np.load(os.path.join(entry_path, 'embeddings_embeddings.npy'), mmap_mode='c')
+            labels = np.load(os.path.join(entry_path, 'embeddings_labels.npy'), mmap_mode='c')
+            return torch.from_numpy(embeddings), torch.from_numpy(labels)
+
+        os.makedirs(entry_path, exist_ok=True)
+        extractor = model if layer is None else LayerOutput(model, layer)
+        try:
+            embeddings, labels = get_embeddings_streaming(extractor, dataloader, device,
+                                                          os.path.join(entry_path, 'embeddings'),
+                                                          autocast_dtype=autocast_dtype)
+        finally:
+            if layer is not None:
+                # leave the caller's model without our hook
+                extractor.close()
+        with open(meta_path, 'w') as f:
+            json.dump({'description': json.loads(description), 'created': time.time()}, f)
+        self.evict(keep=key)
+        return embeddings, labels
+
+    def entries(self):
+        """(last use, size in bytes, key) of every complete entry, oldest first."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, 'meta.json')
+            if not os.path.isfile(meta_path):
+                continue
+            entry_path = os.path.join(self.cache_dir, key)
+            size = sum(os.path.getsize(os.path.join(entry_path, name)) for name in os.listdir(entry_path))
+            entries.append((os.path.getmtime(meta_path), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key))
+            total -= size
+            print(f'Embeddings {key} evicted from cache.')
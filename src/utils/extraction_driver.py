@@ -0,0 +1,242 @@
+import os
+import queue
+import time
+import multiprocessing as mp
+from typing import Optional
+import cv2
+import numpy as np
+from utils.patch_generator import PatchGenerator, openslide, mir
+from utils.slide_cache import SlideMetadataCache
+from utils.slide_reader import TileCache, level_geometry, read_region_np
+
+# Per-process state, set up once by _init_worker. OpenSlide/ASAP handles are
+# not fork-safe, so every worker opens (and keeps) its own.
+_generator = None
+_handles = {}
+_metadata_cache = None
+
+
+def _init_worker(generator_kwargs, tile_cache_bytes=None, metadata_cache_dir=None):
+    global _generator, _metadata_cache
+    tile_cache = None if tile_cache_bytes is None else TileCache(tile_cache_bytes)
+    _generator = PatchGenerator(**generator_kwargs, tile_cache=tile_cache)
+    if metadata_cache_dir is not None:
+        _metadata_cache = SlideMetadataCache(metadata_cache_dir)
+
+
+def _open_slide(path):
+    if path not in _handles:
+        if _generator.tile_cache is not None or path.startswith('s3://'):
+            # WSI and mask readers of this worker share one tile cache, s3:// slides are read remotely
+            _handles[path] = _generator.open_slide(path)
+            return _handles[path]
+        try:
+            _handles[path] = openslide.OpenSlide(path)
+        except openslide.OpenSlideError:
+            print(f'Openslide extraction failed. Trying with ASAP...')
+            _handles[path] = mir.MultiResolutionImageReader().open(path)
+    return _handles[path]
+
+
+def extract_slide(task, seed=None):
+    """Extracts the patches of one task (a slide, or a share of its bboxes)
+    with the handles and PatchGenerator of the current process.
+
+    Args:
+        task (dict): wsi_path, img_idx, is_tumor and optionally mask_path (mask
+            slide, or XML annotation read as a PolygonMask, with is_camelyon17),
+            part=(k, n) to sample only every n-th contour starting at k and
+            close_handles to close the slide handles when done.
+        seed (optional): Seed of this task, so results don't depend on scheduling.
+
+    Returns:
+        result (dict): Summary of get_patches_indexed plus timing of the task.
+    """
+    start = time.perf_counter()
+    generator = _generator
+    if seed is not None:
+        generator.rng = np.random.default_rng(seed)
+
+    wsi_full_size = _open_slide(task['wsi_path'])
+
+    mask_full_size = None
+    mask_path = task.get('mask_path')
+    if mask_path:
+        if mask_path.endswith('.xml'):
+            # annotation polygons instead of a mask TIFF
+            if mask_path not in _handles:
+                _handles[mask_path] = generator.open_annotation_mask(
+                    mask_path, wsi_full_size, task.get('is_camelyon17', False))
+            mask_full_size = _handles[mask_path]
+        else:
+            mask_full_size = _open_slide(mask_path)
+
+    if _metadata_cache is not None:
+        # masks and contours of a previous run with the same thresholding
+        metadata = _metadata_cache.get(generator, task['wsi_path'], mask_path, wsi_full_size,
+                                       mask_full_size, task.get('is_camelyon17', False))
+        tissue_mask, tumor_mask = metadata['tissue_mask'], metadata['tumor_mask']
+        tissue_contours, tumor_contours = metadata['tissue_contours'], metadata['tumor_contours']
+    else:
+        tissue_mask, tissue_contours = None, ()
+        if not bool(task['is_tumor']):
+            # tumor tasks sample the tumor contours only
+            tissue_mask = generator.stream_tissue_mask(wsi_full_size, 2048, 32)
+            tissue_contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL,
+                                                  cv2.CHAIN_APPROX_SIMPLE)
+        tumor_mask, tumor_contours = None, ()
+        if mask_full_size is not None:
+            mag_level, size, _ = level_geometry(
+                mask_full_size, generator.mag_factor)
+            tumor_mask = read_region_np(mask_full_size, (0, 0), mag_level, size)
+            tumor_contours = generator.get_tumor_contours(tumor_mask)
+
+    if bool(task['is_tumor']):
+        assert tumor_mask is not None
+        contours = tumor_contours
+        region_mask, exclude_mask = tumor_mask, None
+    else:
+        contours = tissue_contours
+        region_mask, exclude_mask = tissue_mask, tumor_mask
+
+    img_idx = task['img_idx']
+    if task.get('part'):
+        k, n = task['part']
+        contours = contours[k::n]
+        img_idx = f'{img_idx}-{k}'
+
+    result = generator.get_patches_indexed(wsi_full_size, task['is_tumor'], img_idx,
+                                           contours, region_mask, exclude_mask)
+    if task.get('close_handles'):
+        # the slide won't come back (e.g. it is deleted after extraction)
+        close_slide(task['wsi_path'])
+        close_slide(task.get('mask_path'))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def close_slide(path):
+    handle = _handles.pop(path, None)
+    if handle is not None and hasattr(handle, 'close'):
+        handle.close()
+
+
+def _worker(generator_kwargs, tile_cache_bytes, metadata_cache_dir, task_queue, result_queue):
+    _init_worker(generator_kwargs, tile_cache_bytes, metadata_cache_dir)
+    while True:
+        item = task_queue.get()
+        if item is None:
+            break
+        task_idx, task, seed = item
+        try:
+            result = extract_slide(task, seed)
+        except Exception as e:
+            result = {'error': repr(e)}
+        result.update(task_idx=task_idx, slide=task['wsi_path'], pid=os.getpid())
+        # blocks when the parent falls behind (bounded queue)
+        result_queue.put(result)
+    # e.g. closes the HDF5 shard of this worker
+    _generator.sink.close()
+
+
+class ExtractionDriver:
+    """Spreads slides (and optionally bbox regions of one slide) across a pool of
+    worker processes. Each worker builds its own PatchGenerator and OpenSlide/ASAP
+    handles once and reuses them for all its tasks (optionally through a per-worker
+    TileCache); results come back through a bounded queue.
+    """
+
+    def __init__(self, generator_kwargs: dict, num_workers: int = os.cpu_count() or 1,
+                 queue_size: int = 16, regions_per_slide: int = 1, seed=None,
+                 tile_cache_bytes: Optional[int] = None, metadata_cache_dir: Optional[str] = None,
+                 poll_seconds: float = 5.0):
+        self.generator_kwargs = generator_kwargs
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.regions_per_slide = regions_per_slide
+        self.seed = seed
+        # size of the per-worker TileCache, None reads the slides directly
+        self.tile_cache_bytes = tile_cache_bytes
+        # SlideMetadataCache folder, None computes the masks and contours on every run
+        self.metadata_cache_dir = metadata_cache_dir
+        # how often the parent checks that workers are still alive while waiting
+        self.poll_seconds = poll_seconds
+
+    def make_tasks(self, slides):
+        """Splits every slide into regions_per_slide tasks (bboxes are dealt
+        round-robin between them)."""
+        if self.regions_per_slide <= 1:
+            return list(slides)
+        return [dict(slide, part=(k, self.regions_per_slide))
+                for slide in slides for k in range(self.regions_per_slide)]
+
+    def run(self, slides):
+        """Extracts patches of all slides.
+
+        Args:
+            slides: List of dicts with wsi_path, img_idx, is_tumor and optionally mask_path.
+
+        Returns:
+            results: One summary per task, in the order tasks were given.
+        """
+        tasks = self.make_tasks(slides)
+        ctx = mp.get_context('spawn')
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue(maxsize=self.queue_size)
+
+        for task_idx, task in enumerate(tasks):
+            seed = None if self.seed is None else (self.seed, task_idx)
+            task_queue.put((task_idx, task, seed))
+        for _ in range(self.num_workers):
+            task_queue.put(None)
+
+        workers = [ctx.Process(target=_worker, args=(self.generator_kwargs, self.tile_cache_bytes,
+                                                          self.metadata_cache_dir, task_queue, result_queue))
+                   for _ in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        results = [None] * len(tasks)
+        received = 0
+        while received < len(tasks):
+            # a worker killed by the OS (OOM, crash in OpenSlide) never answers for
+            # its task, the others keep going until the task queue is empty
+            alive = any(worker.is_alive() for worker in workers)
+            try:
+                result = result_queue.get(timeout=self.poll_seconds)
+            except queue.Empty:
+                if alive:
+                    continue
+                # every worker exited and what they sent before has been read
+                break
+            received += 1
+            results[result['task_idx']] = result
+            if 'error' in result:
+                print(f'Extraction of {result["slide"]} failed: {result["error"]}')
+            else:
+                print(f'{os.path.basename(result["slide"])}: {result["accepted"]} patches in '
+                      f'{result["seconds"]:.1f}s ({result["accepted"] / result["seconds"]:.1f} patches/s, '
+                      f'worker {result["pid"]})')
+
+        for worker in workers:
+            worker.join()
+
+        exit_codes = [worker.exitcode for worker in workers if worker.exitcode]
+        for task_idx, result in enumerate(results):
+            if result is None:
+                results[task_idx] = {'error': f'worker died (exit codes {exit_codes})',
+                                     'task_idx': task_idx, 'slide': tasks[task_idx]['wsi_path']}
+                print(f'Extraction of {tasks[task_idx]["wsi_path"]} failed: worker died '
+                      f'(exit codes {exit_codes}).')
+
+        elapsed = time.perf_counter() - start
+        accepted = sum(r.get('accepted', 0) for r in results)
+        print(f'{len(slides)} slides, {accepted} patches in {elapsed:.1f}s with '
+              f'{self.num_workers} workers ({accepted / elapsed:.1f} patches/s).')
+        duplicates = sum(r.get('duplicates', 0) for r in results)
+        if duplicates:
+            tries = sum(r.get('tries', 0) for r in results)
+            print(f'{duplicates} of {tries} sampled locations rejected as duplicates '
+                  f'({duplicates / max(tries, 1):.1%}).')
+        return results
@@ -1,5 +1,8 @@
+import json
+import os
 import torch
 import numpy as np
+from torch.utils.data import DataLoader, Subset
 
 def get_embeddings_pytorch(model, dataloader, device):
     """Generate embeddings for a PyTorch model used for 
@@ -29,4 +32,81 @@ def get_embeddings_pytorch(model, dataloader, device):
     embeddings = torch.tensor(np.concatenate(embeddings), dtype= torch.float)
     labels = torch.tensor(np.concatenate(labels), dtype=torch.float).reshape(-1,1)
 
-    return embeddings, labels
\ No newline at end of file
+    return embeddings, labels
+
+def get_embeddings_streaming(model, dataloader, device, out_path, autocast_dtype=None,
+                             resume=True, checkpoint_every=50):
+    """Streaming version of get_embeddings_pytorch: every batch is written into
+    preallocated memory-mapped .npy files sized from len(dataloader.dataset),
+    so peak memory stays around one batch and an interrupted run resumes from
+    the last checkpointed batch. The dataloader must not shuffle.
+
+    Args:
+        model: PyTorch model
+        dataloader: Dataloader of the dataset to generate embeddings for (pin_memory
+            makes the host to device copies asynchronous)
+        device: Device where the operation is performed (i.e. GPU or CPU)
+        out_path: Prefix of the output files (_embeddings.npy, _labels.npy)
+        autocast_dtype (optional): torch.bfloat16/torch.float16 to run the model under autocast. Defaults to None.
+        resume (bool, optional): Continue from the progress file of a previous run. Defaults to True.
+        checkpoint_every (int, optional): Batches between progress checkpoints. Defaults to 50.
+
+    Returns:
+        The embeddings and labels, as tensors viewing the memory-mapped files (no copy)
+    """
+    model.eval()
+    num_rows = len(dataloader.dataset)
+    embeddings_path = out_path + '_embeddings.npy'
+    labels_path = out_path + '_labels.npy'
+    progress_path = out_path + '_progress.json'
+
+    rows_done = 0
+    embeddings, labels = None, None
+    if resume and os.path.isfile(embeddings_path):
+        embeddings = np.load(embeddings_path, mmap_mode='r+')
+        labels = np.load(labels_path, mmap_mode='r+')
+        # without a progress file the previous run finished
+        rows_done = num_rows
+        if os.path.isfile(progress_path):
+            with open(progress_path, 'r') as f:
+                rows_done = json.load(f)['rows_done']
+
+    if 0 < rows_done < num_rows:
+        # same loader settings over the rows still missing
+        dataloader = DataLoader(Subset(dataloader.dataset, range(rows_done, num_rows)),
+                                batch_size=dataloader.batch_size, num_workers=dataloader.num_workers,
+                                pin_memory=dataloader.pin_memory, collate_fn=dataloader.collate_fn)
+
+    if rows_done < num_rows:
+        for batch_idx, (data, labels_batch) in enumerate(dataloader):
+            images = data.to(device, non_blocking=True)
+
+            with torch.inference_mode(), torch.autocast(device.type, dtype=autocast_dtype,
+                                                        enabled=autocast_dtype is not None):
+                output = model(images)
+
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(embeddings_path, mode='w+', dtype=np.float32,
+                                                       shape=(num_rows, output.shape[1]))
+                labels = np.lib.format.open_memmap(labels_path, mode='w+', dtype=np.float32,
+                                                   shape=(num_rows, 1))
+                with open(progress_path, 'w') as f:
+                    json.dump({'rows_done': 0}, f)
+
+            batch_rows = len(output)
+            embeddings[rows_done:rows_done + batch_rows] = output.float().cpu().numpy()
+            labels[rows_done:rows_done + batch_rows, 0] = labels_batch.reshape(-1).numpy()
+            rows_done += batch_rows
+
+            if (batch_idx + 1) % checkpoint_every == 0:
+                embeddings.flush()
+                labels.flush()
+                with open(progress_path, 'w') as f:
+                    json.dump({'rows_done': rows_done}, f)
+
+        embeddings.flush()
+        labels.flush()
+        if os.path.isfile(progress_path):
+            os.remove(progress_path)
+
+    return torch.from_numpy(embeddings), torch.from_numpy(labels)
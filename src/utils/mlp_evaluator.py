@@ -1,11 +1,14 @@
 from utils.mlp_classifier import MLP
+from utils.streaming_metrics import StreamingBinaryMetrics
+import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 class MLPEvaluator():
-    def __init__(self, device, batch_size, num_epochs, size_z, learning_rate, betas, num_gpu = 0):
+    def __init__(self, device, batch_size, num_epochs, size_z, learning_rate, betas, num_gpu = 0,
+                 eval_batch_size = 65536, log_every = 50, compile = False):
         # self.model = None
         self.num_gpu = num_gpu
         self.device = device
@@ -14,6 +17,12 @@ class MLPEvaluator():
         self.size_z = size_z
         self.learning_rate = learning_rate
         self.betas = betas
+        # batch size of get_mlp_accuracy (inference only, can be much larger)
+        self.eval_batch_size = eval_batch_size
+        # steps between loss logs of the tensor training loop
+        self.log_every = log_every
+        # wrap the MLP with torch.compile
+        self.compile = compile
     
     def calculate_accuracy(self, predictions, labels):
         # Apply a threshold of 0.5 to convert the sigmoid output to binary predictions (0 or 1)
@@ -26,15 +35,43 @@ class MLPEvaluator():
         return accuracy.item()
 
     def get_mlp_accuracy(self, model, X_test, y_test):
-        model.eval()
-        y_pred = model(X_test.to(self.device))
-
-        accuracy = self.calculate_accuracy(y_pred.cpu(), y_test)
+        metrics = self.evaluate_mlp(model, X_test, y_test)
+        accuracy = metrics['accuracy']
         print('MLP Accuracy:', accuracy)
+        print(f"MLP AUC: {metrics['auc']:.4f}, F1: {metrics['f1']:.4f} "
+              f"(best {metrics['best_f1']:.4f} at {metrics['best_threshold']:.3f})")
 
         return accuracy
-    
-    def train_mlp(self, X,y):
+
+    def evaluate_mlp(self, model, X_test, y_test, num_bins = 1000):
+        """Chunked evaluation of a trained MLP: X_test (e.g. a memory-mapped
+        embeddings tensor) goes through the model eval_batch_size rows at a time
+        under inference_mode and the predictions are accumulated in fixed-size
+        histograms, so memory does not depend on the test set size.
+
+        Args:
+            model: Trained MLP
+            X_test: Embeddings tensor (N, size_z)
+            y_test: Labels tensor (N,) or (N, 1)
+            num_bins (int, optional): Histogram bins (threshold resolution). Defaults to 1000.
+
+        Returns:
+            Dict with accuracy, F1 (0.5 threshold), AUC, best F1 and its threshold, and the threshold sweep
+        """
+        model.eval()
+        metrics = StreamingBinaryMetrics(num_bins, self.device)
+        with torch.inference_mode():
+            for start in range(0, len(X_test), self.eval_batch_size):
+                inputs = X_test[start:start + self.eval_batch_size].to(self.device, torch.float)
+                metrics.update(model(inputs.view(-1, self.size_z)),
+                               y_test[start:start + self.eval_batch_size])
+
+        return metrics.compute()
+
+    def train_mlp(self, X,y, fast = False):
+        if fast and isinstance(X, torch.Tensor) and isinstance(y, torch.Tensor):
+            return self.train_mlp_tensors(X, y)
+
         mlp_loader = DataLoader(list(zip(X,y)), shuffle = True, batch_size= self.batch_size) # type: ignore
 
         mlp = MLP(self.size_z).to(self.device)
@@ -63,4 +100,60 @@ class MLPEvaluator():
                 loop.set_postfix(Loss = mlp_loss.item())
                 mlp_losses.append(mlp_loss.item())
 
-        return mlp, mlp_losses
\ No newline at end of file
+        return mlp, mlp_losses
+
+    def build_mlp(self):
+        mlp = MLP(self.size_z).to(self.device)
+
+        if (self.device.type == 'cuda' and (self.num_gpu > 1)):
+            mlp = nn.DataParallel(mlp, list(range(self.num_gpu)))
+
+        if self.compile:
+            mlp = torch.compile(mlp)
+
+        return mlp
+
+    def train_mlp_tensors(self, X, y):
+        """Same training as train_mlp for embeddings that fit in memory: X and y
+        are moved to the device once, each epoch draws a single randperm and
+        slices the batches from it, and the losses stay on the device (the
+        progress bar is only updated every log_every steps).
+
+        Args:
+            X: Embeddings tensor (N, size_z)
+            y: Labels tensor (N,) or (N, 1)
+
+        Returns:
+            The trained MLP and the loss of every step
+        """
+        X = X.to(self.device, torch.float)
+        y = y.to(self.device, torch.float).view(-1, 1)
+        num_rows = len(X)
+        steps_per_epoch = (num_rows + self.batch_size - 1) // self.batch_size
+
+        mlp = self.build_mlp()
+        criterion = nn.BCELoss()
+        mlp_optimizer = optim.Adam(mlp.parameters(), lr = self.learning_rate, betas= self.betas)
+        mlp_losses = torch.empty(self.num_epochs * steps_per_epoch, device=self.device)
+
+        step = 0
+        for epoch in range(self.num_epochs):
+            permutation = torch.randperm(num_rows, device=self.device)
+            loop = tqdm(range(steps_per_epoch))
+            loop.set_description(f"Epoch [{epoch+1}/{self.num_epochs}]")
+            for batch in loop:
+                indices = permutation[batch * self.batch_size:(batch + 1) * self.batch_size]
+                mlp_optimizer.zero_grad(set_to_none=True)
+                output = mlp(X[indices])
+                mlp_loss = criterion(output, y[indices])
+
+                mlp_loss.backward()
+
+                mlp_optimizer.step()
+
+                mlp_losses[step] = mlp_loss.detach()
+                step += 1
+                if step % self.log_every == 0:
+                    loop.set_postfix(Loss = mlp_losses[step - self.log_every:step].mean().item())
+
+        return mlp, mlp_losses.tolist()
@@ -0,0 +1,309 @@
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.nn.functional as F
+from utils.mlp_classifier import MLP
+
+# per worker embeddings (shared memory) and validation split
+_X = None
+_y = None
+_train_idx = None
+_val_idx = None
+
+
+def grid(**params):
+    """All combinations of the given values, e.g.
+    grid(learning_rate=[1e-3, 1e-4], betas=[(0.9, 0.999)], batch_size=[256], num_epochs=[20])."""
+    keys = list(params)
+    return [dict(zip(keys, values)) for values in itertools.product(*params.values())]
+
+
+class BatchedMLP(nn.Module):
+    """K independent MLPs (same layers as MLP(size_z)) stacked along a leading
+    member dimension: one matmul per layer trains all of them at once.
+    """
+
+    def __init__(self, num_members, size_z, generator=None):
+        super(BatchedMLP, self).__init__()
+        self.num_members = num_members
+        self.size_z = size_z
+        sizes = [size_z, int(size_z / 2), int(size_z / 4), 1]
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+            # same bounds as the default nn.Linear initialization
+            bound = 1 / math.sqrt(fan_in)
+            self.weights.append(nn.Parameter(
+                (torch.rand(num_members, fan_in, fan_out, generator=generator) * 2 - 1) * bound))
+            self.biases.append(nn.Parameter(
+                (torch.rand(num_members, 1, fan_out, generator=generator) * 2 - 1) * bound))
+
+    def forward(self, input):
+        """(B, size_z) or (K, B, size_z) -> (K, B, 1)"""
+        output = input
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            output = torch.matmul(output, weight) + bias
+            if layer < len(self.weights) - 1:
+                output = torch.relu(output)
+        return torch.sigmoid(output)
+
+    def member(self, k):
+        """MLP with the weights of member k."""
+        mlp = MLP(self.size_z)
+        linears = [module for module in mlp.layers if isinstance(module, nn.Linear)]
+        with torch.no_grad():
+            for linear, weight, bias in zip(linears, self.weights, self.biases):
+                linear.weight.copy_(weight[k].T)
+                linear.bias.copy_(bias[k, 0])
+        return mlp
+
+
+class BatchedAdam:
+    """Adam over the parameters of a BatchedMLP with a learning rate and betas per
+    member. Members outside the active mask are left untouched."""
+
+    def __init__(self, params, learning_rates, betas, eps=1e-8):
+        self.params = list(params)
+        device = self.params[0].device
+        self.lr = torch.tensor(learning_rates, dtype=torch.float, device=device)
+        betas = torch.tensor(betas, dtype=torch.float, device=device)
+        self.beta1, self.beta2 = betas[:, 0], betas[:, 1]
+        self.eps = eps
+        self.steps = torch.zeros(len(self.lr), device=device)
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self, active):
+        self.steps += active.float()
+        steps = self.steps.clamp(min=1)
+        bias_correction1 = 1 - self.beta1 ** steps
+        bias_correction2 = 1 - self.beta2 ** steps
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            mask = active.view(shape)
+            beta1, beta2 = self.beta1.view(shape), self.beta2.view(shape)
+            exp_avg.copy_(torch.where(mask, beta1 * exp_avg + (1 - beta1) * p.grad, exp_avg))
+            exp_avg_sq.copy_(torch.where(mask, beta2 * exp_avg_sq + (1 - beta2) * p.grad ** 2,
+                                         exp_avg_sq))
+            update = (self.lr.view(shape) * (exp_avg / bias_correction1.view(shape)) /
+                      ((exp_avg_sq / bias_correction2.view(shape)).sqrt() + self.eps))
+            p.sub_(torch.where(mask, update, torch.zeros_like(update)))
+
+
+def train_stacked(configs, X, y, train_idx, val_idx=None, device=torch.device('cpu'),
+                  patience=None, min_delta=0.0, eval_batch_size=65536, seed=0):
+    """Trains one BatchedMLP member per configuration. All configurations must share
+    batch_size (each step uses the same minibatch for every member); num_epochs can
+    differ, members simply stop updating after their last epoch.
+
+    Args:
+        configs: List of dicts with learning_rate, betas, batch_size and num_epochs
+        X: Embeddings (N, size_z)
+        y: Labels (N,) or (N, 1)
+        train_idx: Rows used for training
+        val_idx (optional): Rows of the validation split. Defaults to None (no early stopping).
+        device (optional): Device where the training is performed. Defaults to CPU.
+        patience (optional): Epochs without validation improvement before a member stops. Defaults to None.
+        min_delta (float, optional): Smallest validation loss decrease counted as improvement. Defaults to 0.0.
+        eval_batch_size (int, optional): Rows per validation forward pass. Defaults to 65536.
+        seed (int, optional): Seed of the initialization and shuffling. Defaults to 0.
+
+    Returns:
+        A result dict per configuration, and the BatchedMLP holding the best weights of every member
+    """
+    start = time.perf_counter()
+    batch_size = configs[0]['batch_size']
+    assert all(config['batch_size'] == batch_size for config in configs)
+    num_members = len(configs)
+    generator = torch.Generator().manual_seed(seed)
+
+    X_train = X[train_idx].to(device, torch.float)
+    y_train = y[train_idx].to(device, torch.float).view(-1, 1)
+    model = BatchedMLP(num_members, X.shape[1], generator).to(device)
+    best = BatchedMLP(num_members, X.shape[1]).to(device)
+    best.load_state_dict(model.state_dict())
+    optimizer = BatchedAdam(model.parameters(), [config['learning_rate'] for config in configs],
+                            [config['betas'] for config in configs])
+
+    num_epochs = torch.tensor([config['num_epochs'] for config in configs], device=device)
+    stopped = torch.zeros(num_members, dtype=torch.bool, device=device)
+    bad_epochs = torch.zeros(num_members, dtype=torch.long, device=device)
+    epochs_run = torch.zeros(num_members, dtype=torch.long, device=device)
+    best_epoch = torch.zeros(num_members, dtype=torch.long, device=device)
+    best_loss = torch.full((num_members,), float('inf'), device=device)
+    best_accuracy = torch.full((num_members,), float('nan'), device=device)
+    train_loss = torch.full((num_members,), float('nan'), device=device)
+
+    num_rows = len(X_train)
+    steps_per_epoch = (num_rows + batch_size - 1) // batch_size
+    for epoch in range(int(num_epochs.max())):
+        active = (epoch < num_epochs) & ~stopped
+        if not active.any():
+            break
+        permutation = torch.randperm(num_rows, generator=generator).to(device)
+        epoch_loss = torch.zeros(num_members, device=device)
+        for step in range(steps_per_epoch):
+            indices = permutation[step * batch_size:(step + 1) * batch_size]
+            output = model(X_train[indices])
+            target = y_train[indices].expand(num_members, -1, -1)
+            losses = F.binary_cross_entropy(output, target, reduction='none').mean(dim=(1, 2))
+            optimizer.zero_grad()
+            # members are independent, the gradient of the sum is each member's own gradient
+            losses.sum().backward()
+            optimizer.step(active)
+            epoch_loss += losses.detach()
+        train_loss = torch.where(active, epoch_loss / steps_per_epoch, train_loss)
+        epochs_run += active.long()
+
+        if val_idx is None:
+            improved = active
+            val_loss, val_accuracy = best_loss, best_accuracy
+        else:
+            val_loss, val_accuracy = evaluate_stacked(model, X[val_idx], y[val_idx], device,
+                                                      eval_batch_size)
+            improved = active & (val_loss < best_loss - min_delta)
+        best_loss = torch.where(improved, val_loss, best_loss)
+        best_accuracy = torch.where(improved, val_accuracy, best_accuracy)
+        best_epoch = torch.where(improved, torch.full_like(best_epoch, epoch + 1), best_epoch)
+        with torch.no_grad():
+            for p, best_p in zip(model.parameters(), best.parameters()):
+                mask = improved.view((-1,) + (1,) * (p.dim() - 1))
+                best_p.copy_(torch.where(mask, p, best_p))
+        if patience is not None:
+            bad_epochs = torch.where(improved, torch.zeros_like(bad_epochs), bad_epochs + active.long())
+            stopped |= bad_epochs >= patience
+
+    seconds = time.perf_counter() - start
+    results = []
+    for k, config in enumerate(configs):
+        results.append(dict(config, epochs_run=int(epochs_run[k]), best_epoch=int(best_epoch[k]),
+                            train_loss=float(train_loss[k]),
+                            val_loss=float(best_loss[k]) if val_idx is not None else float('nan'),
+                            val_accuracy=float(best_accuracy[k]), members_stacked=num_members,
+                            seconds=seconds))
+    return results, best
+
+
+@torch.no_grad()
+def evaluate_stacked(model, X, y, device, eval_batch_size=65536):
+    """Mean BCE loss and accuracy (0.5 threshold) of every member, (K,) each."""
+    total_loss = torch.zeros(model.num_members, device=device)
+    correct = torch.zeros(model.num_members, device=device)
+    for start in range(0, len(X), eval_batch_size):
+        output = model(X[start:start + eval_batch_size].to(device, torch.float))
+        target = y[start:start + eval_batch_size].to(device, torch.float).view(1, -1, 1)
+        target = target.expand(model.num_members, -1, -1)
+        total_loss += F.binary_cross_entropy(output, target, reduction='none').sum(dim=(1, 2))
+        correct += ((output >= 0.5).float() == target).float().sum(dim=(1, 2))
+    return total_loss / len(X), correct / len(X)
+
+
+def _init_worker(X, y, train_idx, val_idx, num_threads):
+    global _X, _y, _train_idx, _val_idx
+    _X, _y, _train_idx, _val_idx = X, y, train_idx, val_idx
+    torch.set_num_threads(num_threads)
+
+
+def _train_group(configs, options):
+    results, best = train_stacked(configs, _X, _y, _train_idx, _val_idx, **options)
+    return results, [best.member(k).state_dict() for k in range(len(configs))]
+
+
+class MLPSweep:
+    """Trains many MLPEvaluator configurations (learning_rate, betas, batch_size,
+    num_epochs) over the same embeddings. Configurations with the same schedule
+    (batch_size) are stacked into one BatchedMLP; the stacked groups run in a
+    process pool whose workers share the embeddings through shared memory.
+    Optionally stops each member early on a validation split.
+    """
+
+    def __init__(self, device=torch.device('cpu'), num_workers: int = os.cpu_count() or 1,
+                 val_fraction: float = 0.1, patience=None, min_delta: float = 0.0,
+                 max_group_size=None, eval_batch_size: int = 65536, seed: int = 0):
+        self.device = device
+        # pool of processes for CPU sweeps, 0 runs the groups one after another here
+        self.num_workers = num_workers if device.type == 'cpu' else 0
+        self.val_fraction = val_fraction
+        self.patience = patience
+        self.min_delta = min_delta
+        # splits large groups so they spread over the workers
+        self.max_group_size = max_group_size
+        self.eval_batch_size = eval_batch_size
+        self.seed = seed
+        self.models = {}
+
+    def groups(self, configs):
+        """Indices of the configurations trained together."""
+        groups = {}
+        for i, config in enumerate(configs):
+            groups.setdefault(config['batch_size'], []).append(i)
+        groups = list(groups.values())
+        max_group_size = self.max_group_size
+        if max_group_size is None and self.num_workers > len(groups):
+            # enough workers left to split the groups between them
+            max_group_size = math.ceil(len(configs) / self.num_workers)
+        if max_group_size:
+            groups = [group[start:start + max_group_size] for group in groups
+                      for start in range(0, len(group), max_group_size)]
+        return groups
+
+    def split(self, num_rows):
+        permutation = torch.randperm(num_rows, generator=torch.Generator().manual_seed(self.seed))
+        num_val = int(num_rows * self.val_fraction)
+        if num_val == 0:
+            return permutation, None
+        return permutation[num_val:], permutation[:num_val]
+
+    def run(self, X, y, configs):
+        """Trains every configuration.
+
+        Args:
+            X: Embeddings tensor (N, size_z), size_z is the input of every MLP
+            y: Labels tensor (N,) or (N, 1)
+            configs: List of dicts with learning_rate, betas, batch_size and num_epochs (see grid)
+
+        Returns:
+            A pandas DataFrame with a row per configuration (same order); the MLP with the
+            best validation loss of configuration i is stored in self.models[i]
+        """
+        train_idx, val_idx = self.split(len(X))
+        groups = self.groups(configs)
+        options = dict(patience=self.patience, min_delta=self.min_delta,
+                       eval_batch_size=self.eval_batch_size, seed=self.seed)
+        rows = [None] * len(configs)
+
+        def collect(group, results, states):
+            for i, result, state in zip(group, results, states):
+                rows[i] = result
+                self.models[i] = MLP(X.shape[1])
+                self.models[i].load_state_dict(state)
+
+        if self.num_workers == 0:
+            for group in groups:
+                results, best = train_stacked([configs[i] for i in group], X, y, train_idx, val_idx,
+                                              device=self.device, **options)
+                collect(group, results, [best.member(k).state_dict() for k in range(len(group))])
+        else:
+            X, y = X.float().share_memory_(), y.float().share_memory_()
+            num_workers = min(self.num_workers, len(groups))
+            num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+            with ProcessPoolExecutor(num_workers, mp_context=mp.get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(X, y, train_idx, val_idx, num_threads)) as pool:
+                futures = [pool.submit(_train_group, [configs[i] for i in group], options)
+                           for group in groups]
+                for group, future in zip(groups, futures):
+                    collect(group, *future.result())
+
+        return pd.DataFrame(rows)
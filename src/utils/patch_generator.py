@@ -3,23 +3,18 @@ from PIL import Image
 from PIL import TiffImagePlugin
 import numpy as np
 import cv2
-# Comes from ASAP library (PATH HAS TO BE DEFINED in the script the class is defined.)
-import multiresolutionimageinterface as mir  # type: ignore
 import os
-import random
-
-# Getting the openslide tools for windows
-# OPENSLIDE_PATH = r'D:\kuleuven\thesis\openslide-win64\bin'
-OPENSLIDE_PATH = os.path.join(
-    'D:', os.sep, 'kuleuven', 'thesis', 'openslide-win64-20171122', 'bin')
-if hasattr(os, 'add_dll_directory'):
-    # Python >= 3.8 on Windows
-    with os.add_dll_directory(OPENSLIDE_PATH):
-        import openslide  # type: ignore
-        # print(f'OpenSlide version: {openslide.__version__}')
-        print(f'OpenSlide library version: {openslide.__library_version__}')
-else:
-    import openslide  # type: ignore
+
+from utils.candidate_index import CandidateIndex
+from utils.region_reader import BatchedRegionReader
+# OpenSlide (Windows DLL path) and ASAP are imported once, in slide_reader
+from utils.slide_reader import CachedSlideReader, TileCache, level_geometry, mir, openslide, read_region_np
+from utils.patch_sink import AsyncPatchSink, FilePatchSink, PatchSink, PNGPatchSink
+from utils.patch_scoring import tissue_fractions, tumor_fractions
+from utils.annotation_raster import AnnotationRasterizer
+from utils.polygon_mask import PolygonMask
+from utils.remote_slide import RemoteSlide, parse_s3_url
+from utils.spatial_hash import SpatialHash
 
 
 class PatchGenerator:
@@ -34,7 +29,17 @@ class PatchGenerator:
                  tumor_threshold: float,
                  adaptive_quant: int,
                  lower_bound,
-                 upper_bound):
+                 upper_bound,
+                 close_kernel_size: int = 20,
+                 open_kernel_size: int = 5,
+                 seed: Optional[int] = None,
+                 max_tries: int = 1000,
+                 sink: Optional[PatchSink] = None,
+                 tile_cache: Optional[TileCache] = None,
+                 s3_client=None,
+                 codec: str = 'png',
+                 writer_threads: int = 0,
+                 max_overlap: Optional[float] = None):
 
         self.image_path = image_path
         self.annotation_path = annotation_path
@@ -50,6 +55,21 @@ class PatchGenerator:
             if not os.path.isdir(self.patch_pos_path) or not os.path.isdir(self.patch_neg_path):
                 raise e
 
+        # where accepted patches are written (PNG files by default), optionally
+        # with another codec and encoded on writer_threads background threads
+        if sink is None and codec == 'png' and writer_threads == 0:
+            sink = PNGPatchSink(self.patch_pos_path, self.patch_neg_path)
+        elif sink is None:
+            sink = FilePatchSink(self.patch_pos_path, self.patch_neg_path, codec)
+        if writer_threads > 0:
+            sink = AsyncPatchSink(sink, writer_threads)
+        self.sink = sink
+
+        # decoded tiles shared by the WSI and mask readers (None reads OpenSlide directly)
+        self.tile_cache = tile_cache
+        # client of the s3://bucket/key slides (RemoteSlide), created on first use if None
+        self.s3_client = s3_client
+
         # Patch atrributes
         self.mag_factor = mag_factor                # magnification factor
         self.patches_per_bbox = patches_per_bbox    # number of samples per bounding box
@@ -60,9 +80,35 @@ class PatchGenerator:
         self.tumor_threshold = tumor_threshold
         self.lower_bound = lower_bound              # RGB min threshold for colors
         self.upper_bound = upper_bound              # RGB max threshold for colors
+        # morphology kernels used by extract_tissue
+        self.close_kernel_size = close_kernel_size
+        self.open_kernel_size = open_kernel_size
+        # seeded sampler of every method and cap on failed tries per bbox
+        self.rng = np.random.default_rng(seed)
+        self.max_tries = max_tries
+        # largest overlap fraction between two patches of a slide, None allows duplicates
+        self.max_overlap = max_overlap
+
+    def open_slide(self, wsi_path):
+        """CachedSlideReader on the shared tile cache, or a plain OpenSlide
+        handle when the generator has no tile cache. s3://bucket/key paths are
+        read remotely with RemoteSlide (only the needed tiles are fetched)."""
+        if wsi_path.startswith('s3://'):
+            bucket, key = parse_s3_url(wsi_path)
+            return RemoteSlide(self.get_s3_client(), bucket, key, self.tile_cache)
+        if self.tile_cache is not None:
+            return CachedSlideReader(wsi_path, self.tile_cache)
+        return openslide.OpenSlide(wsi_path)
+
+    def get_s3_client(self):
+        """Client of the s3:// slides, created on first use if none was given."""
+        if self.s3_client is None:
+            import boto3
+            self.s3_client = boto3.client('s3')
+        return self.s3_client
 
     def read_wsi(self, wsi_path):
-        wsi_full_size = openslide.OpenSlide(wsi_path)
+        wsi_full_size = self.open_slide(wsi_path)
 
         mag_level = wsi_full_size.get_best_level_for_downsample(
             self.mag_factor)
@@ -84,6 +130,67 @@ class PatchGenerator:
 
         return wsi_full_size, wsi_scaled
 
+    def read_tissue_mask(self, wsi_path, tile_size: int = 2048, halo: int = 32):
+        """Streaming alternative to read_wsi + get_tissue_contours. The
+        downsampled level is read in tiles and only the binary tissue mask is
+        stitched, so peak memory depends on tile_size instead of slide size.
+
+        Args:
+            wsi_path: Path of the WSI.
+            tile_size (int, optional): Side of the tiles read from the downsampled level. Defaults to 2048.
+            halo (int, optional): Extra pixels read around each tile so the morphology
+                matches the full-level path. Defaults to 32.
+
+        Returns:
+            wsi_full_size, tissue_mask, tissue_contours
+        """
+        min_halo = self.close_kernel_size + self.open_kernel_size
+        if halo < min_halo:
+            raise ValueError(
+                f'halo must be at least {min_halo} pixels to match the full-level morphology.')
+
+        wsi_full_size = self.open_slide(wsi_path)
+        try:
+            tissue_mask = self.stream_tissue_mask(
+                wsi_full_size, tile_size, halo)
+        except openslide.OpenSlideError as e:
+            print(f'Openslide extraction failed. Trying with ASAP...')
+            reader = mir.MultiResolutionImageReader()
+            wsi_full_size = reader.open(wsi_path)
+            tissue_mask = self.stream_tissue_mask(
+                wsi_full_size, tile_size, halo)
+
+        tissue_contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL,
+                                              cv2.CHAIN_APPROX_SIMPLE)
+
+        return wsi_full_size, tissue_mask, tissue_contours
+
+    def stream_tissue_mask(self, slide, tile_size: int, halo: int):
+        mag_level, (width, height), downsample = level_geometry(
+            slide, self.mag_factor)
+        tissue_mask = np.zeros((height, width), dtype=np.uint8)
+
+        for y in range(0, height, tile_size):
+            for x in range(0, width, tile_size):
+                # tile plus halo, clipped to the level bounds
+                x0, y0 = max(x - halo, 0), max(y - halo, 0)
+                x1 = min(x + tile_size + halo, width)
+                y1 = min(y + tile_size + halo, height)
+
+                # read_region expects the location in level 0 coordinates
+                tile = read_region_np(slide, (round(x0 * downsample), round(y0 * downsample)),
+                                      mag_level, (x1 - x0, y1 - y0))
+                tissue_tile = self.extract_tissue(
+                    cv2.cvtColor(tile, cv2.COLOR_BGR2HSV))
+
+                # keep the core of the tile only, the halo is discarded
+                core_w = min(tile_size, width - x)
+                core_h = min(tile_size, height - y)
+                tissue_mask[y:y + core_h, x:x + core_w] = \
+                    tissue_tile[y - y0:y - y0 + core_h, x - x0:x - x0 + core_w]
+
+        return tissue_mask
+
     def get_tissue_contours(self, wsi_scaled):
         hsv_img = cv2.cvtColor(wsi_scaled, cv2.COLOR_BGR2HSV)
         tissue_img = self.extract_tissue(hsv_img)
@@ -95,8 +202,10 @@ class PatchGenerator:
     def extract_tissue(self, hsv_img):
         tissue_mask = cv2.inRange(hsv_img, self.lower_bound, self.upper_bound)
 
-        kernel_close = np.ones((20, 20), dtype=np.uint8)
-        kernel_open = np.ones((5, 5), dtype=np.uint8)
+        kernel_close = np.ones(
+            (self.close_kernel_size, self.close_kernel_size), dtype=np.uint8)
+        kernel_open = np.ones(
+            (self.open_kernel_size, self.open_kernel_size), dtype=np.uint8)
 
         image_closed = cv2.morphologyEx(np.array(tissue_mask), cv2.MORPH_CLOSE,
                                         kernel_close)
@@ -118,148 +227,280 @@ class PatchGenerator:
             i for i in bounding_boxes if i[2] > 10 and i[3] > 10]
         return bounding_boxes_big
 
+    def new_spacing(self):
+        """SpatialHash of one slide enforcing max_overlap (None when disabled)."""
+        if self.max_overlap is None:
+            return None
+        return SpatialHash(self.patch_size, self.max_overlap)
+
+    def report_spacing(self, spacing, img_idx):
+        if spacing is not None:
+            print(f'{spacing.duplicates} of {spacing.checks} sampled locations of image {img_idx} '
+                  f'rejected as duplicates ({spacing.duplicate_rate:.1%}).')
+
+    def random_locations(self, bbox, n):
+        """n random level 0 locations of a downsampled bounding box (edges included)."""
+        x, y, w, h = bbox
+        xs = self.rng.integers(x, x + w + 1, n) * self.mag_factor
+        ys = self.rng.integers(y, y + h + 1, n) * self.mag_factor
+        return [(int(real_x), int(real_y)) for real_x, real_y in zip(xs, ys)]
+
+    def mask_fractions(self, mask_full_size, locations):
+        """Tumor fractions (channel 0 sum / 255) of the level 0 patches of a mask."""
+        size = (self.patch_size, self.patch_size)
+        if hasattr(mask_full_size, 'fractions'):
+            # polygon mask, no mask read needed
+            return mask_full_size.fractions(locations, size)
+        return tumor_fractions(np.stack(
+            [read_region_np(mask_full_size, location, 0, size) for location in locations]))
+
+    def spaced(self, spacing, locations):
+        """Locations far enough from the accepted patches (all of them without spacing)."""
+        return locations if spacing is None else spacing.filter(locations)
+
     def get_tumor_patches_const(self, wsi_full_size, mask_full_size, img_idx,
                                 tumor_contours):
 
         patch_idx = 0
+        spacing = self.new_spacing()
+        size = (self.patch_size, self.patch_size)
 
         for bbox in self.get_bbox(tumor_contours):
             # tumor bounding box
-            x, y, w, h = bbox
             patch_in_box = 0
-
-            # sample until desired number of patches is reached (constant)
-            while (patch_in_box < self.patches_per_bbox):
-                # start from a random point within downsampled bounding box
-                rand_x = random.randint(x, x+w)
-                rand_y = random.randint(y, y+h)
-
-                # calculate point same point for full size WSI
-                real_x = rand_x * self.mag_factor
-                real_y = rand_y * self.mag_factor
-
-                # extract mask for selected patch
-                mask_patch = mask_full_size.read_region((real_x, real_y), 0,
-                                                        (self.patch_size, self.patch_size))
-                mask_patch_np = np.array(mask_patch)[:, :, 0]
-
-                # check what proportion of patch is tumor
-                tumor_percent = (mask_patch_np.sum(axis=0).sum(
-                    axis=0)/255)/(self.patch_size*self.patch_size)
-                mask_patch.close()
+            failed = 0
+
+            # sample until desired number of patches is reached (constant), one
+            # batch of random points per round, scored together; every failed
+            # try counts, a bbox without enough passing points gives up after max_tries
+            while (patch_in_box < self.patches_per_bbox and failed < self.max_tries):
+                candidates = self.random_locations(bbox, self.patches_per_bbox - patch_in_box)
+                # too close to an accepted patch, skipped before any read
+                locations = self.spaced(spacing, candidates)
+                failed += len(candidates) - len(locations)
+                if not locations:
+                    continue
 
                 # save patch only if threshold for tumor proportion is met
-                if (tumor_percent > self.tumor_threshold):
-                    wsi_patch = wsi_full_size.read_region((real_x, real_y), 0,
-                                                          (self.patch_size, self.patch_size))
-                    wsi_patch.save(self.patch_pos_path +
-                                   img_idx + '_' + str(patch_idx), 'PNG')
+                passing = self.mask_fractions(mask_full_size, locations) > self.tumor_threshold
+                failed += int(np.count_nonzero(~passing))
+                for location, keep in zip(locations, passing):
+                    if not keep:
+                        continue
+                    wsi_patch = read_region_np(wsi_full_size, location, 0, size)
+                    self.sink.write(wsi_patch, True, img_idx, location, patch_idx)
                     patch_idx += 1
                     patch_in_box += 1
-                    wsi_patch.close()
+                    if spacing is not None:
+                        spacing.add(location)
 
+        self.sink.flush()
+        self.report_spacing(spacing, img_idx)
         return 0
 
     def get_normalT_patches_const(self, wsi_full_size, mask_full_size, img_idx,
                                   tissue_contours):
 
         patch_idx = 0
+        spacing = self.new_spacing()
+        size = (self.patch_size, self.patch_size)
 
         for bbox in self.get_bbox(tissue_contours):
             # tissue bounidng box
-            x, y, w, h = bbox
             patch_in_box = 0
+            failed = 0
 
             # sample until desired number of patches is reached (constant)
-            while (patch_in_box < self.patches_per_bbox):
-                rand_x = random.randint(x, x+w)
-                rand_y = random.randint(y, y+h)
-
-                real_x = rand_x * self.mag_factor
-                real_y = rand_y * self.mag_factor
-
-                # extract mask for selected patch
-                mask_patch = mask_full_size.read_region((real_x, real_y), 0,
-                                                        (self.patch_size, self.patch_size))
-                mask_patch_np = np.array(mask_patch)[:, :, 0]
-                mask_patch.close()
-
-                # only continue if patch has no cancerous tissue
-                if (mask_patch_np.sum(axis=0).sum(axis=0) == 0):
-                    # extract selected patch
-                    wsi_patch = wsi_full_size.read_region((real_x, real_y), 0,
-                                                          (self.patch_size, self.patch_size))
-                    hsv_patch = cv2.cvtColor(
-                        np.array(wsi_patch), cv2.COLOR_BGR2HSV)
-
-                    tissue_patch = self.extract_tissue(hsv_patch)
-
-                    # check what proportion of patch is tissue
-                    tissue_percent = (tissue_patch.sum(axis=0).sum(
-                        axis=0)/255)/(self.patch_size*self.patch_size)
-
-                    # save patch only if threshold for tissue proportion is met
-                    if (tissue_percent > self.tumor_threshold):
-                        wsi_patch.save(self.patch_neg_path +
-                                       img_idx + '_T' + str(patch_idx), 'PNG')
-                        patch_idx += 1
-                        patch_in_box += 1
-                        wsi_patch.close()
-                        print('Saving')
+            while (patch_in_box < self.patches_per_bbox and failed < self.max_tries):
+                candidates = self.random_locations(bbox, self.patches_per_bbox - patch_in_box)
+                locations = self.spaced(spacing, candidates)
+                failed += len(candidates) - len(locations)
+                if not locations:
+                    continue
+
+                # only continue with patches that have no cancerous tissue
+                clean = self.mask_fractions(mask_full_size, locations) == 0
+                failed += int(np.count_nonzero(~clean))
+                locations = [location for location, keep in zip(locations, clean) if keep]
+                if not locations:
+                    continue
+
+                # check what proportion of every patch is tissue
+                wsi_patches = np.stack([read_region_np(wsi_full_size, location, 0, size)
+                                        for location in locations])
+                passing = tissue_fractions(wsi_patches, self.lower_bound, self.upper_bound,
+                                           self.close_kernel_size, self.open_kernel_size) > self.tumor_threshold
+                failed += int(np.count_nonzero(~passing))
+
+                # save patch only if threshold for tissue proportion is met
+                for location, wsi_patch, keep in zip(locations, wsi_patches, passing):
+                    if not keep:
+                        continue
+                    self.sink.write(wsi_patch, False, img_idx, location, patch_idx)
+                    patch_idx += 1
+                    patch_in_box += 1
+                    if spacing is not None:
+                        spacing.add(location)
+                    print('Saving')
 
+        self.sink.flush()
+        self.report_spacing(spacing, img_idx)
         return 0
 
     def get_patches(self, wsi_full_size: Union[openslide.OpenSlide, mir.MultiResolutionImage], is_tumor, img_idx, tissue_contours, mask_full_size: Optional[Union[openslide.OpenSlide, mir.MultiResolutionImage]] = None):
         patch_idx = 0
+        spacing = self.new_spacing()
+        size = (self.patch_size, self.patch_size)
 
         for bbox in self.get_bbox(tissue_contours):
-            x, y, w, h = bbox
             patch_in_box = 0
+            failed = 0
 
-            while (patch_in_box < self.patches_per_bbox):
-                rand_x = random.randint(x, x+w)
-                rand_y = random.randint(y, y+h)
-
-                real_x = rand_x * self.mag_factor
-                real_y = rand_y * self.mag_factor
-
-                image_proportion_percent = 0
-
-                wsi_patch = wsi_full_size.read_region(
-                    (real_x, real_y), 0, (self.patch_size, self.patch_size))
-                patch_path = ''
+            # every failed try counts, a bbox without enough passing points gives up after max_tries
+            while (patch_in_box < self.patches_per_bbox and failed < self.max_tries):
+                candidates = self.random_locations(bbox, self.patches_per_bbox - patch_in_box)
+                locations = self.spaced(spacing, candidates)
+                failed += len(candidates) - len(locations)
+                if not locations:
+                    continue
 
                 if bool(is_tumor):
                     assert mask_full_size is not None
-                    mask_patch = mask_full_size.read_region(
-                        (real_x, real_y), 0, (self.patch_size, self.patch_size))
-                    mask_patch_np = np.array(mask_patch)[:, :, 0]
-
-                    patch_path = os.path.join(
-                        self.patch_pos_path, f'{img_idx}_T_{patch_idx}.PNG')
-                    # check what proportion of patch is tumor
-                    image_proportion_percent = (mask_patch_np.sum(axis=0).sum(
-                        axis=0)/255)/(self.patch_size*self.patch_size)
-                    mask_patch.close()
-
+                    # check what proportion of every patch is tumor, WSI read for the passing ones only
+                    passing = self.mask_fractions(mask_full_size, locations) > self.tumor_threshold
+                    wsi_patches = [read_region_np(wsi_full_size, location, 0, size) if keep else None
+                                   for location, keep in zip(locations, passing)]
                 else:
-                    cvt_image = self.extract_tissue(cv2.cvtColor(
-                        np.array(wsi_patch), cv2.COLOR_BGR2HSV))
-                    patch_path = os.path.join(
-                        self.patch_neg_path, f'{img_idx}_N_{patch_idx}.PNG')
-                    image_proportion_percent = (cvt_image.sum(axis=0).sum(
-                        axis=0)/255)/(self.patch_size*self.patch_size)
+                    wsi_patches = np.stack([read_region_np(wsi_full_size, location, 0, size)
+                                            for location in locations])
+                    passing = tissue_fractions(wsi_patches, self.lower_bound, self.upper_bound,
+                                               self.close_kernel_size, self.open_kernel_size) > self.tumor_threshold
+                failed += int(np.count_nonzero(~passing))
 
                 # extract selected patch if meets criteria
-                if (image_proportion_percent > self.tumor_threshold):
-                    wsi_patch.save(patch_path, 'PNG')
+                for location, wsi_patch, keep in zip(locations, wsi_patches, passing):
+                    if not keep:
+                        continue
+                    patch_path = self.sink.write(wsi_patch, is_tumor, img_idx,
+                                                 location, patch_idx)
                     patch_idx += 1
                     patch_in_box += 1
-                    wsi_patch.close()
+                    if spacing is not None:
+                        spacing.add(location)
                     print(
                         f'Patch {patch_idx} from image {img_idx} was saved in {patch_path} succesfully.')
+            self.sink.flush()
+            self.report_spacing(spacing, img_idx)
             return 0
 
+    def get_patches_indexed(self, wsi_full_size, is_tumor, img_idx, contours, region_mask,
+                            exclude_mask=None, mask_full_size=None, verify: bool = False):
+        """Samples patches from a precomputed candidate index instead of random
+        points: only grid cells whose downsampled region fraction already passes
+        tumor_threshold (and that have no excluded region) are drawn, so level 0
+        reads happen for accepted patches only. The level 0 reads of a batch are
+        grouped by the slide's tile grid (BatchedRegionReader).
+
+        Args:
+            wsi_full_size: Full size WSI (OpenSlide or ASAP).
+            is_tumor: True to sample tumor patches, False for normal ones.
+            img_idx: Identifier of the WSI used in the patch names.
+            contours: Contours of the downsampled image whose bboxes are sampled.
+            region_mask: Downsampled mask of the sampled region (tumor mask or tissue mask).
+            exclude_mask (optional): Downsampled mask that must be empty in the
+                patch (tumor mask when sampling normal patches). Defaults to None.
+            mask_full_size (optional): Full size tumor mask, only needed with verify. Defaults to None.
+            verify (bool, optional): Check the threshold again on the level 0 patch. Defaults to False.
+
+        Returns:
+            summary: Dictionary with accepted patches, tries, level 0 reads and tile decode counts.
+        """
+        level0_size = level_geometry(wsi_full_size, 1)[1]
+        downsample = level0_size[0] / region_mask.shape[1]
+        index = CandidateIndex(region_mask, downsample, self.patch_size, level0_size,
+                               exclude_mask, seed=self.rng)
+        size = (self.patch_size, self.patch_size)
+        summary = {'accepted': 0, 'tries': 0, 'wsi_reads': 0, 'mask_reads': 0}
+        patch_idx = 0
+        spacing = self.new_spacing()
+
+        wsi_reader = BatchedRegionReader(wsi_full_size)
+        mask_reader = None if mask_full_size is None else BatchedRegionReader(
+            mask_full_size)
+
+        for bbox in self.get_bbox(contours):
+            patch_in_box = 0
+            candidates = index.sample(bbox, self.tumor_threshold,
+                                      self.max_tries if verify else self.patches_per_bbox)
+
+            while candidates and patch_in_box < self.patches_per_bbox:
+                # next batch of candidates, as many as patches still missing
+                batch = candidates[:self.patches_per_bbox - patch_in_box]
+                candidates = candidates[len(batch):]
+                summary['tries'] += len(batch)
+
+                if spacing is not None:
+                    # overlapping bboxes can draw the same cells again, dropped before any
+                    # read; locations of one batch are also checked against each other
+                    batch = spacing.filter(batch)
+                    if not batch:
+                        continue
+
+                if verify and bool(is_tumor):
+                    assert mask_reader is not None
+                    if hasattr(mask_full_size, 'fractions'):
+                        passing = mask_full_size.fractions(
+                            batch, size) > self.tumor_threshold
+                    else:
+                        mask_patches = np.stack(mask_reader.read(batch, size))
+                        passing = tumor_fractions(
+                            mask_patches) > self.tumor_threshold
+                    batch = [location for location, keep in zip(
+                        batch, passing) if keep]
+                    if not batch:
+                        continue
+
+                wsi_patches = wsi_reader.read(batch, size)
+                if verify and not bool(is_tumor):
+                    # cells fully inside or outside the tissue mask keep their fraction,
+                    # only the others are scored on the level 0 patch
+                    fractions = index.fractions(batch)
+                    undecided = np.flatnonzero(~index.decided(batch))
+                    if len(undecided):
+                        fractions[undecided] = tissue_fractions(
+                            np.stack([wsi_patches[i] for i in undecided]), self.lower_bound,
+                            self.upper_bound, self.close_kernel_size, self.open_kernel_size)
+                    passing = fractions > self.tumor_threshold
+                else:
+                    passing = [True] * len(batch)
+
+                for location, wsi_patch_np, keep in zip(batch, wsi_patches, passing):
+                    if not keep:
+                        continue
+
+                    self.sink.write(wsi_patch_np, is_tumor,
+                                    img_idx, location, patch_idx)
+                    patch_idx += 1
+                    patch_in_box += 1
+                    if spacing is not None:
+                        spacing.add(location)
+
+        self.sink.flush()
+        summary['accepted'] = patch_idx
+        summary['duplicates'] = 0 if spacing is None else spacing.duplicates
+        summary['duplicate_rate'] = 0.0 if spacing is None else spacing.duplicate_rate
+        for reader, prefix in ((wsi_reader, 'wsi'), (mask_reader, 'mask')):
+            if reader is not None:
+                summary[f'{prefix}_reads'] = reader.stats['reads']
+                summary[f'{prefix}_tiles_spanned'] = reader.stats['tiles_spanned']
+                summary[f'{prefix}_naive_tiles'] = reader.stats['naive_tiles']
+                summary[f'{prefix}_read_seconds'] = reader.stats['seconds']
+        print(f'{patch_idx} patches from image {img_idx} saved after {summary["tries"]} tries, '
+              f'{summary["wsi_tiles_spanned"]} WSI tiles read ({summary["wsi_naive_tiles"]} with '
+              f'one read per patch) in {summary["wsi_read_seconds"]:.2f}s.')
+        self.report_spacing(spacing, img_idx)
+        return summary
+
     def get_contours(self, image, is_tumor):
         contours = None
 
@@ -277,7 +518,9 @@ class PatchGenerator:
 
     def get_image_region(self, slide: Union[openslide.OpenSlide, mir.MultiResolutionImage], location, level, size) :
 
-        if type(slide) == openslide.OpenSlide:
+        if isinstance(slide, CachedSlideReader):
+            slide_patch = slide.read_region_np(location, level, size)
+        elif type(slide) == openslide.OpenSlide:
             assert type(slide) is openslide.OpenSlide
             slide_patch = np.array(slide.read_region(location, level, size))
             slide.close()
@@ -289,7 +532,7 @@ class PatchGenerator:
 
         return slide_patch
 
-    def get_mask_from_annotation(self, wsi_image, is_camelyon17: bool = False):
+    def get_mask_from_annotation(self, wsi_image, is_camelyon17: bool = False, native: bool = False):
         # Check if there is an annotation file
         print(f'Is Camelyon17? {is_camelyon17}')
         annotation_file = wsi_image.split('.', 1)[0] + '.xml'
@@ -304,19 +547,43 @@ class PatchGenerator:
 
         # adjust labels based on dataset (CAMELYON 16 or 17)
         annotation_mask = mir.AnnotationToMask()
-        label_map = {'metastases': 1, 'normal': 2} if is_camelyon17 else {
-            '_0': 1, '_1': 1, '_2': 0}
-        conversion_order = ['metastases',
-                            'normal'] if is_camelyon17 else ['_0', '_1', '_2']
+        label_map, conversion_order = self.annotation_labels(is_camelyon17)
 
         # Loading WSI associated to annotation
         slide = reader.open(os.path.join(self.image_path, wsi_image))
+        mask_path = os.path.join(self.mask_path, wsi_image)
+        if native:
+            # streaming rasterizer instead of ASAP's full level 0 conversion
+            AnnotationRasterizer(annotation_path, label_map, conversion_order,
+                                 slide.getDimensions()).write_tiff(mask_path)
+            print(f'Mask for {annotation_file} created successfully.')
+            return
+
         xml_repository.setSource(annotation_path)
         xml_repository.load()
 
         # Save mask file generated from annotations
-        mask_path = os.path.join(self.mask_path, wsi_image)
         annotation_mask.convert(annotation_list, mask_path, slide.getDimensions(
         ), slide.getSpacing(), label_map, conversion_order)
 
         print(f'Mask for {annotation_file} created successfully.')
+
+    def annotation_labels(self, is_camelyon17: bool = False):
+        label_map = {'metastases': 1, 'normal': 2} if is_camelyon17 else {
+            '_0': 1, '_1': 1, '_2': 0}
+        conversion_order = ['metastases',
+                            'normal'] if is_camelyon17 else ['_0', '_1', '_2']
+        return label_map, conversion_order
+
+    def open_annotation_mask(self, annotation_path, wsi_full_size, is_camelyon17: bool = False):
+        """PolygonMask of an XML annotation, usable wherever a mask slide is
+        expected (mask_full_size, tumor contours), so no mask TIFF is needed.
+
+        Args:
+            annotation_path: Path of the XML annotation.
+            wsi_full_size: WSI the annotation belongs to (gives the level 0 size).
+            is_camelyon17 (bool, optional): CAMELYON17 labels. Defaults to False.
+        """
+        label_map, conversion_order = self.annotation_labels(is_camelyon17)
+        return PolygonMask(annotation_path, label_map, conversion_order,
+                           level_geometry(wsi_full_size, 1)[1])
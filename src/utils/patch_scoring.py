@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+
+def tumor_fractions(mask_patches):
+    """Tumor fraction of a stack of mask patches in one pass.
+
+    Args:
+        mask_patches: (N, H, W) or (N, H, W, C) uint8 array, channel 0 is used
+            with the same sum/255 as get_patches (255 is tumor).
+
+    Returns:
+        fractions: (N,) float array.
+    """
+    if mask_patches.ndim == 4:
+        mask_patches = mask_patches[..., 0]
+    n, height, width = mask_patches.shape
+    return (mask_patches.reshape(n, -1).sum(axis=1, dtype=np.int64) / 255) / (height * width)
+
+
+def tissue_fractions(patches, lower_bound, upper_bound, close_kernel_size: int = 20,
+                     open_kernel_size: int = 5, morphology: bool = True):
+    """Tissue fraction of a stack of RGB(A) patches, with the same HSV threshold
+    and close/open morphology as PatchGenerator.extract_tissue, in one pass over
+    the whole stack. For the morphology the patches are laid out one above the
+    other with gap rows wider than the kernels between them; before every
+    dilate/erode the gaps are reset to its neutral value (0 / 255), which is how
+    cv2 treats the border of a single patch, so the result is the per patch one.
+
+    Args:
+        patches: (N, H, W, C) uint8 array.
+        lower_bound, upper_bound: HSV bounds of the tissue.
+        morphology (bool, optional): Apply close/open. Defaults to True.
+
+    Returns:
+        fractions: (N,) float array.
+    """
+    n, height, width, channels = patches.shape
+    stacked = np.ascontiguousarray(patches).reshape(n * height, width, channels)
+    hsv = cv2.cvtColor(stacked, cv2.COLOR_BGR2HSV)
+    tissue = cv2.inRange(hsv, lower_bound, upper_bound)
+
+    if morphology and n:
+        kernel_close = np.ones(
+            (close_kernel_size, close_kernel_size), dtype=np.uint8)
+        kernel_open = np.ones(
+            (open_kernel_size, open_kernel_size), dtype=np.uint8)
+        gap = max(close_kernel_size, open_kernel_size)
+        rows = (np.arange(n)[:, None] * (height + gap) + np.arange(height)).ravel()
+        gaps = np.ones(n * (height + gap) - gap, dtype=bool)
+        gaps[rows] = False
+
+        canvas = np.zeros((len(gaps), width), dtype=np.uint8)
+        canvas[rows] = tissue
+        # MORPH_CLOSE (dilate, erode) then MORPH_OPEN (erode, dilate)
+        for operation, kernel in ((cv2.dilate, kernel_close), (cv2.erode, kernel_close),
+                                  (cv2.erode, kernel_open), (cv2.dilate, kernel_open)):
+            canvas[gaps] = 255 if operation is cv2.erode else 0
+            canvas = operation(canvas, kernel)
+        tissue = canvas[rows]
+
+    return np.count_nonzero(tissue.reshape(n, -1), axis=1) / (height * width)
+
+
+def window_fractions(mask, windows):
+    """Non-zero fraction of many (x, y, w, h) windows of one 2D mask, using a
+    single integral image (e.g. patches cut from one batched region read).
+
+    Returns:
+        fractions: (len(windows),) float array.
+    """
+    integral = cv2.integral((mask > 0).astype(np.uint8))
+    x, y, w, h = np.asarray(windows).T
+    counts = (integral[y + h, x + w] - integral[y, x + w]
+              - integral[y + h, x] + integral[y, x])
+    return counts / (w * h)
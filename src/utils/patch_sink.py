@@ -0,0 +1,287 @@
+import abc
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import h5py
+from PIL import Image
+
+# file extension of every codec of FilePatchSink
+CODEC_EXTENSIONS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'npy': 'npy'}
+
+
+def encode_patch(patch, codec='png', compress_level=6, quality=90, webp_method=4):
+    """Encodes a (H, W, C) uint8 patch.
+
+    Args:
+        patch: PIL image or (H, W, C) uint8 array.
+        codec (str, optional): png, jpeg (libjpeg-turbo through PIL), webp (lossless) or npy. Defaults to 'png'.
+        compress_level (int, optional): PNG zlib level, 0 (fastest) to 9. Defaults to 6 (PIL default).
+        quality (int, optional): JPEG quality. Defaults to 90.
+        webp_method (int, optional): WebP effort, 0 (fastest) to 6. Defaults to 4.
+
+    Returns:
+        The encoded bytes.
+    """
+    buffer = io.BytesIO()
+    if codec == 'npy':
+        np.save(buffer, np.asarray(patch))
+        return buffer.getvalue()
+
+    image = patch if isinstance(patch, Image.Image) else Image.fromarray(np.asarray(patch))
+    if codec == 'png':
+        image.save(buffer, 'PNG', compress_level=compress_level)
+    elif codec == 'jpeg':
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality)
+    elif codec == 'webp':
+        image.save(buffer, 'WEBP', lossless=True, method=webp_method)
+    else:
+        raise ValueError(f'Unknown codec {codec}, expected one of {list(CODEC_EXTENSIONS)}.')
+    return buffer.getvalue()
+
+
+class PatchSink(abc.ABC):
+    """Destination of the patches accepted by PatchGenerator."""
+
+    @abc.abstractmethod
+    def write(self, patch, label, slide_id, location, patch_idx):
+        """Stores one patch.
+
+        Args:
+            patch: PIL image or (H, W, C) uint8 array.
+            label: 1 for tumor patches, 0 for normal ones.
+            slide_id: Identifier of the WSI the patch comes from.
+            location: (x, y) level 0 coordinates of the patch.
+            patch_idx: Index of the patch within its slide.
+
+        Returns:
+            Where the patch was stored.
+        """
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PNGPatchSink(PatchSink):
+    """One PNG per patch in the tumor/normal folders (original layout)."""
+
+    def __init__(self, patch_pos_path, patch_neg_path):
+        self.patch_pos_path = patch_pos_path
+        self.patch_neg_path = patch_neg_path
+
+    def write(self, patch, label, slide_id, location, patch_idx):
+        if bool(label):
+            patch_path = os.path.join(
+                self.patch_pos_path, f'{slide_id}_T_{patch_idx}.PNG')
+        else:
+            patch_path = os.path.join(
+                self.patch_neg_path, f'{slide_id}_N_{patch_idx}.PNG')
+        if not isinstance(patch, Image.Image):
+            patch = Image.fromarray(patch)
+        patch.save(patch_path, 'PNG')
+        return patch_path
+
+
+class FilePatchSink(PNGPatchSink):
+    """One file per patch in the tumor/normal folders, with a choice of codec
+    (see encode_patch). Writes of different patches are independent, so the
+    sink can be used from several threads (AsyncPatchSink)."""
+
+    def __init__(self, patch_pos_path, patch_neg_path, codec: str = 'png', compress_level: int = 6,
+                 quality: int = 90, webp_method: int = 4):
+        super(FilePatchSink, self).__init__(patch_pos_path, patch_neg_path)
+        if codec not in CODEC_EXTENSIONS:
+            raise ValueError(f'Unknown codec {codec}, expected one of {list(CODEC_EXTENSIONS)}.')
+        self.codec = codec
+        self.compress_level = compress_level
+        self.quality = quality
+        self.webp_method = webp_method
+
+    def path(self, label, slide_id, patch_idx):
+        extension = CODEC_EXTENSIONS[self.codec]
+        if bool(label):
+            return os.path.join(self.patch_pos_path, f'{slide_id}_T_{patch_idx}.{extension}')
+        return os.path.join(self.patch_neg_path, f'{slide_id}_N_{patch_idx}.{extension}')
+
+    def write(self, patch, label, slide_id, location, patch_idx):
+        data = encode_patch(patch, self.codec, self.compress_level, self.quality, self.webp_method)
+        patch_path = self.path(label, slide_id, patch_idx)
+        with open(patch_path, 'wb') as f:
+            f.write(data)
+        return patch_path
+
+
+class AsyncPatchSink(PatchSink):
+    """Moves the encoding and writing of another sink to a pool of threads so
+    the sampling loop goes on with the next reads. write() only copies the
+    patch (the caller may close or reuse it) and blocks when more than
+    max_pending patches or max_inflight_bytes of patch data are waiting.
+    FilePatchSink writes (one file per patch) run concurrently; other sinks
+    share state between patches (e.g. the buffers of HDF5PatchSink), so their
+    writes run one at a time on a single thread, in write order. Errors of the
+    background writes are raised by flush().
+    """
+
+    def __init__(self, sink: PatchSink, num_workers: int = 4, max_pending: int = 64,
+                 max_inflight_bytes: int = 256 * 1024 * 1024):
+        self.sink = sink
+        self.concurrent = isinstance(sink, FilePatchSink)
+        # one thread keeps the rows of ordered sinks (HDF5) in write order
+        self.pool = ThreadPoolExecutor(num_workers if self.concurrent else 1)
+        self.max_pending = max_pending
+        self.max_inflight_bytes = max_inflight_bytes
+        self.pending = 0
+        self.inflight_bytes = 0
+        self.condition = threading.Condition()
+        # serializes the writes of sinks that are not FilePatchSink
+        self.sink_lock = threading.Lock()
+        self.errors = []
+        self.stats = {'patches': 0, 'write_seconds': 0.0, 'wait_seconds': 0.0}
+
+    def _done(self, future, nbytes):
+        with self.condition:
+            self.pending -= 1
+            self.inflight_bytes -= nbytes
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+            self.condition.notify_all()
+
+    def _write(self, patch, label, slide_id, location, patch_idx):
+        start = time.perf_counter()
+        if self.concurrent:
+            self.sink.write(patch, label, slide_id, location, patch_idx)
+        else:
+            with self.sink_lock:
+                self.sink.write(patch, label, slide_id, location, patch_idx)
+        with self.condition:
+            self.stats['write_seconds'] += time.perf_counter() - start
+
+    def write(self, patch, label, slide_id, location, patch_idx):
+        patch = np.array(patch)
+        start = time.perf_counter()
+        with self.condition:
+            # a single patch larger than the budget still goes through, alone
+            self.condition.wait_for(lambda: self.pending == 0 or (
+                self.pending < self.max_pending
+                and self.inflight_bytes + patch.nbytes <= self.max_inflight_bytes))
+            self.pending += 1
+            self.inflight_bytes += patch.nbytes
+            self.stats['patches'] += 1
+            self.stats['wait_seconds'] += time.perf_counter() - start
+
+        future = self.pool.submit(self._write, patch, label, slide_id, location, patch_idx)
+        future.add_done_callback(lambda f, nbytes=patch.nbytes: self._done(f, nbytes))
+        return self.sink.path(label, slide_id, patch_idx) if hasattr(self.sink, 'path') else None
+
+    def flush(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+        with self.sink_lock:
+            self.sink.flush()
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+        self.sink.close()
+
+
+class HDF5PatchSink(PatchSink):
+    """Chunked, appendable HDF5 store with the PCam layout: x (N, H, W, 3) uint8
+    and y (N, 1, 1, 1) uint8, plus slide_id and level 0 coords of every patch.
+    Patches are buffered and written batch_size at a time. The file can be read
+    directly with PCAMDataset(file_path, label_path=file_path).
+
+    The file is opened on the first write, so the sink can be given to the
+    spawned workers of ExtractionDriver or S3PatchPipeline (generator_kwargs).
+    With '{worker}' in file_path (e.g. 'patches_{worker}.h5') every process
+    writes its own shard, read back together with pcam_dataset.load_shards.
+    """
+
+    def __init__(self, file_path, patch_size, batch_size: int = 256, compression=None):
+        self.file_path = file_path
+        self.patch_size = patch_size
+        self.batch_size = batch_size
+        self.compression = compression
+        self.file = None
+        self.buffer = {'x': [], 'y': [], 'slide_id': [], 'coords': []}
+
+    def shard_path(self):
+        """Path of the file written by the current process."""
+        return self.file_path.format(worker=os.getpid())
+
+    def open(self):
+        if self.file is not None:
+            return self.file
+        self.file = h5py.File(self.shard_path(), 'a')
+        if 'x' not in self.file:
+            patch_size = self.patch_size
+            self.file.create_dataset('x', shape=(0, patch_size, patch_size, 3), dtype=np.uint8,
+                                     maxshape=(None, patch_size, patch_size, 3),
+                                     chunks=(min(self.batch_size, 64), patch_size, patch_size, 3),
+                                     compression=self.compression)
+            self.file.create_dataset('y', shape=(0, 1, 1, 1), dtype=np.uint8,
+                                     maxshape=(None, 1, 1, 1), chunks=(4096, 1, 1, 1))
+            self.file.create_dataset('slide_id', shape=(0,), dtype=h5py.string_dtype(),
+                                     maxshape=(None,), chunks=(4096,))
+            self.file.create_dataset('coords', shape=(0, 2), dtype=np.int64,
+                                     maxshape=(None, 2), chunks=(4096, 2))
+        return self.file
+
+    def __getstate__(self):
+        # the open file and the pending rows stay in the process that wrote them
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['buffer'] = {name: [] for name in self.buffer}
+        return state
+
+    def __len__(self):
+        return len(self.open()['x']) + len(self.buffer['x'])
+
+    def write(self, patch, label, slide_id, location, patch_idx):
+        # PCam patches are RGB, the alpha channel of read_region is dropped.
+        # Copied so the buffer doesn't keep larger regions alive through views.
+        self.buffer['x'].append(np.array(np.asarray(patch)[:, :, :3]))
+        self.buffer['y'].append(int(bool(label)))
+        self.buffer['slide_id'].append(str(slide_id))
+        self.buffer['coords'].append(location)
+        row = len(self) - 1
+
+        if len(self.buffer['x']) >= self.batch_size:
+            self.flush()
+        return f'{self.shard_path()}[{row}]'
+
+    def flush(self):
+        count = len(self.buffer['x'])
+        if count == 0:
+            return
+        file = self.open()
+        start = len(file['x'])
+        values = {'x': np.stack(self.buffer['x']),
+                  'y': np.array(self.buffer['y'], dtype=np.uint8).reshape(-1, 1, 1, 1),
+                  'slide_id': np.array(self.buffer['slide_id'], dtype=object),
+                  'coords': np.array(self.buffer['coords'], dtype=np.int64)}
+        for name, value in values.items():
+            file[name].resize(start + count, axis=0)
+            file[name][start:start + count] = value
+            self.buffer[name] = []
+        file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
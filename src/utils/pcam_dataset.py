@@ -1,26 +1,104 @@
+import glob
+import hashlib
 import os
-import cv2
+import tempfile
 import torchstain
 import h5py
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import ConcatDataset, Dataset, Sampler
+from utils.stain_norm import REFERENCE_PARAMS, load_or_fit_reference, make_batch_normalizer
 
 class PCAMDataset(Dataset):
-    def __init__(self, file_path, label_path = None, transform=None, normalize=None):
-        self.dataset = h5py.File(file_path, 'r')
-        self.images = self.dataset['x']
+    def __init__(self, file_path, label_path = None, transform=None, normalize=None, cache=None,
+                 target_path=os.path.join('..', 'data', 'norm_better.png'), norm_cache_dir=None,
+                 cache_dir=None):
+        # HDF5 handles are opened lazily in every process (see open), so the
+        # dataset can be used with DataLoader(num_workers>0)
+        self.file_path = file_path
+        self.label_path = label_path
         self.transform = transform
         self.normalize = normalize
-        self.labels =  h5py.File(label_path, 'r')['y'] if label_path else None
+        # reference image(s) of the stain normalization and folder of the fitted reference
+        self.target_path = target_path
+        self.norm_cache_dir = norm_cache_dir
+        # None reads from HDF5, 'ram' loads x in memory, 'memmap' maps x from disk
+        self.cache = cache
+        # folder of the .npy copy of x mapped by the memmap cache (the data folder is left untouched)
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'pcam_memmap')
+        self.pid = None
+        self.dataset = None
+        self.images = None
+        self.labels = None
+
+        with h5py.File(file_path, 'r') as f:
+            self.length = len(f['x'])
+            self.chunk_rows = f['x'].chunks[0] if f['x'].chunks else 1
+            if self.cache == 'memmap':
+                self.memmap_path = self.prepare_memmap(f['x'])
 
         if self.transform and self.normalize:
             if self.normalize == 'macenko':
                 self.normalizer = torchstain.normalizers.MacenkoNormalizer(backend='torch')
             elif self.normalize == 'reinhard':
                 self.normalizer = torchstain.normalizers.ReinhardNormalizer(backend='torch')
-            target_image = cv2.cvtColor(cv2.imread(os.path.join('..', 'data', 'norm_better.png')), cv2.COLOR_BGR2RGB)
-            self.normalizer.fit(self.transform(target_image))
-    
+            else:
+                raise ValueError(f'Unknown stain normalization {self.normalize!r}, '
+                                 f'expected one of {list(REFERENCE_PARAMS)}.')
+            # fitted once per target image(s) and method, then loaded from norm_cache_dir
+            reference = load_or_fit_reference(target_path, self.normalize, self.transform, norm_cache_dir)
+            for name, value in reference.items():
+                setattr(self.normalizer, name, value)
+
+    def prepare_memmap(self, images):
+        """Offset of x in the HDF5 file when it is stored contiguously and
+        uncompressed, otherwise a .npy copy of x (written once in cache_dir, keyed
+        by the path, size and mtime of the file) to map instead."""
+        if images.chunks is None and images.compression is None:
+            return self.file_path, images.id.get_offset()
+        path = os.path.abspath(self.file_path)
+        key = hashlib.sha1(f'{path}:{os.path.getsize(path)}:{os.path.getmtime(path)}'.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        npy_path = os.path.join(self.cache_dir, f'{name}_{key}.x.npy')
+        if not os.path.isfile(npy_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+            out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=images.dtype,
+                                            shape=images.shape)
+            step = self.chunk_rows * 64
+            for start in range(0, len(images), step):
+                out[start:start + step] = images[start:start + step]
+            out.flush()
+            del out
+            os.replace(tmp_path, npy_path)
+        return npy_path, None
+
+    def open(self):
+        if self.pid == os.getpid():
+            return
+        self.dataset = h5py.File(self.file_path, 'r')
+        self.images = self.dataset['x']
+        self.labels = h5py.File(self.label_path, 'r')['y'] if self.label_path else None
+
+        if self.cache == 'ram':
+            images = np.empty(self.images.shape, dtype=self.images.dtype)
+            self.images.read_direct(images)
+            self.images = images
+        elif self.cache == 'memmap':
+            path, offset = self.memmap_path
+            if offset is None:
+                self.images = np.load(path, mmap_mode='r')
+            else:
+                self.images = np.memmap(path, dtype=self.images.dtype, mode='r',
+                                        offset=offset, shape=self.images.shape)
+        self.pid = os.getpid()
+
+    def __getstate__(self):
+        # handles (and the RAM cache) are not sent to workers, each one opens its own
+        state = self.__dict__.copy()
+        state.update(pid=None, dataset=None, images=None, labels=None)
+        return state
+
     def get_normalization(self, image):
         if self.normalize == 'macenko':
             # print('Beefore:', image[0,])
@@ -33,17 +111,99 @@ class PCAMDataset(Dataset):
             image = image.type(torch.float)/255.0 # type: ignore
         return image
 
+    def batch_normalizer(self, method=None):
+        """Batched stain normalizer (see utils.stain_norm) fitted on target_path
+        like the per image one, e.g. for StainNormalizeCollate on a dataset built
+        without normalize.
+
+        Args:
+            method (optional): 'macenko' or 'reinhard'. Defaults to the normalize of the dataset.
+        """
+        method = method or self.normalize
+        if method not in REFERENCE_PARAMS:
+            raise ValueError(f'Unknown stain normalization {method!r}, expected one of {list(REFERENCE_PARAMS)}.')
+        if not self.transform:
+            raise ValueError('The reference is fitted on transform(target), the dataset needs a transform.')
+        reference = load_or_fit_reference(self.target_path, method, self.transform, self.norm_cache_dir)
+        return make_batch_normalizer(method, reference)
+
     def __len__(self):
-        return len(self.images) # type: ignore
-    
-    def __getitem__(self, idx):
-        data = self.images[idx] # type: ignore
+        return self.length
+
+    def process(self, data):
         # Apply transformation if provided
         if self.transform:
             data = self.transform(data)
         if self.normalize:
             data = self.get_normalization(data).permute(2, 0, 1) # type: ignore
-        if self.labels:
+        return data
+
+    def __getitem__(self, idx):
+        self.open()
+        data = self.process(self.images[idx]) # type: ignore
+        if self.labels is not None:
             labels = self.labels[idx] # type: ignore
             return data, labels
-        return data
\ No newline at end of file
+        return data
+
+    def __getitems__(self, indices):
+        """Batched fetch used by DataLoader: contiguous runs of the sorted
+        indices are read as one HDF5 hyperslab each."""
+        self.open()
+        order = np.argsort(indices)
+        sorted_indices = np.asarray(indices)[order]
+        runs = np.split(sorted_indices, np.flatnonzero(np.diff(sorted_indices) != 1) + 1)
+
+        images = np.concatenate([self.images[run[0]:run[-1] + 1] for run in runs])
+        labels = None if self.labels is None else np.concatenate(
+            [self.labels[run[0]:run[-1] + 1] for run in runs])
+
+        batch = [None] * len(indices)
+        for position, i in enumerate(order):
+            data = self.process(images[position])
+            batch[i] = (data, labels[position]) if labels is not None else data
+        return batch
+
+
+class ChunkBatchSampler(Sampler):
+    """Batch sampler yielding contiguous index ranges in random order, so every
+    batch is a single HDF5 hyperslab read (through __getitems__). batch_size
+    must be a multiple or a divisor of the chunk rows of x (PCAMDataset.chunk_rows)
+    for the batches to be chunk-aligned."""
+
+    def __init__(self, dataset_length, batch_size, chunk_rows=1, shuffle=True, drop_last=False, seed=None):
+        if batch_size % chunk_rows and chunk_rows % batch_size:
+            raise ValueError(f'batch_size {batch_size} is not aligned with chunks of {chunk_rows} rows.')
+        self.dataset_length = dataset_length
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        self.starts = list(range(0, dataset_length, batch_size))
+        if drop_last and dataset_length % batch_size:
+            self.starts = self.starts[:-1]
+
+    def __iter__(self):
+        order = torch.randperm(len(self.starts), generator=self.generator).tolist() \
+            if self.shuffle else range(len(self.starts))
+        for i in order:
+            start = self.starts[i]
+            yield list(range(start, min(start + self.batch_size, self.dataset_length)))
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def load_shards(file_path, **kwargs):
+    """One dataset over the shards written by HDF5PatchSink ('{worker}' in
+    file_path), concatenated in path order.
+
+    Args:
+        file_path: Shard path template given to HDF5PatchSink.
+        **kwargs: Arguments of PCAMDataset (transform, normalize, cache...).
+    """
+    paths = sorted(glob.glob(file_path.replace('{worker}', '*')))
+    if not paths:
+        raise FileNotFoundError(f'No shard matches {file_path}.')
+    return ConcatDataset([PCAMDataset(path, label_path=path, **kwargs) for path in paths])
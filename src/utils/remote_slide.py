@@ -0,0 +1,282 @@
+import io
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+from PIL import Image
+from utils.slide_reader import TileCache
+
+try:
+    import imagecodecs  # type: ignore
+except ImportError:  # LZW / JPEG 2000 tiles need it, zlib and JPEG don't
+    imagecodecs = None
+
+# TIFF tags read from every IFD
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+SAMPLES_PER_PIXEL = 277
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+JPEG_TABLES = 347
+
+# TIFF field type -> struct format (without byte order)
+FIELD_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 7: 'B', 11: 'f', 12: 'd',
+               13: 'I', 16: 'Q', 17: 'q', 18: 'Q'}
+
+
+def parse_s3_url(url):
+    """s3://bucket/key -> (bucket, key)"""
+    bucket, key = url[len('s3://'):].split('/', 1)
+    return bucket, key
+
+
+class RemoteSlide:
+    """OpenSlide-like reader of a tiled (pyramidal) TIFF stored in S3 that never
+    downloads the whole file. The IFD chain and the tile offset tables are read
+    with a few ranged GETs; read_region then fetches only the tiles it needs,
+    merging tiles that are close in the file into one ranged request and running
+    the requests concurrently. Decoded tiles go to a TileCache (shareable with
+    the mask reader, like CachedSlideReader).
+    """
+
+    def __init__(self, s3_client, bucket, key, cache: Optional[TileCache] = None,
+                 max_workers: int = 8, header_bytes: int = 64 * 1024,
+                 coalesce_gap: int = 64 * 1024, max_request_bytes: int = 8 * 1024 * 1024):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.path = f's3://{bucket}/{key}'
+        self.cache = cache if cache is not None else TileCache()
+        self.pool = ThreadPoolExecutor(max_workers)
+        # tiles separated by less than coalesce_gap bytes are fetched in one request
+        self.coalesce_gap = coalesce_gap
+        self.max_request_bytes = max_request_bytes
+        self.stats = {'requests': 0, 'bytes': 0, 'tiles': 0}
+        self.lock = threading.Lock()
+
+        self.header = self._fetch(0, header_bytes)
+        byte_order = self.header[:2]
+        if byte_order not in (b'II', b'MM'):
+            raise ValueError(f'{self.path} is not a TIFF file.')
+        self.byte_order = '<' if byte_order == b'II' else '>'
+        version, = struct.unpack(self.byte_order + 'H', self.header[2:4])
+        self.bigtiff = version == 43
+        if self.bigtiff:
+            first_ifd, = struct.unpack(self.byte_order + 'Q', self.header[8:16])
+        else:
+            first_ifd, = struct.unpack(self.byte_order + 'I', self.header[4:8])
+
+        self.levels = self._read_levels(first_ifd)
+        self.level_dimensions = tuple((level['width'], level['height']) for level in self.levels)
+        width = self.level_dimensions[0][0]
+        self.level_downsamples = tuple(width / level_width for level_width, _ in self.level_dimensions)
+        self.dimensions = self.level_dimensions[0]
+        self.properties = {'openslide.level[0].tile-width': str(self.levels[0]['tile_width']),
+                           'openslide.level[0].tile-height': str(self.levels[0]['tile_length'])}
+
+    @property
+    def level_count(self):
+        return len(self.levels)
+
+    def get_best_level_for_downsample(self, downsample):
+        # same rule as OpenSlide: largest level whose downsample is <= the requested one
+        candidates = [level for level, level_downsample in enumerate(self.level_downsamples)
+                      if level_downsample <= downsample]
+        return max(candidates) if candidates else 0
+
+    def _fetch(self, offset, length):
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key,
+                                             Range=f'bytes={offset}-{offset + length - 1}')
+        data = response['Body'].read()
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(data)
+        return data
+
+    def _read(self, offset, length):
+        """Bytes of the file, from the header buffer when possible."""
+        if offset + length <= len(self.header):
+            return self.header[offset:offset + length]
+        return self._fetch(offset, length)
+
+    def _read_ifd(self, offset):
+        """Tags of one IFD and the offset of the next one."""
+        order = self.byte_order
+        # entry: tag, type, number of values, value or offset (4/8 bytes in classic/BigTIFF)
+        count_format, entry_size, value_size, offset_format = (
+            ('Q', 20, 8, 'Q') if self.bigtiff else ('H', 12, 4, 'I'))
+        count_size = struct.calcsize(count_format)
+        count, = struct.unpack(order + count_format, self._read(offset, count_size))
+        table = self._read(offset + count_size, count * entry_size + value_size)
+
+        tags = {}
+        for i in range(count):
+            entry = table[i * entry_size:(i + 1) * entry_size]
+            tag, field_type = struct.unpack(order + 'HH', entry[:4])
+            if field_type not in FIELD_TYPES:
+                continue
+            number, = struct.unpack(order + offset_format, entry[4:4 + value_size])
+            value_format = FIELD_TYPES[field_type]
+            size = struct.calcsize(order + value_format) * number if value_format != 's' else number
+            if size <= value_size:
+                raw = entry[entry_size - value_size:entry_size - value_size + size]
+            else:
+                pointer, = struct.unpack(order + offset_format, entry[entry_size - value_size:])
+                raw = self._read(pointer, size)
+            if value_format == 's' or field_type == 7:
+                tags[tag] = raw
+            else:
+                tags[tag] = struct.unpack(order + value_format * number, raw)
+
+        next_ifd, = struct.unpack(order + offset_format, table[count * entry_size:])
+        return tags, next_ifd
+
+    def _read_levels(self, offset):
+        """Tiled full resolution and reduced resolution images, largest first
+        (stripped images such as label or macro are skipped)."""
+        levels = []
+        while offset:
+            tags, offset = self._read_ifd(offset)
+            if TILE_OFFSETS not in tags:
+                continue
+            levels.append({
+                'width': tags[IMAGE_WIDTH][0], 'height': tags[IMAGE_LENGTH][0],
+                'tile_width': tags[TILE_WIDTH][0], 'tile_length': tags[TILE_LENGTH][0],
+                'offsets': np.array(tags[TILE_OFFSETS], dtype=np.int64),
+                'byte_counts': np.array(tags[TILE_BYTE_COUNTS], dtype=np.int64),
+                'compression': tags.get(COMPRESSION, (1,))[0],
+                'predictor': tags.get(PREDICTOR, (1,))[0],
+                'samples': tags.get(SAMPLES_PER_PIXEL, (1,))[0],
+                'bits': tags.get(BITS_PER_SAMPLE, (8,))[0],
+                'jpeg_tables': tags.get(JPEG_TABLES),
+            })
+        if not levels:
+            raise ValueError(f'{self.path} has no tiled image.')
+        # keep a proper pyramid: every level smaller than the previous one
+        levels.sort(key=lambda level: -level['width'])
+        pyramid = [levels[0]]
+        for level in levels[1:]:
+            if level['width'] < pyramid[-1]['width']:
+                pyramid.append(level)
+        return pyramid
+
+    def _decode(self, level, data):
+        """Decoded tile as an RGBA (tile_length, tile_width, 4) uint8 array."""
+        info = self.levels[level]
+        shape = (info['tile_length'], info['tile_width'], info['samples'])
+        compression = info['compression']
+        if compression == 1:
+            tile = np.frombuffer(data, dtype=np.uint8)
+        elif compression in (8, 32946):
+            tile = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        elif compression in (6, 7):
+            if info['jpeg_tables'] is not None:
+                # abbreviated JPEG stream: tables without EOI + tile without SOI
+                data = bytes(info['jpeg_tables'])[:-2] + data[2:]
+            tile = np.array(Image.open(io.BytesIO(data)))
+        elif compression == 5 and imagecodecs is not None:
+            tile = np.frombuffer(imagecodecs.lzw_decode(data), dtype=np.uint8)
+        elif compression in (33003, 33005) and imagecodecs is not None:
+            # Aperio JPEG 2000
+            tile = np.asarray(imagecodecs.jpeg2k_decode(data))
+        else:
+            raise ValueError(f'TIFF compression {compression} of {self.path} is not supported '
+                             f'(LZW and JPEG 2000 need imagecodecs).')
+
+        tile = tile.reshape(shape) if tile.ndim == 1 else tile.reshape(shape[:2] + (-1,))
+        if info['predictor'] == 2:
+            tile = np.cumsum(tile, axis=1, dtype=np.uint8)
+        if tile.shape[2] == 1:
+            tile = np.repeat(tile, 3, axis=2)
+        if tile.shape[2] == 3:
+            tile = np.dstack([tile, np.full(tile.shape[:2], 255, dtype=np.uint8)])
+        return tile
+
+    def _requests(self, level, tiles):
+        """Groups tiles into ranged requests: (start, end, [(tile, offset, count)])."""
+        info = self.levels[level]
+        tiles_across = -(-info['width'] // info['tile_width'])
+        parts = []
+        for tile_x, tile_y in tiles:
+            index = tile_y * tiles_across + tile_x
+            parts.append(((tile_x, tile_y), int(info['offsets'][index]), int(info['byte_counts'][index])))
+        parts.sort(key=lambda part: part[1])
+
+        requests = []
+        for part in parts:
+            _, offset, count = part
+            if requests:
+                start, end, members = requests[-1]
+                if offset - end <= self.coalesce_gap and offset + count - start <= self.max_request_bytes:
+                    requests[-1] = (start, max(end, offset + count), members + [part])
+                    continue
+            requests.append((offset, offset + count, [part]))
+        return requests
+
+    def _fetch_tiles(self, level, tiles):
+        """Fetches and decodes the given tiles (also stored in the cache).
+
+        Returns:
+            decoded: Dictionary (tile_x, tile_y) -> RGBA tile
+        """
+        def fetch(request):
+            start, end, members = request
+            data = self._fetch(start, end - start)
+            decoded = {}
+            for tile, offset, count in members:
+                decoded[tile] = self._decode(level, data[offset - start:offset - start + count])
+                self.cache.put((self.path, level) + tile, decoded[tile])
+            return decoded
+
+        decoded = {}
+        for request_tiles in self.pool.map(fetch, self._requests(level, tiles)):
+            decoded.update(request_tiles)
+        with self.lock:
+            self.stats['tiles'] += len(decoded)
+        return decoded
+
+    def read_region_np(self, location, level, size):
+        info = self.levels[level]
+        tile_width, tile_length = info['tile_width'], info['tile_length']
+        downsample = self.level_downsamples[level]
+        x0, y0 = int(location[0] // downsample), int(location[1] // downsample)
+        width, height = size
+
+        tiles = [(tile_x, tile_y)
+                 for tile_y in range(max(y0, 0) // tile_length,
+                                     (min(y0 + height, info['height']) - 1) // tile_length + 1)
+                 for tile_x in range(max(x0, 0) // tile_width,
+                                     (min(x0 + width, info['width']) - 1) // tile_width + 1)]
+        decoded = {tile: self.cache.get((self.path, level) + tile) for tile in tiles}
+        missing = [tile for tile, data in decoded.items() if data is None]
+        if missing:
+            decoded.update(self._fetch_tiles(level, missing))
+
+        # outside the image is transparent, like OpenSlide
+        region = np.zeros((height, width, 4), dtype=np.uint8)
+        for (tile_x, tile_y), tile in decoded.items():
+            # overlap between the tile, the image and the requested region
+            left = max(x0, tile_x * tile_width)
+            top = max(y0, tile_y * tile_length)
+            right = min(x0 + width, (tile_x + 1) * tile_width, info['width'])
+            bottom = min(y0 + height, (tile_y + 1) * tile_length, info['height'])
+            if right <= left or bottom <= top:
+                continue
+            region[top - y0:bottom - y0, left - x0:right - x0] = tile[
+                top - tile_y * tile_length:bottom - tile_y * tile_length,
+                left - tile_x * tile_width:right - tile_x * tile_width]
+
+        return region
+
+    def read_region(self, location, level, size):
+        return Image.fromarray(self.read_region_np(location, level, size))
+
+    def close(self):
+        self.pool.shutdown(wait=False)
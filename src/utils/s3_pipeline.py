@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from utils.aws_handler import AWSHandler, DEFAULT_TRANSFER_CONFIG
+from utils.extraction_driver import _init_worker, extract_slide
+
+
+class S3PatchPipeline:
+    """Downloads slides from S3 and extracts their patches as soon as each
+    download finishes, deleting the local slide (and mask) once its patches are
+    written. A download only starts while the slides on disk stay under
+    high_water_bytes and at most max_pending slides wait for extraction, so disk
+    usage is bounded instead of the whole dataset landing on local disk.
+    """
+
+    def __init__(self, aws_handler: AWSHandler, bucket_name, download_path, generator_kwargs: dict,
+                 download_workers: int = 2, extraction_workers: int = os.cpu_count() or 1,
+                 high_water_bytes: int = 50 * 1024 ** 3, max_pending: int = 4,
+                 config=DEFAULT_TRANSFER_CONFIG, tile_cache_bytes: Optional[int] = None,
+                 metadata_cache_dir: Optional[str] = None):
+        self.aws_handler = aws_handler
+        self.bucket_name = bucket_name
+        # AWSHandler concatenates paths, keep a trailing separator
+        self.download_path = os.path.join(download_path, '')
+        self.generator_kwargs = generator_kwargs
+        self.download_workers = download_workers
+        self.extraction_workers = extraction_workers
+        self.high_water_bytes = high_water_bytes
+        self.max_pending = max_pending
+        self.config = config
+        self.tile_cache_bytes = tile_cache_bytes
+        # SlideMetadataCache folder, keyed by content so it survives the re-downloads
+        self.metadata_cache_dir = metadata_cache_dir
+
+        # bytes of the slides currently on disk (or being downloaded)
+        self.disk_bytes = 0
+        self.peak_disk_bytes = 0
+        self.disk_condition = threading.Condition()
+
+    def _size(self, key):
+        return self.aws_handler.s3_client.head_object(Bucket=self.bucket_name, Key=key)['ContentLength']
+
+    def _reserve(self, size):
+        with self.disk_condition:
+            # a slide larger than the high-water mark still goes through, alone
+            self.disk_condition.wait_for(
+                lambda: self.disk_bytes == 0 or self.disk_bytes + size <= self.high_water_bytes)
+            self.disk_bytes += size
+            self.peak_disk_bytes = max(self.peak_disk_bytes, self.disk_bytes)
+
+    def _release(self, paths, size):
+        for path in paths:
+            if path and os.path.isfile(path):
+                os.remove(path)
+        with self.disk_condition:
+            self.disk_bytes -= size
+            self.disk_condition.notify_all()
+
+    def run(self, slides):
+        """Runs the pipeline.
+
+        Args:
+            slides: List of dicts with key (S3 key of the WSI), img_idx, is_tumor and
+                optionally mask_key, size and mask_size (bytes, asked with head_object if missing).
+
+        Returns:
+            results: Summary of every slide, in the order of slides.
+        """
+        results = [None] * len(slides)
+        pending = threading.BoundedSemaphore(self.max_pending)
+        start = time.perf_counter()
+        first_patch = []
+
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(self.extraction_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(self.generator_kwargs, self.tile_cache_bytes,
+                                           self.metadata_cache_dir)) as extractors:
+
+            def fail(i, error):
+                # a failed slide is reported in its result, the other slides go on
+                results[i] = {'error': repr(error), 'slide': slides[i]['key']}
+                print(f'{slides[i]["key"]} failed: {error!r}')
+
+            def process(i):
+                slide = slides[i]
+                keys = [slide['key']] + \
+                    ([slide['mask_key']] if slide.get('mask_key') else [])
+                try:
+                    sizes = [slide.get('size') or self._size(slide['key'])]
+                    if slide.get('mask_key'):
+                        sizes.append(slide.get('mask_size')
+                                     or self._size(slide['mask_key']))
+                except Exception as e:
+                    fail(i, e)
+                    return
+                size = sum(sizes)
+
+                pending.acquire()
+                self._reserve(size)
+                paths = []
+                try:
+                    for key, key_size in zip(keys, sizes):
+                        self.aws_handler.download_file_resumable(self.bucket_name, key, self.download_path,
+                                                                 size=key_size, config=self.config)
+                        paths.append(self.download_path + key.split('/')[-1])
+
+                    task = {'wsi_path': paths[0], 'mask_path': paths[1] if len(paths) > 1 else None,
+                            'img_idx': slide['img_idx'], 'is_tumor': slide['is_tumor'],
+                            'close_handles': True}
+                    future = extractors.submit(extract_slide, task)
+                except Exception as e:
+                    self._release(paths, size)
+                    pending.release()
+                    fail(i, e)
+                    return
+
+                def done(future, i=i, paths=paths, size=size):
+                    self._release(paths, size)
+                    pending.release()
+                    result = {'error': repr(future.exception())} if future.exception() else future.result()
+                    result['slide'] = slides[i]['key']
+                    results[i] = result
+                    if not first_patch and result.get('accepted'):
+                        first_patch.append(time.perf_counter() - start)
+                    print(f'{slides[i]["key"]}: {result.get("accepted", 0)} patches, '
+                          f'{self.disk_bytes / 1024 ** 2:.0f} MB of slides on disk.')
+
+                future.add_done_callback(done)
+
+            with ThreadPoolExecutor(self.download_workers) as downloaders:
+                list(downloaders.map(process, range(len(slides))))
+
+        elapsed = time.perf_counter() - start
+        accepted = sum(r.get('accepted', 0) for r in results if r)
+        failed = sum(1 for r in results if r and 'error' in r)
+        print(f'{len(slides)} slides ({failed} failed), {accepted} patches in {elapsed:.1f}s, first patches after '
+              f'{first_patch[0] if first_patch else float("nan"):.1f}s, peak '
+              f'{self.peak_disk_bytes / 1024 ** 2:.0f} MB of slides on disk.')
+        return results
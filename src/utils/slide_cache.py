@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import cv2
+import numpy as np
+from utils.slide_reader import level_geometry, read_region_np
+
+# bump when the stored arrays or the way they are computed change
+CACHE_VERSION = 2
+# largest side of the cached RGB thumbnail (the masks keep the mag_factor level)
+THUMBNAIL_SIZE = 1024
+
+
+def file_identity(path, s3_client=None, block_size=1024 * 1024):
+    """Cheap content identity of a slide: size plus a hash of its first and last
+    block for local files (stable across re-downloads, unlike mtime), size and
+    ETag for s3:// paths."""
+    if path.startswith('s3://'):
+        bucket, key = path[len('s3://'):].split('/', 1)
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+        return f'{head["ContentLength"]}:{head["ETag"]}'
+
+    size = os.path.getsize(path)
+    sha = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        sha.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            sha.update(f.read(block_size))
+    return f'{size}:{sha.hexdigest()}'
+
+
+def pack_contours(contours):
+    points = np.concatenate([c.reshape(-1, 2) for c in contours]) if len(contours) else \
+        np.zeros((0, 2), dtype=np.int32)
+    lengths = np.array([len(c) for c in contours], dtype=np.int64)
+    return points.astype(np.int32), lengths
+
+
+def unpack_contours(points, lengths):
+    """Contours in the cv2.findContours format ((n, 1, 2) int32 arrays)."""
+    return tuple(part.reshape(-1, 1, 2) for part in np.split(points, np.cumsum(lengths)[:-1])) \
+        if len(lengths) else ()
+
+
+def read_thumbnail(slide, max_size: int = THUMBNAIL_SIZE):
+    """RGB thumbnail of at most max_size pixels a side, read from the smallest
+    level that is still as large and resized with INTER_AREA."""
+    level0_size = level_geometry(slide, 1)[1]
+    scale = max(max(level0_size) / max_size, 1)
+    level, size, _ = level_geometry(slide, scale)
+    thumbnail = read_region_np(slide, (0, 0), level, size)[:, :, :3]
+    thumbnail_size = (max(round(level0_size[0] / scale), 1), max(round(level0_size[1] / scale), 1))
+    if size != thumbnail_size:
+        thumbnail = cv2.resize(thumbnail, thumbnail_size, interpolation=cv2.INTER_AREA)
+    return thumbnail
+
+
+def stream_gray_mask(slide, mag_factor, tile_size: int = 2048):
+    """Grayscale of a mask slide at the mag_factor level, read tile by tile."""
+    level, (width, height), downsample = level_geometry(slide, mag_factor)
+    gray = np.zeros((height, width), dtype=np.uint8)
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            tile_w, tile_h = min(tile_size, width - x), min(tile_size, height - y)
+            tile = read_region_np(slide, (round(x * downsample), round(y * downsample)),
+                                  level, (tile_w, tile_h))
+            gray[y:y + tile_h, x:x + tile_w] = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+    return gray
+
+
+def compute_metadata(generator, wsi_full_size, mask_full_size=None, tile_size: int = 2048):
+    """Thumbnail, tissue and tumor masks, contours and bboxes of a slide at the
+    mag_factor level, as read_wsi + get_tissue_contours/get_tumor_contours + get_bbox.
+    The masks are built tile by tile (PatchGenerator.stream_tissue_mask), the
+    mag_factor level is never read at once."""
+    _, _, downsample = level_geometry(wsi_full_size, generator.mag_factor)
+    thumbnail = read_thumbnail(wsi_full_size)
+    halo = max(32, generator.close_kernel_size + generator.open_kernel_size)
+    tissue_mask = generator.stream_tissue_mask(wsi_full_size, tile_size, halo)
+    tissue_contours, _ = cv2.findContours(tissue_mask, cv2.RETR_EXTERNAL,
+                                          cv2.CHAIN_APPROX_SIMPLE)
+    metadata = {'thumbnail': thumbnail, 'tissue_mask': tissue_mask, 'downsample': downsample,
+                'tissue_contours': tissue_contours,
+                'tissue_bboxes': np.array(generator.get_bbox(tissue_contours)).reshape(-1, 4),
+                'tumor_mask': None, 'tumor_contours': (), 'tumor_bboxes': np.zeros((0, 4), dtype=int)}
+
+    if mask_full_size is not None:
+        tumor_mask = stream_gray_mask(mask_full_size, generator.mag_factor, tile_size)
+        tumor_contours, _ = cv2.findContours(tumor_mask, cv2.RETR_EXTERNAL,
+                                             cv2.CHAIN_APPROX_SIMPLE)
+        metadata.update(tumor_mask=tumor_mask, tumor_contours=tumor_contours,
+                        tumor_bboxes=np.array(generator.get_bbox(tumor_contours)).reshape(-1, 4))
+    return metadata
+
+
+class SlideMetadataCache:
+    """Per-slide cache of everything sampling needs before the first level 0
+    read: the downsampled RGB thumbnail, tissue and tumor masks, contours and
+    bounding boxes, stored as one compressed .npz per slide. Entries are keyed
+    by the identity of the slide (and mask) files and by the parameters the
+    masks depend on (mag_factor, color bounds, kernel sizes), so changing
+    patches_per_bbox or patch_size reuses them.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, generator, wsi_path, mask_path=None, is_camelyon17: bool = False):
+        s3_client = generator.get_s3_client() if any(
+            path and path.startswith('s3://') for path in (wsi_path, mask_path)) else None
+        # the tumor mask of an XML annotation depends on the labels it is read with
+        mask_labels = generator.annotation_labels(is_camelyon17) \
+            if mask_path is not None and mask_path.endswith('.xml') else None
+        description = json.dumps({
+            'version': CACHE_VERSION,
+            'wsi': file_identity(wsi_path, s3_client),
+            'mask': None if mask_path is None else file_identity(mask_path, s3_client),
+            'mask_labels': mask_labels,
+            'mag_factor': generator.mag_factor,
+            'lower_bound': np.asarray(generator.lower_bound).tolist(),
+            'upper_bound': np.asarray(generator.upper_bound).tolist(),
+            'close_kernel_size': generator.close_kernel_size,
+            'open_kernel_size': generator.open_kernel_size,
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def load(self, key):
+        if not os.path.isfile(self.path(key)):
+            return None
+        with np.load(self.path(key)) as data:
+            metadata = {name: data[name] for name in ('thumbnail', 'tissue_mask', 'tissue_bboxes',
+                                                       'tumor_bboxes')}
+            metadata['downsample'] = float(data['downsample'])
+            metadata['tissue_contours'] = unpack_contours(data['tissue_points'], data['tissue_lengths'])
+            metadata['tumor_contours'] = unpack_contours(data['tumor_points'], data['tumor_lengths'])
+            metadata['tumor_mask'] = data['tumor_mask'] if 'tumor_mask' in data else None
+        return metadata
+
+    def save(self, key, metadata):
+        arrays = {name: metadata[name] for name in ('thumbnail', 'tissue_mask', 'tissue_bboxes',
+                                                     'tumor_bboxes')}
+        arrays['downsample'] = np.array(metadata['downsample'])
+        arrays['tissue_points'], arrays['tissue_lengths'] = pack_contours(metadata['tissue_contours'])
+        arrays['tumor_points'], arrays['tumor_lengths'] = pack_contours(metadata['tumor_contours'])
+        if metadata['tumor_mask'] is not None:
+            arrays['tumor_mask'] = metadata['tumor_mask']
+        # write then rename, so an interrupted run never leaves a truncated entry
+        tmp_path = self.path(key) + f'.{os.getpid()}.tmp.npz'
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, self.path(key))
+
+    def get(self, generator, wsi_path, mask_path=None, wsi_full_size=None, mask_full_size=None,
+            is_camelyon17: bool = False):
+        """Metadata of a slide, computed (and stored) on a miss.
+
+        Args:
+            generator: PatchGenerator whose parameters the masks depend on.
+            wsi_path: Path of the WSI.
+            mask_path (optional): Path of its tumor mask (slide or XML annotation). Defaults to None.
+            wsi_full_size (optional): Opened WSI, opened with generator.open_slide if missing. Defaults to None.
+            mask_full_size (optional): Opened mask (e.g. a PolygonMask). Defaults to None.
+            is_camelyon17 (bool, optional): Labels of an XML mask_path (see open_annotation_mask). Defaults to False.
+
+        Returns:
+            Dictionary with thumbnail, tissue_mask, tumor_mask (None without mask),
+            tissue/tumor contours and bboxes and the downsample of the level
+        """
+        key = self.key(generator, wsi_path, mask_path, is_camelyon17)
+        metadata = self.load(key)
+        if metadata is not None:
+            return metadata
+
+        if wsi_full_size is None:
+            wsi_full_size = generator.open_slide(wsi_path)
+        if mask_full_size is None and mask_path is not None:
+            mask_full_size = generator.open_annotation_mask(mask_path, wsi_full_size, is_camelyon17) \
+                if mask_path.endswith('.xml') else generator.open_slide(mask_path)
+        metadata = compute_metadata(generator, wsi_full_size, mask_full_size)
+        self.save(key, metadata)
+        return metadata
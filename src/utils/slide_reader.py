@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from PIL import Image
+# Comes from ASAP library (PATH HAS TO BE DEFINED in the script the class is defined.)
+import multiresolutionimageinterface as mir  # type: ignore
+import os
+
+# Getting the openslide tools for windows
+# OPENSLIDE_PATH = r'D:\kuleuven\thesis\openslide-win64\bin'
+OPENSLIDE_PATH = os.path.join(
+    'D:', os.sep, 'kuleuven', 'thesis', 'openslide-win64-20171122', 'bin')
+if hasattr(os, 'add_dll_directory'):
+    # Python >= 3.8 on Windows
+    with os.add_dll_directory(OPENSLIDE_PATH):
+        import openslide  # type: ignore
+        # print(f'OpenSlide version: {openslide.__version__}')
+        print(f'OpenSlide library version: {openslide.__library_version__}')
+else:
+    import openslide  # type: ignore
+
+
+def level_geometry(slide, mag_factor):
+    """Level closest to mag_factor, its dimensions and its real downsample,
+    for both OpenSlide-like and ASAP slides."""
+    if hasattr(slide, 'level_dimensions'):
+        level = slide.get_best_level_for_downsample(mag_factor)
+        return level, tuple(slide.level_dimensions[level]), slide.level_downsamples[level]
+
+    level = slide.getBestLevelForDownSample(mag_factor)
+    return level, tuple(slide.getLevelDimensions(level)), slide.getLevelDownsample(level)
+
+
+def read_region_np(slide, location, level, size):
+    """Region of a slide as a NumPy array, location given in level 0
+    coordinates (OpenSlide convention)."""
+    if hasattr(slide, 'read_region_np'):
+        return slide.read_region_np(location, level, size)
+    if hasattr(slide, 'read_region'):
+        region = slide.read_region(location, level, size)
+        region_np = np.array(region)
+        region.close()
+        return region_np
+
+    return np.array(slide.getUCharPatch(startX=location[0], startY=location[1],
+                                        width=size[0], height=size[1], level=level))
+
+
+class TileCache:
+    """Byte-budgeted LRU cache of decoded tiles keyed by (slide, level, tile_x,
+    tile_y). One instance can be shared by several readers (WSI and mask) and
+    threads."""
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            if key in self.tiles:
+                return
+            self.tiles[key] = tile
+            self.bytes += tile.nbytes
+            while self.bytes > self.max_bytes and len(self.tiles) > 1:
+                _, evicted = self.tiles.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'tiles': len(self.tiles), 'bytes': self.bytes}
+
+
+class CachedSlideReader:
+    """OpenSlide-like reader over OpenSlide or ASAP (fallback) that serves
+    read_region from decoded tiles of a TileCache. Regions are always RGBA.
+    Level locations are location // downsample, exact for power of two pyramids.
+    """
+
+    def __init__(self, path, cache: Optional[TileCache] = None, tile_size: Optional[int] = None):
+        self.path = path
+        self.cache = cache if cache is not None else TileCache()
+        try:
+            self.slide = openslide.OpenSlide(path)
+            self.level_dimensions = tuple(self.slide.level_dimensions)
+            self.level_downsamples = tuple(self.slide.level_downsamples)
+            self.properties = dict(self.slide.properties)
+        except openslide.OpenSlideError:
+            print(f'Openslide extraction failed. Trying with ASAP...')
+            self.slide = mir.MultiResolutionImageReader().open(path)
+            levels = range(self.slide.getNumberOfLevels())
+            self.level_dimensions = tuple(tuple(self.slide.getLevelDimensions(level))
+                                          for level in levels)
+            self.level_downsamples = tuple(self.slide.getLevelDownsample(level)
+                                           for level in levels)
+            self.properties = {}
+        self.dimensions = self.level_dimensions[0]
+        self.tile_size = tile_size or int(self.properties.get(
+            'openslide.level[0].tile-width', 512))
+
+    @property
+    def level_count(self):
+        return len(self.level_dimensions)
+
+    def get_best_level_for_downsample(self, downsample):
+        # same rule as OpenSlide: largest level whose downsample is <= the requested one
+        candidates = [level for level, level_downsample in enumerate(self.level_downsamples)
+                      if level_downsample <= downsample]
+        return max(candidates) if candidates else 0
+
+    def _read_tile(self, level, tile_x, tile_y):
+        key = (self.path, level, tile_x, tile_y)
+        tile = self.cache.get(key)
+        if tile is None:
+            downsample = self.level_downsamples[level]
+            location = (round(tile_x * self.tile_size * downsample),
+                        round(tile_y * self.tile_size * downsample))
+            size = (self.tile_size, self.tile_size)
+            tile = read_region_np(self.slide, location, level, size)
+            if tile.shape[2] == 3:
+                # ASAP patches have no alpha channel
+                tile = np.dstack(
+                    [tile, np.full(tile.shape[:2], 255, dtype=np.uint8)])
+            self.cache.put(key, tile)
+        return tile
+
+    def read_region_np(self, location, level, size):
+        downsample = self.level_downsamples[level]
+        x0, y0 = int(location[0] // downsample), int(location[1] // downsample)
+        width, height = size
+        region = np.empty((height, width, 4), dtype=np.uint8)
+
+        for tile_y in range(y0 // self.tile_size, (y0 + height - 1) // self.tile_size + 1):
+            for tile_x in range(x0 // self.tile_size, (x0 + width - 1) // self.tile_size + 1):
+                tile = self._read_tile(level, tile_x, tile_y)
+                # overlap between the tile and the requested region, in level coordinates
+                left = max(x0, tile_x * self.tile_size)
+                top = max(y0, tile_y * self.tile_size)
+                right = min(x0 + width, (tile_x + 1) * self.tile_size)
+                bottom = min(y0 + height, (tile_y + 1) * self.tile_size)
+                region[top - y0:bottom - y0, left - x0:right - x0] = tile[
+                    top - tile_y * self.tile_size:bottom - tile_y * self.tile_size,
+                    left - tile_x * self.tile_size:right - tile_x * self.tile_size]
+
+        return region
+
+    def read_region(self, location, level, size):
+        return Image.fromarray(self.read_region_np(location, level, size))
+
+    def close(self):
+        if hasattr(self.slide, 'close'):
+            self.slide.close()
@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+
+class SpatialHash:
+    """Minimum spacing between the patches sampled from one slide, Poisson-disk
+    style. Accepted level 0 windows are hashed into a grid of patch_size cells;
+    a window can only overlap windows whose origin is in its own or one of the 8
+    neighbouring cells, and the spacing bounds how many windows a cell holds, so
+    every check is O(1) and runs before any read_region.
+    """
+
+    def __init__(self, patch_size: int, max_overlap: float = 0.5):
+        self.patch_size = patch_size
+        # largest overlap (fraction of the patch area) allowed with an accepted patch,
+        # identical windows are always rejected
+        self.max_overlap = max_overlap
+        self.cells = defaultdict(list)
+        self.checks = 0
+        self.duplicates = 0
+
+    def overlap(self, location):
+        """Largest overlap fraction of a window with the accepted ones."""
+        x, y = location
+        cell_x, cell_y = x // self.patch_size, y // self.patch_size
+        area = self.patch_size * self.patch_size
+        largest = 0.0
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for other_x, other_y in self.cells.get((cell_x + dx, cell_y + dy), ()):
+                    width = self.patch_size - abs(x - other_x)
+                    height = self.patch_size - abs(y - other_y)
+                    if width > 0 and height > 0:
+                        largest = max(largest, width * height / area)
+        return largest
+
+    def too_close(self, overlap):
+        return overlap >= 1 or overlap > self.max_overlap
+
+    def accepts(self, location):
+        """True if the window respects the spacing (counted in the duplicate rate)."""
+        self.checks += 1
+        if self.too_close(self.overlap(location)):
+            self.duplicates += 1
+            return False
+        return True
+
+    def filter(self, locations):
+        """Locations that respect the spacing with the accepted windows and with
+        the earlier locations of the list, for a batch that is read before any
+        of it is added (counted in the duplicate rate)."""
+        batch = SpatialHash(self.patch_size, self.max_overlap)
+        kept = []
+        for location in locations:
+            self.checks += 1
+            if self.too_close(max(self.overlap(location), batch.overlap(location))):
+                self.duplicates += 1
+                continue
+            batch.add(location)
+            kept.append(location)
+        return kept
+
+    def add(self, location):
+        x, y = location
+        self.cells[(x // self.patch_size, y // self.patch_size)].append((x, y))
+
+    @property
+    def duplicate_rate(self):
+        return self.duplicates / self.checks if self.checks else 0.0
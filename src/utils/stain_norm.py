@@ -0,0 +1,290 @@
+import hashlib
+import os
+import cv2
+import h5py
+import numpy as np
+import torch
+import torchstain
+from torch.utils.data import default_collate
+
+# sRGB (D65) <-> XYZ, as in skimage / torchstain
+RGB2XYZ = torch.tensor([[0.412453, 0.357580, 0.180423],
+                        [0.212671, 0.715160, 0.072169],
+                        [0.019334, 0.119193, 0.950227]])
+XYZ2RGB = torch.linalg.inv(RGB2XYZ)
+WHITE = torch.tensor([0.95047, 1., 1.08883])
+
+# attributes holding the fitted reference of each torchstain normalizer
+REFERENCE_PARAMS = {'macenko': ('HERef', 'maxCRef'),
+                    'reinhard': ('target_means', 'target_stds')}
+
+
+def kth_percentile(t, q, dim=-1):
+    """torchstain's percentile (k = 1 + round(q% of n - 1)) along one dimension."""
+    k = 1 + round(.01 * float(q) * (t.shape[dim] - 1))
+    return t.kthvalue(k, dim=dim).values
+
+
+def masked_percentile(t, mask, q):
+    """Same percentile over the True entries of every row of a (N, P) tensor."""
+    counts = mask.sum(dim=1).double()
+    k = 1 + torch.round(.01 * float(q) * (counts - 1)).long()
+    ordered = torch.where(mask, t, torch.full_like(t, float('inf'))).sort(dim=1).values
+    return ordered.gather(1, (k - 1).clamp(min=0).unsqueeze(1)).squeeze(1)
+
+
+def pool_pixels(images):
+    """One (C, H, W) image, or the pixels of several images as a (C, 1, P) one."""
+    if torch.is_tensor(images) and images.dim() == 3:
+        return images
+    return torch.cat([image.reshape(image.shape[0], 1, -1) for image in images], dim=2)
+
+
+def rgb2lab(rgb):
+    """(N, 3, H, W) RGB in [0, 1] to CIE L*a*b*."""
+    rgb = torch.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = torch.einsum('ij,njhw->nihw', RGB2XYZ.to(rgb), rgb)
+    xyz = xyz / WHITE.to(rgb).view(1, 3, 1, 1)
+    xyz = torch.where(xyz > 0.008856, xyz.clamp(min=0) ** (1 / 3), 7.787 * xyz + 16 / 116)
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    return torch.stack([116. * y - 16., 500. * (x - y), 200. * (y - z)], dim=1)
+
+
+def lab2rgb(lab):
+    """(N, 3, H, W) CIE L*a*b* to RGB in [0, 1]."""
+    y = (lab[:, 0] + 16.) / 116.
+    x = lab[:, 1] / 500. + y
+    z = (y - lab[:, 2] / 200.).clamp(min=0)
+    xyz = torch.stack([x, y, z], dim=1)
+    xyz = torch.where(xyz > 0.2068966, xyz ** 3, (xyz - 16. / 116.) / 7.787)
+    xyz = xyz * WHITE.to(lab).view(1, 3, 1, 1)
+    rgb = torch.einsum('ij,njhw->nihw', XYZ2RGB.to(lab), xyz)
+    rgb = torch.where(rgb > 0.0031308, 1.055 * rgb.clamp(min=0) ** (1 / 2.4) - 0.055, rgb * 12.92)
+    return rgb.clamp(0, 1)
+
+
+class BatchMacenkoNormalizer:
+    """Macenko normalization of a whole (N, C, H, W) batch with values in [0, 255],
+    following torchstain's TorchMacenkoNormalizer: batched OD conversion, masked
+    covariance + eigh for the stain vectors and one batched lstsq for the
+    concentrations. normalize returns (N, C, H, W) int tensors, i.e. what
+    PCAMDataset gives per image after get_normalization and permute.
+    """
+
+    def __init__(self, Io=240, alpha=1, beta=0.15):
+        self.Io = Io
+        self.alpha = alpha
+        self.beta = beta
+        self.HERef = torch.tensor([[0.5626, 0.2159],
+                                   [0.7201, 0.8012],
+                                   [0.4062, 0.5581]])
+        self.maxCRef = torch.tensor([1.9705, 1.0308])
+
+    @classmethod
+    def from_normalizer(cls, normalizer):
+        """Batch normalizer with the reference of a fitted torchstain normalizer."""
+        batch_normalizer = cls()
+        batch_normalizer.HERef = normalizer.HERef.clone()
+        batch_normalizer.maxCRef = normalizer.maxCRef.clone()
+        return batch_normalizer
+
+    def to(self, device):
+        self.HERef = self.HERef.to(device)
+        self.maxCRef = self.maxCRef.to(device)
+        return self
+
+    def compute_matrices(self, batch):
+        n, c, h, w = batch.shape
+        OD = -torch.log((batch.permute(0, 2, 3, 1).reshape(n, -1, c).float() + 1) / self.Io)
+        # pixels with enough optical density in every channel estimate the stains
+        valid = ~torch.any(OD < self.beta, dim=2)
+        weights = valid.float().unsqueeze(2)
+        counts = weights.sum(dim=1)
+
+        mean = (OD * weights).sum(dim=1) / counts
+        centered = (OD - mean.unsqueeze(1)) * weights
+        cov = centered.transpose(1, 2) @ centered / (counts - 1).unsqueeze(2)
+        _, eigvecs = torch.linalg.eigh(cov)
+        eigvecs = eigvecs[:, :, [1, 2]]
+
+        That = OD @ eigvecs
+        phi = torch.atan2(That[:, :, 1], That[:, :, 0])
+        min_phi = masked_percentile(phi, valid, self.alpha)
+        max_phi = masked_percentile(phi, valid, 100 - self.alpha)
+        v_min = eigvecs @ torch.stack((torch.cos(min_phi), torch.sin(min_phi)), dim=1).unsqueeze(2)
+        v_max = eigvecs @ torch.stack((torch.cos(max_phi), torch.sin(max_phi)), dim=1).unsqueeze(2)
+        HE = torch.where((v_min[:, 0, 0] > v_max[:, 0, 0]).view(-1, 1, 1),
+                         torch.cat((v_min, v_max), dim=2), torch.cat((v_max, v_min), dim=2))
+
+        C = torch.linalg.lstsq(HE, OD.transpose(1, 2)).solution
+        maxC = torch.stack([kth_percentile(C[:, 0, :], 99),
+                            kth_percentile(C[:, 1, :], 99)], dim=1)
+        return HE, C, maxC
+
+    def fit(self, images):
+        """Fits the reference on one (C, H, W) image, or on the pixels of a
+        list / (N, C, H, W) stack of reference images taken together."""
+        images = pool_pixels(images)
+        HE, _, maxC = self.compute_matrices(images.unsqueeze(0))
+        self.HERef = HE[0]
+        self.maxCRef = maxC[0]
+
+    def normalize(self, batch):
+        n, c, h, w = batch.shape
+        _, C, maxC = self.compute_matrices(batch)
+        C = C * (self.maxCRef.to(C) / maxC).unsqueeze(2)
+        Inorm = self.Io * torch.exp(-self.HERef.to(C) @ C)
+        Inorm = Inorm.clamp(max=255)
+        return Inorm.reshape(n, c, h, w).int()
+
+    __call__ = normalize
+
+
+class BatchReinhardNormalizer:
+    """Reinhard normalization of a whole (N, C, H, W) batch with values in
+    [0, 255]: per image LAB means/stds are mapped onto the target ones.
+    normalize returns (N, C, H, W) floats in [0, 1], like PCAMDataset per image.
+    """
+
+    def __init__(self):
+        self.target_means = None
+        self.target_stds = None
+
+    @classmethod
+    def from_normalizer(cls, normalizer):
+        batch_normalizer = cls()
+        batch_normalizer.target_means = torch.as_tensor(normalizer.target_means).clone()
+        batch_normalizer.target_stds = torch.as_tensor(normalizer.target_stds).clone()
+        return batch_normalizer
+
+    def to(self, device):
+        self.target_means = self.target_means.to(device)
+        self.target_stds = self.target_stds.to(device)
+        return self
+
+    def fit(self, images):
+        """Fits the target on one (C, H, W) image or on a list / (N, C, H, W) stack taken together."""
+        images = pool_pixels(images)
+        lab = rgb2lab(images.unsqueeze(0).float() / 255)[0]
+        self.target_means = lab.mean(dim=(1, 2))
+        self.target_stds = lab.std(dim=(1, 2))
+
+    def normalize(self, batch):
+        lab = rgb2lab(batch.float() / 255)
+        means = lab.mean(dim=(2, 3), keepdim=True)
+        stds = lab.std(dim=(2, 3), keepdim=True)
+        lab = (lab - means) / stds * self.target_stds.to(lab).view(1, 3, 1, 1) \
+            + self.target_means.to(lab).view(1, 3, 1, 1)
+        # same uint8 rounding as the per image normalizer
+        return (lab2rgb(lab) * 255).type(torch.uint8).float() / 255.0
+
+    __call__ = normalize
+
+
+def fit_reference(images, method):
+    """Fitted reference of a stain normalizer for one or more (C, H, W) images
+    in [0, 255]. A single image is fitted by torchstain itself (same reference
+    as before caching), several images are pooled by the batched normalizers.
+
+    Returns:
+        params (dict): HERef/maxCRef for macenko, target_means/target_stds for reinhard.
+    """
+    if len(images) == 1:
+        if method == 'macenko':
+            normalizer = torchstain.normalizers.MacenkoNormalizer(backend='torch')
+        else:
+            normalizer = torchstain.normalizers.ReinhardNormalizer(backend='torch')
+        normalizer.fit(images[0])
+    else:
+        normalizer = BatchMacenkoNormalizer() if method == 'macenko' else BatchReinhardNormalizer()
+        normalizer.fit(images)
+    return {name: torch.as_tensor(getattr(normalizer, name)) for name in REFERENCE_PARAMS[method]}
+
+
+def make_batch_normalizer(method, reference):
+    """Batched normalizer of the given method with a fitted reference (see fit_reference)."""
+    if method not in REFERENCE_PARAMS:
+        raise ValueError(f'Unknown stain normalization {method!r}, expected one of {list(REFERENCE_PARAMS)}.')
+    normalizer = BatchMacenkoNormalizer() if method == 'macenko' else BatchReinhardNormalizer()
+    for name in REFERENCE_PARAMS[method]:
+        setattr(normalizer, name, torch.as_tensor(reference[name]).clone())
+    return normalizer
+
+
+def load_or_fit_reference(target_paths, method, transform, cache_dir=None, cache_key=None):
+    """Fitted reference for the given target images, loaded from a small .pt
+    artifact keyed by the hash of the method and of the transformed images the
+    reference is fitted on (their bytes, shape and dtype), or fitted and saved
+    there on the first call. Only the fit is skipped on a hit, the images are
+    still read and transformed to compute the key.
+
+    Args:
+        target_paths: Path or list of paths of the reference images.
+        method: 'macenko' or 'reinhard'.
+        transform: Transform applied to the RGB images before fitting.
+        cache_dir (optional): Folder of the artifacts. Defaults to the folder of the first target.
+        cache_key (optional): Name of the artifact, used instead of the hash (the caller
+            guarantees it changes with the targets and the transform). Defaults to None.
+
+    Returns:
+        params (dict): See fit_reference.
+    """
+    if method not in REFERENCE_PARAMS:
+        raise ValueError(f'Unknown stain normalization {method!r}, expected one of {list(REFERENCE_PARAMS)}.')
+    if isinstance(target_paths, str):
+        target_paths = [target_paths]
+    cache_dir = cache_dir or os.path.dirname(target_paths[0])
+
+    images = None
+    if cache_key is None:
+        images = [transform(cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)) for path in target_paths]
+        sha = hashlib.sha256(method.encode())
+        # what is fitted, whatever the transform is (its repr is not stable across runs)
+        for image in images:
+            array = np.ascontiguousarray(torch.as_tensor(image).detach().cpu().numpy())
+            sha.update(f'{array.shape}{array.dtype}'.encode())
+            sha.update(array.tobytes())
+        cache_key = sha.hexdigest()[:16]
+    artifact_path = os.path.join(cache_dir, f'stain_{method}_{cache_key}.pt')
+    if os.path.isfile(artifact_path):
+        return torch.load(artifact_path)
+
+    if images is None:
+        images = [transform(cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)) for path in target_paths]
+    params = fit_reference(images, method)
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.save(params, artifact_path + '.tmp')
+    os.replace(artifact_path + '.tmp', artifact_path)
+    return params
+
+
+class StainNormalizeCollate:
+    """collate_fn normalizing the collated images of a batch at once. Use with a
+    PCAMDataset built without normalize (the transform still applies per image)."""
+
+    def __init__(self, normalizer):
+        self.normalizer = normalizer
+
+    def __call__(self, samples):
+        batch = default_collate(samples)
+        if isinstance(batch, (list, tuple)):
+            return [self.normalizer(batch[0])] + list(batch[1:])
+        return self.normalizer(batch)
+
+
+def normalize_hdf5(src_path, dst_path, normalizer, batch_size=512):
+    """Writes a stain normalized copy of a PCam-layout HDF5 file (x as uint8,
+    y copied when present), so training can read normalized images directly."""
+    with h5py.File(src_path, 'r') as src, h5py.File(dst_path, 'w') as dst:
+        images = src['x']
+        out = dst.create_dataset('x', shape=images.shape, dtype=np.uint8,
+                                 chunks=images.chunks, compression=images.compression)
+        for start in range(0, len(images), batch_size):
+            batch = torch.from_numpy(images[start:start + batch_size]).permute(0, 3, 1, 2).float()
+            normalized = normalizer(batch).float()
+            if isinstance(normalizer, BatchReinhardNormalizer):
+                normalized = normalized * 255
+            out[start:start + len(batch)] = normalized.round().clamp(0, 255) \
+                .permute(0, 2, 3, 1).to(torch.uint8).numpy()
+        if 'y' in src:
+            src.copy('y', dst)
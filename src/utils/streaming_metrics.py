@@ -0,0 +1,60 @@
+import torch
+
+
+class StreamingBinaryMetrics:
+    """Binary classification metrics accumulated batch by batch in two fixed-size
+    histograms of the predicted probabilities (one per class), so memory does not
+    depend on the number of predictions. Thresholds are the bin edges i / num_bins;
+    AUC is exact up to ties inside a bin (counted as half).
+    """
+
+    def __init__(self, num_bins: int = 1000, device=torch.device('cpu')):
+        # even, so that 0.5 is a bin edge and the 0.5 metrics are exact
+        assert num_bins % 2 == 0
+        self.num_bins = num_bins
+        self.positives = torch.zeros(num_bins, dtype=torch.long, device=device)
+        self.negatives = torch.zeros(num_bins, dtype=torch.long, device=device)
+
+    def update(self, predictions, labels):
+        """Adds a batch of probabilities in [0, 1] and their 0/1 labels."""
+        predictions = predictions.reshape(-1)
+        labels = labels.reshape(-1).to(predictions.device).bool()
+        bins = (predictions * self.num_bins).long().clamp(0, self.num_bins - 1)
+        self.positives += torch.bincount(bins[labels], minlength=self.num_bins).to(self.positives.device)
+        self.negatives += torch.bincount(bins[~labels], minlength=self.num_bins).to(self.negatives.device)
+
+    def curves(self):
+        """True/false positives when predicting positive from each threshold i / num_bins
+        (i = 0..num_bins), as float64 tensors."""
+        zero = torch.zeros(1, dtype=torch.float64, device=self.positives.device)
+        tp = torch.cat([self.positives.double().flip(0).cumsum(0).flip(0), zero])
+        fp = torch.cat([self.negatives.double().flip(0).cumsum(0).flip(0), zero])
+        return tp, fp
+
+    def compute(self):
+        """Accuracy and F1 at 0.5, AUC, and the threshold sweep (accuracy/F1 per
+        threshold, best F1 and its threshold).
+
+        Returns:
+            A dict of floats, plus the sweep as lists
+        """
+        tp, fp = self.curves()
+        num_pos, num_neg = tp[0], fp[0]
+        fn = num_pos - tp
+        tn = num_neg - fp
+        accuracy = (tp + tn) / (num_pos + num_neg)
+        f1 = 2 * tp / (2 * tp + fp + fn).clamp(min=1)
+
+        # ROC points go from (1, 1) at threshold 0 to (0, 0), integrate with trapezoids
+        tpr = tp / num_pos.clamp(min=1)
+        fpr = fp / num_neg.clamp(min=1)
+        auc = ((fpr[:-1] - fpr[1:]) * (tpr[:-1] + tpr[1:]) / 2).sum()
+
+        thresholds = torch.arange(self.num_bins + 1, dtype=torch.float64) / self.num_bins
+        half = self.num_bins // 2
+        best = int(f1.argmax())
+        return {'accuracy': float(accuracy[half]), 'f1': float(f1[half]), 'auc': float(auc),
+                'best_f1': float(f1[best]), 'best_threshold': float(thresholds[best]),
+                'num_samples': int(num_pos + num_neg),
+                'thresholds': thresholds.tolist(), 'accuracy_sweep': accuracy.cpu().tolist(),
+                'f1_sweep': f1.cpu().tolist()}
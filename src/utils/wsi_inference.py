@@ -0,0 +1,184 @@
+import os
+import queue
+import threading
+import time
+from contextlib import closing
+from typing import Optional
+import numpy as np
+import torch
+from utils.patch_scoring import window_fractions
+from utils.region_reader import BatchedRegionReader
+from utils.slide_reader import level_geometry
+
+_END = object()
+
+
+class WSIInference:
+    """Runs a patch classifier over a whole slide and writes a tumor probability
+    heatmap. The tissue mask of the PatchGenerator picks the tiles of a stride
+    grid worth reading; a prefetching thread reads them in batches
+    (BatchedRegionReader) while the model runs on the previous batch, and every
+    tile fills one pixel of the heatmap (one pixel per stride level 0 pixels).
+    """
+
+    def __init__(self, generator, model, device, stride: Optional[int] = None, batch_size: int = 64,
+                 tissue_threshold: float = 0.1, transform=None, prefetch: int = 4,
+                 autocast_dtype=None):
+        self.generator = generator
+        self.model = model
+        self.device = device
+        self.patch_size = generator.patch_size
+        self.stride = stride or generator.patch_size
+        self.batch_size = batch_size
+        # minimum tissue fraction of the tile window, other tiles are skipped
+        self.tissue_threshold = tissue_threshold
+        # applied to the (B, 3, H, W) float batch in [0, 1], e.g. transforms.Normalize
+        self.transform = transform
+        # batches read ahead of the model, 0 reads synchronously
+        self.prefetch = prefetch
+        self.autocast_dtype = autocast_dtype
+
+    def tile_grid(self, tissue_mask, level0_size):
+        """Tiles of the stride grid with enough tissue. Every tile is a patch_size
+        window centered on its grid cell.
+
+        Returns:
+            grid_shape: (rows, cols) of the heatmap
+            cells: (N, 2) array of the (row, col) of every tile
+            locations: List of the level 0 (x, y) of every tile window
+        """
+        cols = level0_size[0] // self.stride
+        rows = level0_size[1] // self.stride
+        downsample = level0_size[0] / tissue_mask.shape[1]
+        cells = np.stack(np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij'), -1).reshape(-1, 2)
+
+        offset = (self.stride - self.patch_size) // 2
+        x = np.clip(cells[:, 1] * self.stride + offset, 0, level0_size[0] - self.patch_size)
+        y = np.clip(cells[:, 0] * self.stride + offset, 0, level0_size[1] - self.patch_size)
+
+        # windows in downsampled mask pixels, at least one pixel wide
+        height, width = tissue_mask.shape[:2]
+        mx0 = np.minimum((x / downsample).astype(int), width - 1)
+        my0 = np.minimum((y / downsample).astype(int), height - 1)
+        mx1 = np.clip(np.ceil((x + self.patch_size) / downsample).astype(int), mx0 + 1, width)
+        my1 = np.clip(np.ceil((y + self.patch_size) / downsample).astype(int), my0 + 1, height)
+        fractions = window_fractions(tissue_mask, np.stack([mx0, my0, mx1 - mx0, my1 - my0], -1))
+
+        keep = fractions >= self.tissue_threshold
+        return (rows, cols), cells[keep], list(zip(x[keep].tolist(), y[keep].tolist()))
+
+    def batches(self, reader, cells, locations):
+        size = (self.patch_size, self.patch_size)
+        for start in range(0, len(locations), self.batch_size):
+            patches = reader.read(locations[start:start + self.batch_size], size)
+            yield cells[start:start + self.batch_size], np.stack([patch[:, :, :3] for patch in patches])
+
+    def prefetched(self, batches, timeout: float = 0.1):
+        """Runs the batches generator in a thread, at most prefetch batches ahead.
+        The thread stops as soon as the consumer does (exception or early exit)
+        and is joined before returning, errors of the reads are raised here."""
+        if self.prefetch <= 0:
+            yield from batches
+            return
+
+        buffer = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # a full buffer nobody reads any more must not block the thread forever
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=timeout)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+            else:
+                put(_END)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def predict(self, patches):
+        """Tumor probability of a (B, H, W, 3) uint8 batch. The model either
+        outputs probabilities ((B,) or (B, 1), e.g. ending with the MLP sigmoid)
+        or two class logits (B, 2)."""
+        images = torch.from_numpy(patches).to(self.device).permute(0, 3, 1, 2).float() / 255
+        if self.transform is not None:
+            images = self.transform(images)
+        with torch.autocast(self.device.type, dtype=self.autocast_dtype,
+                            enabled=self.autocast_dtype is not None):
+            output = self.model(images)
+        if output.dim() == 2 and output.shape[1] == 2:
+            output = torch.softmax(output.float(), dim=1)[:, 1]
+        return output.float().reshape(-1).cpu().numpy()
+
+    def run(self, wsi_path, out_path):
+        """Writes the heatmap of one slide.
+
+        Args:
+            wsi_path: Path of the WSI.
+            out_path: Path of the .npy heatmap (float32, rows x cols of the stride
+                grid, 0 where no tile was read).
+
+        Returns:
+            summary: Dictionary with tiles, grid shape, timings and tiles/sec.
+        """
+        start = time.perf_counter()
+        slide, tissue_mask, _ = self.generator.read_tissue_mask(wsi_path)
+        try:
+            level0_size = level_geometry(slide, 1)[1]
+            grid_shape, cells, locations = self.tile_grid(tissue_mask, level0_size)
+            heatmap = np.zeros(grid_shape, dtype=np.float32)
+            mask_seconds = time.perf_counter() - start
+
+            self.model.eval()
+            reader = BatchedRegionReader(slide)
+            inference_seconds = 0.0
+            # closed right away if the model fails, which stops the prefetching thread
+            with torch.inference_mode(), closing(self.prefetched(self.batches(reader, cells, locations))) as batches:
+                for batch_cells, patches in batches:
+                    inference_start = time.perf_counter()
+                    heatmap[batch_cells[:, 0], batch_cells[:, 1]] = self.predict(patches)
+                    inference_seconds += time.perf_counter() - inference_start
+        finally:
+            if hasattr(slide, 'close'):
+                slide.close()
+
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        np.save(out_path, heatmap)
+        seconds = time.perf_counter() - start
+        tiles_per_sec = len(locations) / max(seconds - mask_seconds, 1e-9)
+        print(f'{len(locations)} tiles of {wsi_path} in {seconds:.2f}s ({tiles_per_sec:.1f} tiles/s, '
+              f'read {reader.stats["seconds"]:.2f}s, model {inference_seconds:.2f}s), heatmap {out_path}.')
+        return {'tiles': len(locations), 'grid_shape': grid_shape, 'heatmap_path': out_path,
+                'mask_seconds': mask_seconds, 'read_seconds': reader.stats['seconds'],
+                'inference_seconds': inference_seconds, 'seconds': seconds,
+                'tiles_per_sec': tiles_per_sec}
+
+    def run_slides(self, wsi_paths, out_dir):
+        """Heatmaps of several slides, written as out_dir/<slide name>_heatmap.npy."""
+        summaries = []
+        for wsi_path in wsi_paths:
+            name = os.path.splitext(os.path.basename(wsi_path))[0]
+            summaries.append(self.run(wsi_path, os.path.join(out_dir, f'{name}_heatmap.npy')))
+        return summaries